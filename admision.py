@@ -0,0 +1,76 @@
+"""
+Control de admisión
+Rechaza trabajo nuevo en cuanto se alcanza un límite, en vez de encolarlo y
+dejar que el cliente se entere por timeout
+"""
+
+import threading
+from collections import Counter
+
+# Límites por defecto (0 = sin límite)
+MAX_COLA = 10000          # entradas esperando en el planificador
+MAX_PENDIENTES = 100000   # tareas admitidas y todavía sin responder
+MAX_POR_CLIENTE = 10000   # tareas sin responder de una misma dirección IP
+
+# Rango del tiempo sugerido al cliente antes de reintentar (segundos)
+REINTENTO_MINIMO = 0.05
+REINTENTO_MAXIMO = 5.0
+# Sugerencia cuando todavía no hay respuestas recientes para medir el ritmo
+REINTENTO_SIN_DATOS = 1.0
+
+
+class ControlAdmision:
+    """Cuenta el trabajo admitido y decide si se acepta más"""
+
+    def __init__(self, max_cola=MAX_COLA, max_pendientes=MAX_PENDIENTES,
+                 max_por_cliente=MAX_POR_CLIENTE):
+        self.max_cola = max_cola
+        self.max_pendientes = max_pendientes
+        self.max_por_cliente = max_por_cliente
+
+        self.pendientes = 0
+        self.por_cliente = Counter()
+        self.lock = threading.Lock()
+
+        self.admitidas = 0
+        self.rechazadas = Counter()
+
+    def admitir(self, origen, unidades, en_cola):
+        """Reserva `unidades` tareas para el cliente `origen`.
+        Retorna None si se admiten, o el motivo del rechazo"""
+        with self.lock:
+            # Un pedido más grande que el límite pasa si no hay nada pendiente
+            if self.max_cola and en_cola >= self.max_cola:
+                motivo = 'cola llena'
+            elif (self.max_pendientes and self.pendientes and
+                  self.pendientes + unidades > self.max_pendientes):
+                motivo = 'demasiadas tareas pendientes'
+            elif (self.max_por_cliente and self.por_cliente[origen] and
+                  self.por_cliente[origen] + unidades > self.max_por_cliente):
+                motivo = 'demasiadas tareas del cliente'
+            else:
+                self.pendientes += unidades
+                self.por_cliente[origen] += unidades
+                self.admitidas += 1
+                return None
+
+            self.rechazadas[motivo] += 1
+            return motivo
+
+    def liberar(self, origen, unidades):
+        """Devuelve las unidades de un pedido ya respondido"""
+        with self.lock:
+            self.pendientes -= unidades
+            self.por_cliente[origen] -= unidades
+            if self.por_cliente[origen] <= 0:
+                del self.por_cliente[origen]
+
+    def estadisticas(self):
+        """Trabajo pendiente y contadores de admisión"""
+        with self.lock:
+            return {
+                'pendientes': self.pendientes,
+                'clientes': len(self.por_cliente),
+                'admitidas': self.admitidas,
+                'rechazadas': dict(self.rechazadas),
+            }
@@ -0,0 +1,168 @@
+"""
+Almacén de resultados de las tareas enviadas con ticket
+El servidor responde con el ticket apenas la acepta y el resultado queda aquí
+hasta que vence: el cliente lo retira cuando quiere, en bloque por ticket, o se
+suscribe para recibirlo apenas llega. El ticket es un token al azar, no el ID
+de la tarea: quien no lo recibió no puede leer el resultado de otro cliente
+"""
+
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Segundos que vive un resultado y que puede tardar una tarea con ticket
+TTL_RESULTADOS = 300
+MAX_BYTES_RESULTADOS = 64 * 1024 * 1024
+# Bytes al azar de cada ticket (22 caracteres en base64)
+BYTES_TICKET = 16
+
+
+def tamano_resultado(resultado):
+    """Bytes estimados que ocupa un resultado en memoria"""
+    return sys.getsizeof(resultado.get('resultado')) + 256
+
+
+def respuesta_pendiente(ticket):
+    """Respuesta de un ticket aceptado que todavía no tiene resultado"""
+    return {'ticket': ticket, 'estado': 'pendiente'}
+
+
+def respuesta_desconocida(ticket):
+    """Respuesta de un ticket que no existe o cuyo resultado ya venció"""
+    return {'ticket': ticket, 'estado': 'desconocido',
+            'error': 'Ticket desconocido o con el resultado ya vencido'}
+
+
+class AlmacenResultados:
+    """Resultados por ticket con TTL y límite de memoria; thread-safe. Todos
+    viven lo mismo, así que el orden de llegada es también el de vencimiento
+    y, con el almacén lleno, se desalojan los más viejos"""
+
+    def __init__(self, max_bytes=MAX_BYTES_RESULTADOS, ttl=TTL_RESULTADOS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # Tickets aceptados sin resultado todavía, y el de cada tarea
+        self.pendientes = set()
+        self.tickets = {}
+        # ticket -> (resultado, vence, tamaño), en orden de llegada
+        self.resultados = OrderedDict()
+        self.bytes_usados = 0
+        # ticket -> funciones que reciben el resultado apenas llegue
+        self.suscriptores = {}
+        self.lock = threading.Lock()
+
+        self.guardados = 0
+        self.desalojados = 0
+        self.vencidos = 0
+
+    def abrir(self, tarea_id, ticket=None):
+        """Registra una tarea aceptada cuyo resultado todavía no llegó y
+        retorna su ticket: uno nuevo, salvo que se pase el que ya tenía"""
+        ticket = ticket or secrets.token_urlsafe(BYTES_TICKET)
+        with self.lock:
+            self.pendientes.add(ticket)
+            self.tickets[tarea_id] = ticket
+        return ticket
+
+    def guardar(self, resultado):
+        """Guarda el resultado de una tarea abierta con su ticket y se lo pasa a
+        sus suscriptores (también si no entra en el almacén)"""
+        tamano = tamano_resultado(resultado)
+        with self.lock:
+            ticket = self.tickets.pop(resultado['id'], None)
+            if ticket is None:
+                return
+            resultado = dict(resultado, ticket=ticket)
+            self.pendientes.discard(ticket)
+            avisos = self.suscriptores.pop(ticket, ())
+            self.guardados += 1
+            self.quitar(ticket)
+            if tamano <= self.max_bytes:
+                self.resultados[ticket] = (resultado, time.monotonic() + self.ttl, tamano)
+                self.bytes_usados += tamano
+            self.purgar_vencidos()
+            while self.bytes_usados > self.max_bytes:
+                _, (_, _, tamano) = self.resultados.popitem(last=False)
+                self.bytes_usados -= tamano
+                self.desalojados += 1
+
+        for avisar in avisos:
+            avisar(resultado)
+
+    def quitar(self, ticket):
+        """Elimina un resultado guardado (con el lock tomado)"""
+        entrada = self.resultados.pop(ticket, None)
+        if entrada is not None:
+            self.bytes_usados -= entrada[2]
+
+    def purgar_vencidos(self):
+        """Descarta los resultados que pasaron su TTL (con el lock tomado)"""
+        ahora = time.monotonic()
+        while self.resultados:
+            ticket, (_, vence, _) = next(iter(self.resultados.items()))
+            if vence > ahora:
+                return
+            self.quitar(ticket)
+            self.vencidos += 1
+
+    def purgar(self):
+        """Libera la memoria de los resultados vencidos aunque nadie consulte"""
+        with self.lock:
+            self.purgar_vencidos()
+
+    def obtener(self, ticket):
+        """Resultado de un ticket, o una respuesta 'pendiente' o 'desconocido'"""
+        with self.lock:
+            self.purgar_vencidos()
+            entrada = self.resultados.get(ticket)
+            if entrada is not None:
+                return entrada[0]
+            if ticket in self.pendientes:
+                return respuesta_pendiente(ticket)
+        return respuesta_desconocida(ticket)
+
+    def suscribir(self, tickets, avisar):
+        """Llama a avisar(resultado) una vez por ticket: en el momento si ya
+        se resolvió o es desconocido, o apenas llegue si está pendiente"""
+        listos = []
+        with self.lock:
+            self.purgar_vencidos()
+            for ticket in tickets:
+                entrada = self.resultados.get(ticket)
+                if entrada is not None:
+                    listos.append(entrada[0])
+                elif ticket in self.pendientes:
+                    self.suscriptores.setdefault(ticket, []).append(avisar)
+                else:
+                    listos.append(respuesta_desconocida(ticket))
+
+        for resultado in listos:
+            avisar(resultado)
+
+    def desuscribir(self, tickets, avisar):
+        """Deja de avisar los tickets que todavía no llegaron"""
+        with self.lock:
+            for ticket in tickets:
+                avisos = self.suscriptores.get(ticket)
+                if avisos and avisar in avisos:
+                    avisos.remove(avisar)
+                    if not avisos:
+                        del self.suscriptores[ticket]
+
+    def estadisticas(self):
+        """Contadores del almacén"""
+        with self.lock:
+            return {
+                'pendientes': len(self.pendientes),
+                'resultados': len(self.resultados),
+                'bytes': self.bytes_usados,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'suscriptores': sum(len(avisos) for avisos in self.suscriptores.values()),
+                'guardados': self.guardados,
+                'desalojados': self.desalojados,
+                'vencidos': self.vencidos,
+            }
@@ -0,0 +1,297 @@
+"""
+Generador de carga y benchmark de latencia
+Envía tareas al servidor a una tasa fija (llegadas Poisson o constantes, en
+lazo abierto) o con una concurrencia fija (lazo cerrado), con una mezcla de
+operaciones configurable, y reporta throughput, errores y percentiles de latencia
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+
+from cliente_async import ClienteAsync
+from latencias import Histograma
+
+MEZCLA_POR_DEFECTO = 'suma=6,multiplicacion=2,primo=1,mayusculas=1'
+
+# Datos aleatorios por operación: varían para que el cache no responda todo
+GENERADORES = {
+    'suma': lambda: {'a': random.randint(0, 10**6), 'b': random.randint(0, 10**6)},
+    'resta': lambda: {'a': random.randint(0, 10**6), 'b': random.randint(0, 10**6)},
+    'multiplicacion': lambda: {'a': random.randint(0, 10**6), 'b': random.randint(0, 10**6)},
+    'division': lambda: {'a': random.randint(0, 10**6), 'b': random.randint(1, 1000)},
+    'potencia': lambda: {'base': random.randint(2, 100), 'exponente': random.randint(2, 50)},
+    'raiz': lambda: {'numero': random.uniform(0, 10**6)},
+    'factorial': lambda: {'n': random.randint(50, 500)},
+    'primo': lambda: {'n': random.randint(10**9, 10**12)},
+    'fibonacci': lambda: {'n': random.randint(100, 5000)},
+    'inverso_texto': lambda: {'texto': 'carga ' * random.randint(1, 50)},
+    'mayusculas': lambda: {'texto': 'carga ' * random.randint(1, 50)},
+    'contar_palabras': lambda: {'texto': 'carga ' * random.randint(1, 50)},
+    'sleep': lambda: {'segundos': 0.01},
+}
+
+# Estados de respuesta que cuentan como timeout
+ESTADOS_TIMEOUT = ('timeout', 'vencida')
+
+
+def leer_mezcla(texto):
+    """'suma=8,primo=1' -> {'suma': 8.0, 'primo': 1.0}"""
+    mezcla = {}
+    for parte in texto.split(','):
+        operacion, _, peso = parte.strip().partition('=')
+        if operacion not in GENERADORES:
+            raise ValueError(f"Operación sin generador de datos: {operacion}")
+        mezcla[operacion] = float(peso or 1)
+    return mezcla
+
+
+def commit_actual():
+    """Commit del árbol que se está midiendo, o None fuera de git"""
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, timeout=5)
+    except OSError:
+        return None
+    return salida.stdout.strip() or None
+
+
+class Medicion:
+    """Resultados del benchmark por operación y en total"""
+
+    def __init__(self):
+        self.total = Histograma()
+        self.por_operacion = {}
+        self.estados = {}
+        self.enviadas = 0
+        # Cuánto se atrasó el generador respecto de la llegada programada
+        self.atraso = Histograma()
+
+    def registrar(self, operacion, latencia, estado):
+        self.estados[estado] = self.estados.get(estado, 0) + 1
+        if estado != 'completado':
+            return
+        self.total.registrar(latencia)
+        if operacion not in self.por_operacion:
+            self.por_operacion[operacion] = Histograma()
+        self.por_operacion[operacion].registrar(latencia)
+
+    def resumen(self, duracion, ofrecida):
+        respondidas = sum(self.estados.values())
+        completadas = self.estados.get('completado', 0)
+        timeouts = sum(self.estados.get(e, 0) for e in ESTADOS_TIMEOUT)
+        errores = respondidas - completadas - timeouts
+        return {
+            'duracion': duracion,
+            'tasa_ofrecida': ofrecida,
+            'tasa_lograda': completadas / duracion if duracion else 0.0,
+            'enviadas': self.enviadas,
+            'completadas': completadas,
+            'tasa_errores': errores / respondidas if respondidas else 0.0,
+            'tasa_timeouts': timeouts / respondidas if respondidas else 0.0,
+            'estados': dict(self.estados),
+            'latencia': self.total.resumen(),
+            'por_operacion': {op: h.resumen() for op, h in sorted(self.por_operacion.items())},
+            'atraso_generador': self.atraso.resumen(),
+        }
+
+
+async def ejecutar_tarea(cliente, medicion, operacion, programada, contar):
+    """Envía una tarea y registra su latencia desde la llegada programada
+    (así la espera por conexiones libres también cuenta, sin omisión coordinada)"""
+    try:
+        resultado = await cliente.enviar(operacion, GENERADORES[operacion]())
+        estado = resultado.get('estado', 'desconocido')
+    except (OSError, ValueError) as e:
+        estado = f'fallo: {type(e).__name__}'
+    if contar:
+        medicion.registrar(operacion, time.perf_counter() - programada, estado)
+
+
+async def lazo_abierto(cliente, medicion, mezcla, tasa, llegadas, duracion, calentamiento):
+    """Programa llegadas a `tasa` por segundo, sin esperar a que terminen las anteriores"""
+    operaciones, pesos = list(mezcla), list(mezcla.values())
+    pendientes = set()
+    inicio = time.perf_counter()
+    programada = inicio
+
+    while True:
+        programada += random.expovariate(tasa) if llegadas == 'poisson' else 1 / tasa
+        if programada - inicio >= calentamiento + duracion:
+            break
+        espera = programada - time.perf_counter()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+        contar = programada - inicio >= calentamiento
+        if contar:
+            medicion.enviadas += 1
+            medicion.atraso.registrar(max(0.0, time.perf_counter() - programada))
+        operacion = random.choices(operaciones, pesos)[0]
+        tarea = asyncio.ensure_future(
+            ejecutar_tarea(cliente, medicion, operacion, programada, contar))
+        pendientes.add(tarea)
+        tarea.add_done_callback(pendientes.discard)
+
+    return pendientes
+
+
+async def lazo_cerrado(cliente, medicion, mezcla, concurrencia, duracion, calentamiento):
+    """`concurrencia` usuarios que envían una tarea apenas reciben la anterior"""
+    operaciones, pesos = list(mezcla), list(mezcla.values())
+    inicio = time.perf_counter()
+    fin = inicio + calentamiento + duracion
+
+    async def usuario():
+        while time.perf_counter() < fin:
+            programada = time.perf_counter()
+            contar = programada - inicio >= calentamiento
+            if contar:
+                medicion.enviadas += 1
+            operacion = random.choices(operaciones, pesos)[0]
+            await ejecutar_tarea(cliente, medicion, operacion, programada, contar)
+
+    return {asyncio.ensure_future(usuario()) for _ in range(concurrencia)}
+
+
+async def ejecutar(host='localhost', puerto=5000, modo='poisson', tasa=100.0,
+                   concurrencia=16, duracion=10.0, calentamiento=1.0,
+                   mezcla=MEZCLA_POR_DEFECTO, conexiones=64, codec='binario',
+                   espera_final=35.0):
+    """Corre el benchmark y retorna el resumen (dict serializable a JSON)"""
+    mezcla = leer_mezcla(mezcla) if isinstance(mezcla, str) else mezcla
+    medicion = Medicion()
+
+    # Sin reintentos: un rechazo por sobrecarga es un resultado a medir
+    async with ClienteAsync(host, puerto, reintentos=0, codec=codec,
+                            conexiones=conexiones) as cliente:
+        if modo == 'concurrencia':
+            tareas = await lazo_cerrado(cliente, medicion, mezcla, concurrencia,
+                                        duracion, calentamiento)
+            ofrecida = None
+        else:
+            tareas = await lazo_abierto(cliente, medicion, mezcla, tasa, modo,
+                                        duracion, calentamiento)
+            ofrecida = medicion.enviadas / duracion
+
+        # Las que no terminan a tiempo cuentan como sin respuesta
+        if tareas:
+            _, colgadas = await asyncio.wait(tareas, timeout=espera_final)
+            for tarea in colgadas:
+                tarea.cancel()
+            sin_respuesta = medicion.enviadas - sum(medicion.estados.values())
+            if sin_respuesta > 0:
+                medicion.estados['sin_respuesta'] = sin_respuesta
+
+        servidor = await cliente.estadisticas()
+
+    resumen = medicion.resumen(duracion, ofrecida)
+    resumen['servidor'] = {clave: servidor.get(clave)
+                           for clave in ('workers', 'cola', 'admision', 'etapas')}
+    return resumen
+
+
+def formatear_ms(segundos):
+    return '-' if segundos is None else f"{segundos * 1e3:.2f}"
+
+
+def imprimir(resumen):
+    """Tabla legible del resumen"""
+    print("\n" + "="*72)
+    ofrecida = resumen['tasa_ofrecida']
+    print(f"Ofrecida: {'-' if ofrecida is None else f'{ofrecida:.1f}'} tareas/s | "
+          f"Lograda: {resumen['tasa_lograda']:.1f} tareas/s | "
+          f"Errores: {resumen['tasa_errores']:.2%} | Timeouts: {resumen['tasa_timeouts']:.2%}")
+    print(f"Estados: {resumen['estados']}")
+    print("="*72)
+    print(f"{'operación':>16} | {'n':>7} | {'p50 ms':>8} | {'p90 ms':>8} | "
+          f"{'p99 ms':>8} | {'p999 ms':>8} | {'max ms':>8}")
+    print("-"*72)
+    filas = list(resumen['por_operacion'].items()) + [('TOTAL', resumen['latencia'])]
+    for operacion, h in filas:
+        print(f"{operacion:>16} | {h['cantidad']:>7} | {formatear_ms(h['p50']):>8} | "
+              f"{formatear_ms(h['p90']):>8} | {formatear_ms(h['p99']):>8} | "
+              f"{formatear_ms(h['p999']):>8} | {formatear_ms(h['max']):>8}")
+    atraso = resumen['atraso_generador']
+    if atraso['cantidad'] and atraso['p99'] > 0.01:
+        print(f"\n[AVISO] El generador se atrasó (p99 {formatear_ms(atraso['p99'])} ms): "
+              "la tasa ofrecida puede no ser la pedida")
+
+
+def comparar(base, nuevo):
+    """Compara dos archivos de resultados (p. ej. de dos commits o dos motores)"""
+    resultados = []
+    for ruta in (base, nuevo):
+        with open(ruta) as f:
+            resultados.append(json.load(f))
+    a, b = (r['resultados'] for r in resultados)
+
+    print(f"\n{'':>14} | {'base':>12} | {'nuevo':>12} | {'cambio':>8}")
+    for clave in ('commit', 'etiqueta'):
+        print(f"{'':>14} | {resultados[0].get(clave) or '-':>12} | "
+              f"{resultados[1].get(clave) or '-':>12} |")
+    print("-"*56)
+    filas = [('tareas/s', a['tasa_lograda'], b['tasa_lograda'], 1)]
+    filas += [(f'{p} ms', a['latencia'][p], b['latencia'][p], 1e3)
+              for p in ('p50', 'p90', 'p99', 'p999')]
+    filas += [('errores %', a['tasa_errores'], b['tasa_errores'], 100),
+              ('timeouts %', a['tasa_timeouts'], b['tasa_timeouts'], 100)]
+    for nombre, x, y, escala in filas:
+        cambio = f"{(y - x) / x:+.1%}" if x and y is not None else '-'
+        fx = '-' if x is None else f"{x * escala:.2f}"
+        fy = '-' if y is None else f"{y * escala:.2f}"
+        print(f"{nombre:>14} | {fx:>12} | {fy:>12} | {cambio:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generador de carga para el servidor de tareas')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--puerto', type=int, default=5000)
+    parser.add_argument('--modo', choices=['poisson', 'constante', 'concurrencia'],
+                        default='poisson',
+                        help='llegadas a tasa fija (Poisson o constantes) o concurrencia fija')
+    parser.add_argument('--tasa', type=float, default=100.0,
+                        help='tareas por segundo ofrecidas (modos poisson y constante)')
+    parser.add_argument('--concurrencia', type=int, default=16,
+                        help='usuarios simultáneos (modo concurrencia)')
+    parser.add_argument('--duracion', type=float, default=10.0,
+                        help='segundos medidos')
+    parser.add_argument('--calentamiento', type=float, default=1.0,
+                        help='segundos iniciales que no se miden')
+    parser.add_argument('--mezcla', default=MEZCLA_POR_DEFECTO,
+                        help='operaciones y pesos, p. ej. suma=8,factorial=1,sleep=1')
+    parser.add_argument('--conexiones', type=int, default=64,
+                        help='conexiones al servidor (tareas en vuelo como máximo)')
+    parser.add_argument('--codec', choices=['binario', 'json'], default='binario')
+    parser.add_argument('--etiqueta', default=None,
+                        help='texto libre guardado con los resultados (p. ej. el motor)')
+    parser.add_argument('--salida', default=None,
+                        help='archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', nargs=2, metavar=('BASE', 'NUEVO'),
+                        help='compara dos archivos de resultados y termina')
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    configuracion = {clave: getattr(args, clave) for clave in
+                     ('host', 'puerto', 'modo', 'tasa', 'concurrencia', 'duracion',
+                      'calentamiento', 'mezcla', 'conexiones', 'codec')}
+    resumen = asyncio.run(ejecutar(**configuracion))
+    imprimir(resumen)
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({'commit': commit_actual(), 'etiqueta': args.etiqueta,
+                       'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'configuracion': configuracion, 'resultados': resumen},
+                      f, indent=2)
+        print(f"\n[BENCH] Resultados guardados en {args.salida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark de los codecs del protocolo
+Compara tamaño y tiempo de codificación de JSON y del codec binario
+con mensajes típicos del sistema
+"""
+
+import math
+
+from bench_numerico import medir, formatear
+from numerico import fibonacci
+from protocolo import CODEC_JSON, CODEC_BINARIO, codificar, decodificar, ErrorProtocolo
+
+
+def mensajes():
+    """(descripción, mensaje) representativos del tráfico real"""
+    tarea = {'operacion': 'suma', 'datos': {'a': 10, 'b': 5}, 'id': 1234,
+             'timestamp': 1760000000.123456, 'prioridad': 1, 'costo': 1e-06}
+    resultado = {'id': 1234, 'resultado': 15, 'estado': 'completado',
+                 'worker': 'Worker-1'}
+    lote = {'id': 99, 'desde': 0, 'prioridad': 1, 'timestamp': 1760000000.123456,
+            'tareas': [{'operacion': 'multiplicacion', 'datos': {'a': i, 'b': 3}}
+                       for i in range(100)]}
+    resultados_lote = {'id': 99, 'resultados': [
+        {'resultado': 3 * i, 'estado': 'completado', 'worker': 'Worker-1'}
+        for i in range(100)]}
+    return [
+        ('tarea suelta', tarea),
+        ('resultado suelto', resultado),
+        ('sub-lote de 100 tareas', lote),
+        ('resultados de 100 tareas', resultados_lote),
+        ('factorial(1000)', dict(resultado, resultado=math.factorial(1000))),
+        ('fibonacci(100000)', dict(resultado, resultado=fibonacci(100_000))),
+    ]
+
+
+def main():
+    print("="*92)
+    print("CODECS: JSON vs binario (tamaño del cuerpo y codificar + decodificar)")
+    print("="*92)
+    print(f"{'mensaje':>26} | {'JSON':>10} | {'binario':>10} | "
+          f"{'t JSON':>10} | {'t binario':>10} | {'aceleración':>11}")
+    print("-"*92)
+
+    for descripcion, mensaje in mensajes():
+        fila = []
+        for codec in (CODEC_JSON, CODEC_BINARIO):
+            try:
+                cuerpo = codificar(mensaje, codec)
+            except ErrorProtocolo:
+                # JSON no acepta enteros de más de 4300 dígitos
+                fila.append((None, None))
+                continue
+            if decodificar(cuerpo, codec) != mensaje:
+                raise AssertionError(f"El codec {codec} no preserva: {descripcion}")
+            ida_y_vuelta = lambda m: decodificar(codificar(m, codec), codec)
+            fila.append((len(cuerpo), medir(ida_y_vuelta, mensaje)))
+
+        (b_json, t_json), (b_bin, t_bin) = fila
+        aceleracion = f"{t_json / t_bin:.1f}x" if t_json else '-'
+        print(f"{descripcion:>26} | {b_json or 'no cabe':>10} | {b_bin:>10} | "
+              f"{formatear(t_json):>10} | {formatear(t_bin):>10} | {aceleracion:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark del diario de tareas
+Mide cuántas tareas por segundo se pueden aceptar con cada nivel de
+durabilidad y cuánto espera cada una su fsync, con varios hilos aceptando a
+la vez como los que atienden clientes en el servidor
+"""
+
+import argparse
+import itertools
+import shutil
+import tempfile
+import threading
+import time
+
+from bench_numerico import formatear
+from diario import Diario
+from latencias import Histograma
+
+
+def medir(durabilidad, hilos, duracion):
+    """Acepta, espera y completa tareas desde `hilos` hilos durante `duracion`
+    segundos. Retorna (tareas/s, histograma de la espera, estadísticas)"""
+    directorio = tempfile.mkdtemp(prefix='bench-diario-')
+    diario = None
+    if durabilidad is not None:
+        diario = Diario(directorio, durabilidad)
+        diario.abrir()
+
+    espera = Histograma()
+    ids = itertools.count(1)
+    fin = time.monotonic() + duracion
+    cantidades = []
+
+    def cliente():
+        hechas = 0
+        while time.monotonic() < fin:
+            tarea = {'operacion': 'suma', 'datos': {'a': 10, 'b': 5}, 'id': next(ids),
+                     'prioridad': 1, 'vence': time.monotonic() + 30}
+            inicio = time.perf_counter()
+            if diario is not None:
+                diario.esperar(diario.aceptada(tarea))
+            espera.registrar(time.perf_counter() - inicio)
+            if diario is not None:
+                diario.completada(tarea['id'], 'completado')
+            hechas += 1
+        cantidades.append(hechas)
+
+    inicio = time.monotonic()
+    trabajadores = [threading.Thread(target=cliente) for _ in range(hilos)]
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+    transcurrido = time.monotonic() - inicio
+
+    estadisticas = None
+    if diario is not None:
+        diario.cerrar()
+        estadisticas = diario.estadisticas()
+    shutil.rmtree(directorio, ignore_errors=True)
+    return sum(cantidades) / transcurrido, espera, estadisticas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Costo del diario por nivel de durabilidad')
+    parser.add_argument('--hilos', default='1,16,64',
+                        help='cantidades de hilos aceptando tareas, separadas por coma')
+    parser.add_argument('--duracion', type=float, default=2.0,
+                        help='segundos por medición')
+    args = parser.parse_args()
+
+    print("="*86)
+    print("DIARIO: tareas aceptadas por segundo y espera del fsync")
+    print("="*86)
+    print(f"{'durabilidad':>12} | {'hilos':>5} | {'tareas/s':>10} | "
+          f"{'p50 espera':>10} | {'p99 espera':>10} | {'eventos/fsync':>13}")
+    print("-"*86)
+
+    for hilos in [int(h) for h in args.hilos.split(',')]:
+        for durabilidad in (None, 'diferida', 'sincronica'):
+            por_segundo, espera, estadisticas = medir(durabilidad, hilos, args.duracion)
+            por_grupo = f"{estadisticas['eventos_por_grupo']:.1f}" if estadisticas else '-'
+            print(f"{durabilidad or 'sin diario':>12} | {hilos:>5} | {por_segundo:>10.0f} | "
+                  f"{formatear(espera.percentil(50)):>10} | "
+                  f"{formatear(espera.percentil(99)):>10} | {por_grupo:>13}")
+
+
+if __name__ == '__main__':
+    main()
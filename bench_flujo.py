@@ -0,0 +1,94 @@
+"""
+Benchmark de memoria de las tareas en flujo
+Envía un texto grande (mayusculas) y pide un resultado grande (factorial),
+con el cuerpo en un solo mensaje o en flujo, y reporta cuánta memoria de más
+llegó a usar el servidor y el worker en cada caso (pico de RSS, Linux)
+"""
+
+import argparse
+import time
+
+from bench_numerico import formatear
+from bench_texto import PUERTO_CLIENTES, levantar, esperar_workers
+from cliente import Cliente
+
+
+def memoria(pid, campo):
+    """Kilobytes de un campo de /proc/<pid>/status (VmRSS, VmHWM...)"""
+    with open(f'/proc/{pid}/status') as estado:
+        for linea in estado:
+            if linea.startswith(campo + ':'):
+                return int(linea.split()[1])
+    return 0
+
+
+def partes_de_texto(megas, tamano=256 * 1024):
+    """Genera `megas` millones de caracteres de texto de a `tamano`"""
+    base = ('tarea en flujo ' * (tamano // 15 + 1))[:tamano]
+    for _ in range(megas * 1_000_000 // tamano):
+        yield base
+
+
+def correr(caso, en_flujo, megas, factorial):
+    """Ejecuta un caso en un servidor y un worker nuevos; retorna (segundos,
+    MB de más en el servidor, MB de más en el worker)"""
+    procesos = levantar(1, 0)
+    try:
+        with Cliente(puerto=PUERTO_CLIENTES, conexiones=1) as cliente:
+            esperar_workers(cliente, 1)
+            servidor, worker = procesos[0].pid, procesos[1].pid
+            base = memoria(servidor, 'VmRSS'), memoria(worker, 'VmRSS')
+
+            inicio = time.perf_counter()
+            if caso == 'mayusculas' and en_flujo:
+                largo = [0]
+                respuesta = cliente.enviar_en_flujo(
+                    'mayusculas', partes=partes_de_texto(megas),
+                    al_recibir=lambda parte: largo.__setitem__(0, largo[0] + len(parte)))
+            elif caso == 'mayusculas':
+                texto = ''.join(partes_de_texto(megas))
+                respuesta = cliente.submit('mayusculas', {'texto': texto}).result()
+                del texto
+            elif en_flujo:
+                respuesta = cliente.enviar_en_flujo('factorial', datos={'n': factorial})
+            else:
+                respuesta = cliente.submit('factorial', {'n': factorial}).result()
+            segundos = time.perf_counter() - inicio
+
+            if respuesta.get('estado') != 'completado':
+                raise RuntimeError(f"{caso}: {respuesta.get('error')}")
+            return (segundos,
+                    (memoria(servidor, 'VmHWM') - base[0]) / 1024,
+                    (memoria(worker, 'VmHWM') - base[1]) / 1024)
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+        for proceso in procesos:
+            proceso.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memoria por salto con y sin flujo')
+    parser.add_argument('--megas', type=int, default=64,
+                        help='millones de caracteres del texto de mayusculas')
+    parser.add_argument('--factorial', type=int, default=200_000,
+                        help='n del factorial con resultado grande')
+    args = parser.parse_args()
+
+    print("="*78)
+    print(f"MEMORIA POR SALTO: mayusculas de {args.megas}M caracteres, "
+          f"factorial({args.factorial})")
+    print("="*78)
+    print(f"{'caso':>12} | {'modo':>8} | {'tiempo':>10} | {'servidor +MB':>12} | "
+          f"{'worker +MB':>10}")
+    print("-"*78)
+
+    for caso in ('mayusculas', 'factorial'):
+        for en_flujo in (False, True):
+            segundos, servidor, worker = correr(caso, en_flujo, args.megas, args.factorial)
+            print(f"{caso:>12} | {'flujo' if en_flujo else 'entero':>8} | "
+                  f"{formatear(segundos):>10} | {servidor:>12.1f} | {worker:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
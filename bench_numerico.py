@@ -0,0 +1,103 @@
+"""
+Micro-benchmark de los núcleos numéricos
+Compara numerico.py con las implementaciones anteriores del worker
+"""
+
+import math
+import time
+
+import numerico
+
+
+def es_primo_division(n):
+    """Implementación anterior: división por impares hasta sqrt(n)"""
+    if n < 2:
+        return False
+    if n == 2:
+        return True
+    if n % 2 == 0:
+        return False
+
+    for i in range(3, int(math.sqrt(n)) + 1, 2):
+        if n % i == 0:
+            return False
+    return True
+
+
+def fibonacci_lineal(n):
+    """Implementación anterior: bucle O(n) con enteros grandes"""
+    if n <= 0:
+        return 0
+    elif n == 1:
+        return 1
+
+    a, b = 0, 1
+    for _ in range(2, n + 1):
+        a, b = b, a + b
+    return b
+
+
+def medir(funcion, argumento, presupuesto=0.2):
+    """Segundos por llamada, repitiendo hasta gastar el presupuesto de tiempo"""
+    repeticiones = 0
+    inicio = time.perf_counter()
+    while True:
+        funcion(argumento)
+        repeticiones += 1
+        transcurrido = time.perf_counter() - inicio
+        if transcurrido >= presupuesto:
+            return transcurrido / repeticiones
+
+
+def formatear(segundos):
+    """Tiempo legible con la unidad adecuada"""
+    if segundos is None:
+        return 'omitido'
+    if segundos < 1e-3:
+        return f"{segundos * 1e6:.1f} µs"
+    if segundos < 1:
+        return f"{segundos * 1e3:.2f} ms"
+    return f"{segundos:.2f} s"
+
+
+def comparar(titulo, anterior, nuevo, entradas, limite_anterior):
+    """Imprime una tabla anterior vs nuevo para cada entrada"""
+    print("\n" + "="*72)
+    print(titulo)
+    print("="*72)
+    print(f"{'entrada':>26} | {'anterior':>12} | {'nuevo':>12} | {'aceleración':>11}")
+    print("-"*72)
+
+    for entrada in entradas:
+        if anterior(min(entrada, 10)) != nuevo(min(entrada, 10)):
+            raise AssertionError(f"Resultados distintos para {entrada}")
+
+        t_nuevo = medir(nuevo, entrada)
+        # Las versiones lentas solo se miden donde terminan en tiempo razonable
+        t_anterior = medir(anterior, entrada) if entrada <= limite_anterior else None
+
+        aceleracion = f"{t_anterior / t_nuevo:.0f}x" if t_anterior else '-'
+        print(f"{entrada:>26} | {formatear(t_anterior):>12} | "
+              f"{formatear(t_nuevo):>12} | {aceleracion:>11}")
+
+
+def main():
+    comparar(
+        "FIBONACCI: bucle lineal vs duplicación rápida",
+        fibonacci_lineal, numerico.fibonacci,
+        [10, 100, 1_000, 10_000, 100_000, 1_000_000],
+        limite_anterior=100_000,
+    )
+
+    # Primos de distinto tamaño: es el peor caso para la división por tentativa
+    comparar(
+        "PRIMO: división por tentativa vs Miller-Rabin",
+        es_primo_division, numerico.es_primo,
+        [97, 10_007, 1_000_003, 1_000_000_007, 1_000_000_000_039,
+         2**61 - 1, 2**64 - 59, 2**127 - 1],
+        limite_anterior=1_000_000_000_039,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark del reparto de textos grandes
+Levanta un servidor y N workers (un proceso cada uno, con capacidad 1) y mide
+cuánto tarda cada operación de texto sobre un texto grande, entero en un
+worker o repartido en fragmentos entre todos
+"""
+
+import argparse
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_numerico import formatear
+from cliente import Cliente
+
+PUERTO_CLIENTES = 5300
+PUERTO_WORKERS = 5301
+OPERACIONES = ('contar_palabras', 'mayusculas', 'inverso_texto')
+
+
+def generar_texto(caracteres):
+    """Texto con palabras de largo variable, acentos y espacios distintos"""
+    palabras = ['tarea', 'ñandú', 'straße', 'distribución', 'a', 'Ωmega', 'worker']
+    separadores = [' ', ' ', ' ', '\n', '\t']
+    partes = []
+    total = 0
+    while total < caracteres:
+        parte = random.choice(palabras) + random.choice(separadores)
+        partes.append(parte)
+        total += len(parte)
+    return ''.join(partes)[:caracteres]
+
+
+def levantar(workers, tamano_fragmento):
+    """Inicia servidor y workers; retorna los procesos"""
+    silencio = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL}
+    procesos = [subprocess.Popen(
+        [sys.executable, 'servidor.py', '--puerto-clientes', str(PUERTO_CLIENTES),
+         '--puerto-workers', str(PUERTO_WORKERS), '--puerto-metricas', '0',
+         '--cache-mb', '0', '--tamano-fragmento', str(tamano_fragmento)], **silencio)]
+    time.sleep(1)
+    for numero in range(workers):
+        procesos.append(subprocess.Popen(
+            [sys.executable, 'worker.py', f'Texto-{numero + 1}',
+             '--puerto', str(PUERTO_WORKERS), '--capacidad', '1'], **silencio))
+    return procesos
+
+
+def esperar_workers(cliente, workers, plazo=10):
+    """Espera a que todos los workers estén registrados en el servidor"""
+    limite = time.monotonic() + plazo
+    while time.monotonic() < limite:
+        if cliente.estadisticas().get('workers', 0) >= workers:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"No se conectaron los {workers} workers")
+
+
+def medir(workers, tamano_fragmento, texto, repeticiones):
+    """Mediana de la latencia de cada operación sobre el texto: {operación: segundos}"""
+    procesos = levantar(workers, tamano_fragmento)
+    try:
+        with Cliente(puerto=PUERTO_CLIENTES, conexiones=1) as cliente:
+            esperar_workers(cliente, workers)
+            medianas = {}
+            for operacion in OPERACIONES:
+                tiempos = []
+                for _ in range(repeticiones):
+                    inicio = time.perf_counter()
+                    resultado = cliente.submit(operacion, {'texto': texto}).result()
+                    tiempos.append(time.perf_counter() - inicio)
+                    if resultado.get('estado') != 'completado':
+                        raise RuntimeError(f"{operacion}: {resultado.get('error')}")
+                medianas[operacion] = statistics.median(tiempos)
+            return medianas
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+        for proceso in procesos:
+            proceso.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reparto de textos grandes entre workers')
+    parser.add_argument('--workers', default='1,2,4',
+                        help='cantidades de workers a medir, separadas por coma')
+    parser.add_argument('--caracteres', type=int, default=8_000_000,
+                        help='largo del texto de prueba')
+    parser.add_argument('--tamano-fragmento', type=int, default=1024 * 1024,
+                        help='caracteres por fragmento al repartir')
+    parser.add_argument('--repeticiones', type=int, default=5,
+                        help='mediciones por operación (se reporta la mediana)')
+    args = parser.parse_args()
+
+    texto = generar_texto(args.caracteres)
+    print("="*78)
+    print(f"TEXTO GRANDE: {len(texto)} caracteres, fragmentos de {args.tamano_fragmento}")
+    print("="*78)
+    print(f"{'operación':>16} | {'workers':>7} | {'entero':>10} | {'repartido':>10} | "
+          f"{'aceleración':>11}")
+    print("-"*78)
+
+    base = {}
+    for workers in [int(w) for w in args.workers.split(',')]:
+        entero = medir(workers, 0, texto, args.repeticiones)
+        repartido = medir(workers, args.tamano_fragmento, texto, args.repeticiones)
+        for operacion in OPERACIONES:
+            # Aceleración respecto del texto entero con la primera cantidad de workers
+            base.setdefault(operacion, entero[operacion])
+            print(f"{operacion:>16} | {workers:>7} | {formatear(entero[operacion]):>10} | "
+                  f"{formatear(repartido[operacion]):>10} | "
+                  f"{base[operacion] / repartido[operacion]:>10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Bitácora (logging) del servidor y los workers
+Los hilos que atienden tareas solo encolan el registro: un único hilo lo
+formatea y escribe. Si la cola se llena, los mensajes se descartan y se
+cuentan en vez de bloquear. Los mensajes de cada tarea se pueden muestrear
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Mensajes que pueden esperar escritura; los que no entran se descartan
+CAPACIDAD_POR_DEFECTO = 10000
+
+NIVELES = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+FORMATOS = ('texto', 'json')
+
+# Manejador instalado por configurar() (None si no se configuró) y cada
+# cuántas tareas se registran sus mensajes
+_manejador = None
+_muestreo = 1
+
+
+class LoggerTareas(logging.Logger):
+    """Logger que descarta los mensajes de las tareas no muestreadas antes de
+    armar el registro (lo caro). Se elige una de cada N tareas por su ID, así
+    servidor y workers muestrean las mismas. Advertencias y errores pasan siempre"""
+
+    def _log(self, nivel, mensaje, args, exc_info=None, extra=None, **kwargs):
+        if extra is not None and nivel < logging.WARNING and _muestreo > 1:
+            tarea = extra.get('tarea')
+            if isinstance(tarea, int) and tarea % _muestreo:
+                return
+        super()._log(nivel, mensaje, args, exc_info, extra, **kwargs)
+
+
+def obtener(nombre):
+    """Logger con muestreo por tarea para el componente `nombre`"""
+    anterior = logging.getLoggerClass()
+    logging.setLoggerClass(LoggerTareas)
+    try:
+        return logging.getLogger(nombre)
+    finally:
+        logging.setLoggerClass(anterior)
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """Encola los registros sin formatear y nunca bloquea: con la cola llena
+    el registro se descarta y se cuenta"""
+
+    def __init__(self, capacidad=CAPACIDAD_POR_DEFECTO):
+        super().__init__(queue.Queue(capacidad))
+        self.capacidad = capacidad
+        self.descartados = 0
+        # Descartados que todavía no se avisaron en la propia bitácora
+        self.sin_avisar = 0
+
+    def prepare(self, registro):
+        # La cola es del mismo proceso: formatear es trabajo del hilo escritor
+        return registro
+
+    def enqueue(self, registro):
+        # Handler.handle ya serializa las llamadas con el lock del manejador
+        if self.sin_avisar and self.queue.qsize() < self.capacidad // 2:
+            aviso = logging.LogRecord(
+                'bitacora', logging.WARNING, __file__, 0,
+                "Se descartaron %d mensajes por cola llena", (self.sin_avisar,), None)
+            try:
+                self.queue.put_nowait(aviso)
+                self.sin_avisar = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+            self.sin_avisar += 1
+
+
+class EscritorCola(logging.handlers.QueueListener):
+    """Hilo que escribe los registros encolados"""
+
+    def enqueue_sentinel(self):
+        # Al detener se espera lugar: el centinela no se puede descartar
+        self.queue.put(self._sentinel)
+
+
+def etiqueta(registro):
+    """Prefijo del mensaje: nombre del worker, tarea, ERROR o el componente"""
+    propia = getattr(registro, 'etiqueta', None)
+    if propia is not None:
+        return propia
+    tarea = getattr(registro, 'tarea', None)
+    if tarea is not None:
+        return f"TAREA {tarea}"
+    if registro.levelno >= logging.ERROR:
+        return 'ERROR'
+    return registro.name.rsplit('.', 1)[-1].upper()
+
+
+class FormatoTexto(logging.Formatter):
+    """[ETIQUETA] mensaje, como los print de siempre"""
+
+    def format(self, registro):
+        texto = f"[{etiqueta(registro)}] {registro.getMessage()}"
+        if registro.exc_info:
+            texto += '\n' + self.formatException(registro.exc_info)
+        return texto
+
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea, para procesar la bitácora con herramientas"""
+
+    def format(self, registro):
+        datos = {
+            'ts': round(registro.created, 6),
+            'nivel': registro.levelname,
+            'origen': registro.name,
+            'etiqueta': etiqueta(registro),
+            'mensaje': registro.getMessage(),
+        }
+        tarea = getattr(registro, 'tarea', None)
+        if tarea is not None:
+            datos['tarea'] = tarea
+        if registro.exc_info:
+            datos['excepcion'] = self.formatException(registro.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class Etiquetado(logging.LoggerAdapter):
+    """Logger que agrega una etiqueta fija (p. ej. el nombre del worker) sin
+    pisar los `extra` de cada llamada"""
+
+    def process(self, mensaje, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return mensaje, kwargs
+
+
+def configurar(nivel='INFO', muestreo=1, formato='texto',
+               capacidad=CAPACIDAD_POR_DEFECTO, salida=None):
+    """Instala la bitácora asíncrona en el logger raíz y retorna su manejador"""
+    global _manejador, _muestreo
+    raiz = logging.getLogger()
+    if _manejador is not None:
+        raiz.removeHandler(_manejador)
+    _muestreo = max(1, muestreo)
+
+    # Los formatos no usan hilo ni proceso: no se calculan
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    escritura = logging.StreamHandler(salida or sys.stdout)
+    escritura.setFormatter(FormatoJSON() if formato == 'json' else FormatoTexto())
+
+    manejador = ManejadorCola(capacidad)
+    escritor = EscritorCola(manejador.queue, escritura)
+    escritor.start()
+    # Lo pendiente se escribe al salir
+    atexit.register(escritor.stop)
+
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+    _manejador = manejador
+    return manejador
+
+
+def descartados():
+    """Mensajes descartados por cola llena desde que se configuró la bitácora"""
+    return _manejador.descartados if _manejador is not None else 0
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos de la bitácora"""
+    parser.add_argument('--log-nivel', choices=NIVELES, default='INFO',
+                        help='nivel mínimo (DEBUG incluye los mensajes de cada tarea)')
+    parser.add_argument('--log-muestreo', type=int, default=1,
+                        help='registrar los mensajes de 1 de cada N tareas')
+    parser.add_argument('--log-formato', choices=FORMATOS, default='texto',
+                        help='texto legible o una línea JSON por mensaje')
+
+
+def configurar_desde(args):
+    """Configura la bitácora con las opciones de agregar_argumentos()"""
+    return configurar(args.log_nivel, args.log_muestreo, args.log_formato)
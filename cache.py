@@ -0,0 +1,145 @@
+"""
+Cache de resultados para operaciones deterministas
+LRU con límite de memoria, TTL por operación y contadores de aciertos
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from codec_binario import codificar
+from operaciones import operaciones_cacheables
+
+# Segundos que vive cada entrada; None = sin vencimiento
+TTL_POR_DEFECTO = 300
+TTL_POR_OPERACION = {
+    'primo': None,
+    'factorial': None,
+    'fibonacci': None,
+}
+
+
+def ordenado(valor):
+    """Copia del valor con las claves de cada diccionario en orden"""
+    if type(valor) is dict:
+        return {clave: ordenado(valor[clave]) for clave in sorted(valor)}
+    if type(valor) is list:
+        return [ordenado(elemento) for elemento in valor]
+    return valor
+
+
+def clave_canonica(operacion, datos):
+    """Clave estable para (operacion, datos) sin importar el orden de las claves"""
+    try:
+        return operacion, json.dumps(datos, sort_keys=True, separators=(',', ':'))
+    except ValueError:
+        # Enteros de más de 4300 dígitos (llegan por el codec binario): JSON no
+        # los pasa a texto
+        return operacion, codificar(ordenado(datos))
+
+
+def tamano_aproximado(clave, resultado):
+    """Bytes estimados que ocupa una entrada en memoria"""
+    valor = resultado.get('resultado')
+    return sys.getsizeof(clave[1]) + sys.getsizeof(valor) + 256
+
+
+class CacheResultados:
+    """Cache LRU thread-safe de resultados completados"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, operaciones=None,
+                 ttl_por_defecto=TTL_POR_DEFECTO, ttl_por_operacion=None):
+        self.max_bytes = max_bytes
+        # Por defecto, las operaciones marcadas como cacheables en el registro
+        if operaciones is None:
+            operaciones = operaciones_cacheables()
+        self.operaciones = set(operaciones)
+        self.ttl_por_defecto = ttl_por_defecto
+        self.ttl_por_operacion = dict(TTL_POR_OPERACION if ttl_por_operacion is None
+                                      else ttl_por_operacion)
+
+        # clave -> (resultado, vence, tamaño); el orden es el de uso (LRU al inicio)
+        self.entradas = OrderedDict()
+        self.bytes_usados = 0
+        self.lock = threading.Lock()
+
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.vencidos = 0
+
+    def cacheable(self, operacion):
+        """Indica si los resultados de la operación pueden guardarse"""
+        return self.max_bytes > 0 and operacion in self.operaciones
+
+    def ttl(self, operacion):
+        """Segundos de vida para una operación (None = sin vencimiento)"""
+        return self.ttl_por_operacion.get(operacion, self.ttl_por_defecto)
+
+    def obtener(self, operacion, datos):
+        """Retorna una copia del resultado guardado o None"""
+        if not self.cacheable(operacion):
+            return None
+
+        clave = clave_canonica(operacion, datos)
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+
+            resultado, vence, tamano = entrada
+            if vence is not None and vence < time.monotonic():
+                del self.entradas[clave]
+                self.bytes_usados -= tamano
+                self.vencidos += 1
+                self.fallos += 1
+                return None
+
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return dict(resultado)
+
+    def guardar(self, operacion, datos, resultado):
+        """Guarda un resultado completado, desalojando los menos usados"""
+        if not self.cacheable(operacion) or resultado.get('estado') != 'completado':
+            return
+
+        clave = clave_canonica(operacion, datos)
+        resultado = {k: v for k, v in resultado.items() if k != 'id'}
+        tamano = tamano_aproximado(clave, resultado)
+        if tamano > self.max_bytes:
+            return
+
+        ttl = self.ttl(operacion)
+        vence = None if ttl is None else time.monotonic() + ttl
+
+        with self.lock:
+            anterior = self.entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes_usados -= anterior[2]
+
+            self.entradas[clave] = (resultado, vence, tamano)
+            self.bytes_usados += tamano
+
+            while self.bytes_usados > self.max_bytes:
+                _, (_, _, liberado) = self.entradas.popitem(last=False)
+                self.bytes_usados -= liberado
+                self.desalojos += 1
+
+    def estadisticas(self):
+        """Contadores de uso del cache"""
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self.entradas),
+                'bytes': self.bytes_usados,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+                'vencidos': self.vencidos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+            }
@@ -3,51 +3,379 @@ Cliente que envía tareas al servidor
 Permite enviar diferentes tipos de operaciones y recibir resultados
 """
 
+import queue
+import random
 import socket
-import json
+import threading
 import time
+from concurrent import futures
+
+from flujo import armar_resultado
+from protocolo import (TAREA, RESULTADO, LOTE, ESTADISTICAS, FRAGMENTO, CONSULTA,
+                       SUSCRIPCION, CODECS, LectorMensajes, enviar_mensaje)
+
+# Reintentos ante un rechazo por sobrecarga y tope de espera entre ellos (segundos)
+REINTENTOS_RECHAZO = 5
+ESPERA_MAXIMA = 10.0
+
+# Conexiones persistentes al servidor: el servidor atiende una tarea a la vez
+# por conexión, así que es también la cantidad de tareas en vuelo del cliente
+CONEXIONES_POR_DEFECTO = 8
+
+# Los enteros más grandes se muestran resumidos (factorial, fibonacci...)
+BITS_A_MOSTRAR = 1000
+
+def resumir(valor):
+    """Texto para mostrar un resultado sin volcar enteros enormes a la terminal"""
+    if isinstance(valor, int) and valor.bit_length() > BITS_A_MOSTRAR:
+        return f"<entero de {valor.bit_length()} bits>"
+    return valor
+
+def planificacion(mensaje, prioridad, plazo):
+    """Agrega prioridad ('alta'/'normal'/'baja') y plazo (segundos) si se piden"""
+    if prioridad is not None:
+        mensaje['prioridad'] = prioridad
+    if plazo is not None:
+        mensaje['plazo'] = plazo
+    return mensaje
+
+def espera_reintento(intento, rechazo):
+    """Backoff exponencial con jitter a partir del tiempo que sugiere el servidor"""
+    base = min(ESPERA_MAXIMA, rechazo.get('reintentar_en', 0.1) * 2 ** intento)
+    return random.uniform(base / 2, base)
+
+def mostrar_resultado(resultado):
+    """Imprime el resultado de una tarea según su estado"""
+    if resultado.get('estado') == 'completado':
+        print(f"[RESULTADO] ✓ {resumir(resultado.get('resultado'))}")
+        print(f"[INFO] Procesado por: {resultado.get('worker', 'desconocido')}")
+    elif resultado.get('estado') == 'error':
+        print(f"[ERROR] ✗ {resultado.get('error')}")
+    elif resultado.get('estado') in ('timeout', 'vencida'):
+        print(f"[TIMEOUT] ✗ {resultado.get('error')}")
+    elif resultado.get('estado') == 'rechazado':
+        print(f"[OCUPADO] ✗ {resultado.get('error')}")
+
+class PoolConexiones:
+    """Conexiones persistentes al servidor que se reutilizan entre tareas"""
+    
+    def __init__(self, host, puerto, maximo):
+        self.host = host
+        self.puerto = puerto
+        # Conexiones libres que se conservan; las que sobran se cierran
+        self.maximo = maximo
+        self.libres = queue.LifoQueue()
+        self.creadas = 0
+        self.lock = threading.Lock()
+    
+    def tomar(self):
+        """Retorna ((socket, lector), reusada): una conexión libre o una nueva"""
+        try:
+            return self.libres.get_nowait(), True
+        except queue.Empty:
+            pass
+        
+        sock = socket.create_connection((self.host, self.puerto))
+        with self.lock:
+            self.creadas += 1
+        return (sock, LectorMensajes(sock)), False
+    
+    def devolver(self, conexion):
+        """Deja la conexión disponible para la próxima tarea"""
+        if self.libres.qsize() >= self.maximo:
+            self.descartar(conexion)
+        else:
+            self.libres.put(conexion)
+    
+    def descartar(self, conexion):
+        """Cierra una conexión que no se puede reutilizar"""
+        conexion[0].close()
+    
+    def cerrar(self):
+        """Cierra todas las conexiones libres"""
+        while True:
+            try:
+                self.descartar(self.libres.get_nowait())
+            except queue.Empty:
+                return
+
+class Suscripcion:
+    """Conexión propia por la que llegan los resultados de los tickets
+    suscritos a medida que terminan; se pueden sumar tickets en cualquier momento"""
+    
+    def __init__(self, host, puerto, codec):
+        self.sock = socket.create_connection((host, puerto))
+        self.lector = LectorMensajes(self.sock)
+        self.codec = codec
+        # Tickets agregados cuyo resultado todavía no llegó
+        self.pendientes = set()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.cerrar()
+    
+    def agregar(self, tickets):
+        """Suma tickets a la suscripción"""
+        tickets = list(tickets)
+        self.pendientes.update(tickets)
+        enviar_mensaje(self.sock, SUSCRIPCION, {'tickets': tickets}, self.codec)
+    
+    def recibir(self):
+        """Bloquea hasta el próximo resultado (de cualquier ticket suscrito)"""
+        mensaje = self.lector.recibir()
+        if mensaje is None:
+            raise ConnectionError("El servidor cerró la suscripción")
+        resultado = mensaje[1]
+        self.pendientes.discard(resultado.get('ticket'))
+        return resultado
+    
+    def __iter__(self):
+        """Genera los resultados hasta recibir los de todos los tickets agregados"""
+        while self.pendientes:
+            yield self.recibir()
+    
+    def cerrar(self):
+        """Cierra la conexión; el servidor deja de avisar los tickets pendientes"""
+        self.sock.close()
 
 class Cliente:
-    def __init__(self, host='localhost', puerto=5000):
+    def __init__(self, host='localhost', puerto=5000, reintentos=REINTENTOS_RECHAZO,
+                 codec='binario', conexiones=CONEXIONES_POR_DEFECTO):
         self.host = host
         self.puerto = puerto
+        self.reintentos = reintentos
+        # 'binario' (compacto) o 'json'; el servidor responde en el mismo
+        self.codec = CODECS[codec]
+        
+        # Tareas en vuelo con submit(), cada una por una conexión del pool
+        self.pool = PoolConexiones(host, puerto, conexiones)
+        self.ejecutor = futures.ThreadPoolExecutor(max_workers=conexiones,
+                                                   thread_name_prefix='Cliente')
         
         print(f"[CLIENTE] Configurado para {host}:{puerto}")
     
-    def enviar_tarea(self, operacion, datos):
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.cerrar()
+    
+    def cerrar(self):
+        """Espera las tareas pendientes y cierra las conexiones"""
+        self.ejecutor.shutdown(wait=True)
+        self.pool.cerrar()
+    
+    def esperar_reintento(self, intento, rechazo):
+        """Duerme el backoff sugerido antes de reintentar una tarea rechazada"""
+        espera = espera_reintento(intento, rechazo)
+        print(f"[OCUPADO] {rechazo.get('error')} - reintento en {espera:.2f}s")
+        time.sleep(espera)
+    
+    def solicitar(self, tarea, tipo=TAREA):
+        """Envía una tarea (o consulta) por una conexión del pool y retorna la respuesta"""
+        while True:
+            conexion, reusada = self.pool.tomar()
+            sock, lector = conexion
+            try:
+                enviar_mensaje(sock, tipo, tarea, self.codec)
+                mensaje = lector.recibir()
+                if mensaje is None:
+                    raise ConnectionError("El servidor cerró la conexión sin responder")
+            except Exception as e:
+                self.pool.descartar(conexion)
+                # Una conexión guardada puede estar cerrada del lado del servidor
+                if reusada and isinstance(e, OSError):
+                    continue
+                raise
+            
+            self.pool.devolver(conexion)
+            return mensaje[1]
+    
+    def pedir(self, tarea):
+        """Envía una tarea y, si el servidor está saturado, espera y reintenta"""
+        for intento in range(self.reintentos + 1):
+            resultado = self.solicitar(tarea)
+            if resultado.get('estado') != 'rechazado' or intento == self.reintentos:
+                return resultado
+            self.esperar_reintento(intento, resultado)
+    
+    def submit(self, operacion, datos, prioridad=None, plazo=None):
+        """Envía una tarea sin bloquear; retorna un Future con su resultado"""
+        tarea = planificacion({'operacion': operacion, 'datos': datos}, prioridad, plazo)
+        return self.ejecutor.submit(self.pedir, tarea)
+    
+    def enviar_con_ticket(self, operacion, datos, prioridad=None, plazo=None):
+        """Envía una tarea sin esperar su resultado: retorna la respuesta con
+        su 'ticket' (o el rechazo). El servidor no deja ocupada la conexión;
+        el resultado se retira después con consultar() o suscribir()"""
+        tarea = planificacion({'operacion': operacion, 'datos': datos, 'ticket': True},
+                              prioridad, plazo)
+        return self.pedir(tarea)
+    
+    def consultar(self, tickets, espera=0):
+        """Resultados de los tickets en el mismo orden ('pendiente' si todavía
+        no terminó, 'desconocido' si no existe o ya venció). Con espera, el
+        servidor aguarda hasta esos segundos a que terminen los pendientes"""
+        respuesta = self.solicitar({'tickets': list(tickets), 'espera': espera}, CONSULTA)
+        return respuesta.get('resultados', [])
+    
+    def suscribir(self, tickets=()):
+        """Abre una suscripción que recibe cada resultado apenas termina:
+        `for resultado in cliente.suscribir(tickets)` o agregar() más tickets"""
+        tickets = list(tickets)
+        suscripcion = Suscripcion(self.host, self.puerto, self.codec)
+        if tickets:
+            suscripcion.agregar(tickets)
+        return suscripcion
+    
+    def map(self, operacion, lista_datos, prioridad=None, plazo=None):
+        """Envía una tarea por cada elemento de lista_datos (todas a la vez)
+        y genera sus resultados en el mismo orden"""
+        futuros = [self.submit(operacion, datos, prioridad, plazo) for datos in lista_datos]
+        return (futuro.result() for futuro in futuros)
+    
+    @staticmethod
+    def as_completed(futuros, timeout=None):
+        """Genera los futuros de submit() a medida que terminan"""
+        return futures.as_completed(futuros, timeout)
+    
+    def enviar_tarea(self, operacion, datos, prioridad=None, plazo=None):
         """Envía una tarea al servidor y retorna el resultado"""
         try:
-            # Crear socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.host, self.puerto))
-            
-            # Preparar tarea
-            tarea = {
-                'operacion': operacion,
-                'datos': datos
-            }
+            mostrables = {clave: resumir(valor) for clave, valor in datos.items()}
+            print(f"\n[ENVIANDO] {operacion} con datos: {mostrables}")
             
-            print(f"\n[ENVIANDO] {operacion} con datos: {datos}")
+            resultado = self.submit(operacion, datos, prioridad, plazo).result()
+            mostrar_resultado(resultado)
+            return resultado
+        
+        except ConnectionRefusedError:
+            print("[ERROR] No se pudo conectar al servidor. ¿Está ejecutándose?")
+            return None
+        except Exception as e:
+            print(f"[ERROR] {e}")
+            return None
+    
+    def enviar_lote_flujo(self, tareas, prioridad=None, plazo=None):
+        """Envía una lista de (operacion, datos) en un solo mensaje y
+        genera (indice, resultado) a medida que el servidor los devuelve"""
+        lote = planificacion({
+            'tareas': [{'operacion': op, 'datos': datos} for op, datos in tareas],
+            'flujo': True
+        }, prioridad, plazo)
+        
+        for intento in range(self.reintentos + 1):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect((self.host, self.puerto))
+                enviar_mensaje(sock, LOTE, lote, self.codec)
+                
+                lector = LectorMensajes(sock)
+                while True:
+                    mensaje = lector.recibir()
+                    if mensaje is None:
+                        raise ConnectionError("El servidor cerró la conexión a mitad del lote")
+                    _, respuesta = mensaje
+                    
+                    # Un lote rechazado se reintenta entero mientras queden intentos
+                    if respuesta.get('estado') == 'rechazado' and intento < self.reintentos:
+                        break
+                    
+                    for i, resultado in enumerate(respuesta.get('resultados', [])):
+                        yield respuesta.get('desde', 0) + i, resultado
+                    
+                    if respuesta.get('fin'):
+                        return
+            finally:
+                sock.close()
             
-            # Enviar tarea
-            tarea_json = json.dumps(tarea)
-            sock.sendall(tarea_json.encode('utf-8'))
+            self.esperar_reintento(intento, respuesta)
+    
+    def subir_partes(self, sock, partes, errores):
+        """Envía cada parte del texto de una tarea en flujo y la marca de fin"""
+        try:
+            for texto in partes:
+                enviar_mensaje(sock, FRAGMENTO, {'texto': texto, 'fin': False}, self.codec)
+            enviar_mensaje(sock, FRAGMENTO, {'fin': True}, self.codec)
+        except Exception as e:
+            # El servidor espera el resto del texto: se corta la conexión
+            errores.append(e)
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def enviar_en_flujo(self, operacion, partes=None, datos=None, al_recibir=None,
+                        prioridad=None, plazo=None):
+        """Envía una tarea con el texto y el resultado en flujo, sin que ningún
+        salto arme el cuerpo completo. `partes` es un iterable de textos (p. ej.
+        flujo.partes_de_archivo) que se envían a medida que se generan; sin él,
+        el texto va en `datos` como siempre. Cada parte del resultado se pasa a
+        al_recibir(parte) apenas llega y la respuesta trae 'formato' y 'partes'
+        en vez de 'resultado'; sin al_recibir, se arma el resultado al final"""
+        tarea = planificacion({'operacion': operacion, 'datos': datos or {},
+                               'salida_flujo': True}, prioridad, plazo)
+        if partes is not None:
+            tarea['entrada_flujo'] = True
+        
+        recibidas = []
+        errores = []
+        fallo = None
+        subida = None
+        sock = socket.create_connection((self.host, self.puerto))
+        try:
+            enviar_mensaje(sock, TAREA, tarea, self.codec)
+            if partes is not None:
+                # El texto sube desde otro hilo mientras este recibe el resultado
+                subida = threading.Thread(target=self.subir_partes,
+                                          args=(sock, partes, errores), daemon=True)
+                subida.start()
             
-            # Recibir resultado
-            data = sock.recv(4096).decode('utf-8')
-            resultado = json.loads(data)
+            lector = LectorMensajes(sock)
+            while True:
+                mensaje = lector.recibir()
+                if mensaje is None:
+                    raise ConnectionError("El servidor cerró la conexión a mitad del resultado")
+                tipo, respuesta = mensaje
+                if tipo == RESULTADO:
+                    break
+                (al_recibir or recibidas.append)(respuesta.get('parte', ''))
+        
+        except Exception as e:
+            # Cortar la conexión también termina la subida
+            fallo = e
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        
+        finally:
+            if subida is not None:
+                subida.join()
+            sock.close()
+        
+        # Si falló la subida, su error explica por qué se cortó la conexión
+        if errores or fallo is not None:
+            raise errores[0] if errores else fallo
+        if al_recibir is None and 'formato' in respuesta:
+            respuesta['resultado'] = armar_resultado(respuesta.pop('formato'), recibidas)
+        return respuesta
+    
+    def enviar_lote(self, tareas, prioridad=None, plazo=None):
+        """Envía una lista de (operacion, datos) en un solo mensaje y
+        retorna la lista de resultados en el mismo orden"""
+        try:
+            print(f"\n[ENVIANDO] Lote de {len(tareas)} tareas")
             
-            # Mostrar resultado
-            if resultado.get('estado') == 'completado':
-                print(f"[RESULTADO] ✓ {resultado.get('resultado')}")
-                print(f"[INFO] Procesado por: {resultado.get('worker', 'desconocido')}")
-            elif resultado.get('estado') == 'error':
-                print(f"[ERROR] ✗ {resultado.get('error')}")
-            elif resultado.get('estado') == 'timeout':
-                print(f"[TIMEOUT] ✗ {resultado.get('error')}")
+            resultados = [None] * len(tareas)
+            for indice, resultado in self.enviar_lote_flujo(tareas, prioridad, plazo):
+                resultados[indice] = resultado
             
-            sock.close()
-            return resultado
+            completadas = sum(1 for r in resultados if r and r.get('estado') == 'completado')
+            print(f"[RESULTADO] {completadas}/{len(tareas)} tareas completadas")
+            return resultados
         
         except ConnectionRefusedError:
             print("[ERROR] No se pudo conectar al servidor. ¿Está ejecutándose?")
@@ -56,6 +384,19 @@ class Cliente:
             print(f"[ERROR] {e}")
             return None
     
+    def estadisticas(self):
+        """Consulta los contadores del servidor (workers, cache, ...)"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((self.host, self.puerto))
+            enviar_mensaje(sock, ESTADISTICAS, {}, self.codec)
+            mensaje = LectorMensajes(sock).recibir()
+            sock.close()
+            return mensaje[1] if mensaje else None
+        except OSError as e:
+            print(f"[ERROR] {e}")
+            return None
+    
     def menu_interactivo(self):
         """Menú interactivo para enviar tareas"""
         print("\n" + "="*60)
@@ -166,13 +507,18 @@ class Cliente:
         
         inicio = time.time()
         
-        for operacion, datos in tareas:
-            self.enviar_tarea(operacion, datos)
-            time.sleep(0.5)  # Pequeña pausa entre tareas
+        # Todas en vuelo a la vez; se muestran a medida que terminan
+        futuros = {self.submit(operacion, datos): operacion for operacion, datos in tareas}
+        for futuro in self.as_completed(futuros):
+            print(f"\n[{futuros[futuro].upper()}]")
+            try:
+                mostrar_resultado(futuro.result())
+            except OSError as e:
+                print(f"[ERROR] {e}")
         
         fin = time.time()
         
-        print(f"\n[INFO] {len(tareas)} tareas enviadas en {fin - inicio:.2f} segundos")
+        print(f"\n[INFO] {len(tareas)} tareas completadas en {fin - inicio:.2f} segundos")
     
     def demo_automatica(self):
         """Ejecuta una demostración automática"""
@@ -188,19 +534,21 @@ class Cliente:
             ('inverso_texto', {'texto': 'Python'}, "Invertir: 'Python'"),
         ]
         
-        for operacion, datos, descripcion in demos:
+        futuros = [self.submit(operacion, datos) for operacion, datos, _ in demos]
+        for (_, _, descripcion), futuro in zip(demos, futuros):
             print(f"\n→ {descripcion}")
-            self.enviar_tarea(operacion, datos)
-            time.sleep(1)
+            try:
+                mostrar_resultado(futuro.result())
+            except OSError as e:
+                print(f"[ERROR] {e}")
         
         print("\n[DEMO] Demostración completada")
 
 if __name__ == '__main__':
     import sys
     
-    cliente = Cliente()
-    
-    if len(sys.argv) > 1 and sys.argv[1] == '--demo':
-        cliente.demo_automatica()
-    else:
-        cliente.menu_interactivo()
+    with Cliente() as cliente:
+        if len(sys.argv) > 1 and sys.argv[1] == '--demo':
+            cliente.demo_automatica()
+        else:
+            cliente.menu_interactivo()
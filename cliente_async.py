@@ -0,0 +1,124 @@
+"""
+Cliente asyncio del sistema de distribución de tareas
+Misma API que Cliente (submit, map, as_completed) pero con corrutinas y
+un pool de conexiones persistentes sobre streams
+"""
+
+import asyncio
+
+from cliente import (REINTENTOS_RECHAZO, CONEXIONES_POR_DEFECTO, planificacion,
+                     espera_reintento)
+from protocolo import TAREA, ESTADISTICAS, CONSULTA, CODECS, leer_mensaje, escribir_mensaje
+
+
+class ClienteAsync:
+    """Cliente para usar desde un event loop: cada tarea es una corrutina"""
+
+    def __init__(self, host='localhost', puerto=5000, reintentos=REINTENTOS_RECHAZO,
+                 codec='binario', conexiones=CONEXIONES_POR_DEFECTO):
+        self.host = host
+        self.puerto = puerto
+        self.reintentos = reintentos
+        self.codec = CODECS[codec]
+
+        # Conexiones (reader, writer) libres; a lo sumo `conexiones` tareas en vuelo
+        self.conexiones = conexiones
+        self.libres = []
+        self.limite = None
+        self.creadas = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excepcion):
+        await self.cerrar()
+
+    async def cerrar(self):
+        """Cierra las conexiones libres"""
+        libres, self.libres = self.libres, []
+        for _, writer in libres:
+            writer.close()
+        for _, writer in libres:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def tomar(self):
+        """Retorna ((reader, writer), reusada): una conexión libre o una nueva"""
+        if self.libres:
+            return self.libres.pop(), True
+        conexion = await asyncio.open_connection(self.host, self.puerto)
+        self.creadas += 1
+        return conexion, False
+
+    async def solicitar(self, tipo, mensaje):
+        """Envía un mensaje por una conexión del pool y retorna la respuesta"""
+        # El semáforo se crea en el loop que usa el cliente
+        if self.limite is None:
+            self.limite = asyncio.Semaphore(self.conexiones)
+
+        async with self.limite:
+            while True:
+                conexion, reusada = await self.tomar()
+                reader, writer = conexion
+                try:
+                    await escribir_mensaje(writer, tipo, mensaje, self.codec)
+                    respuesta = await leer_mensaje(reader)
+                    if respuesta is None:
+                        raise ConnectionError("El servidor cerró la conexión sin responder")
+                except BaseException as e:
+                    # También si cancelan la tarea: la respuesta quedaría sin leer
+                    writer.close()
+                    # Una conexión guardada puede estar cerrada del lado del servidor
+                    if reusada and isinstance(e, OSError):
+                        continue
+                    raise
+
+                self.libres.append(conexion)
+                return respuesta[1]
+
+    async def pedir(self, tarea):
+        """Envía una tarea, reintentando si el servidor la rechaza por sobrecarga"""
+        for intento in range(self.reintentos + 1):
+            resultado = await self.solicitar(TAREA, tarea)
+            if resultado.get('estado') != 'rechazado' or intento == self.reintentos:
+                return resultado
+            await asyncio.sleep(espera_reintento(intento, resultado))
+
+    async def enviar(self, operacion, datos, prioridad=None, plazo=None):
+        """Envía una tarea y retorna su resultado, reintentando si el servidor
+        la rechaza por sobrecarga"""
+        return await self.pedir(planificacion({'operacion': operacion, 'datos': datos},
+                                              prioridad, plazo))
+
+    async def enviar_con_ticket(self, operacion, datos, prioridad=None, plazo=None):
+        """Envía una tarea sin esperar su resultado: retorna la respuesta con
+        su 'ticket' (o el rechazo), para retirarlo después con consultar()"""
+        return await self.pedir(planificacion({'operacion': operacion, 'datos': datos,
+                                               'ticket': True}, prioridad, plazo))
+
+    async def consultar(self, tickets, espera=0):
+        """Resultados de los tickets en el mismo orden ('pendiente' si todavía
+        no terminó); con espera, el servidor aguarda hasta esos segundos"""
+        respuesta = await self.solicitar(CONSULTA, {'tickets': list(tickets), 'espera': espera})
+        return respuesta.get('resultados', [])
+
+    def submit(self, operacion, datos, prioridad=None, plazo=None):
+        """Programa una tarea en el loop actual; retorna un asyncio.Task"""
+        return asyncio.ensure_future(self.enviar(operacion, datos, prioridad, plazo))
+
+    async def map(self, operacion, lista_datos, prioridad=None, plazo=None):
+        """Envía una tarea por cada elemento (todas a la vez) y retorna la
+        lista de resultados en el mismo orden"""
+        return await asyncio.gather(*(self.enviar(operacion, datos, prioridad, plazo)
+                                      for datos in lista_datos))
+
+    @staticmethod
+    def as_completed(tareas, timeout=None):
+        """Awaitables de las tareas de submit() en el orden en que terminan"""
+        return asyncio.as_completed(tareas, timeout=timeout)
+
+    async def estadisticas(self):
+        """Consulta los contadores del servidor (workers, cache, ...)"""
+        return await self.solicitar(ESTADISTICAS, {})
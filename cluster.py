@@ -0,0 +1,214 @@
+"""
+Modo cluster: varios servidores que se reparten la cola
+Cada nodo atiende a sus propios clientes y workers. Un nodo con workers
+ociosos se conecta al puerto de workers de cada par como un worker más y
+anuncia como créditos su capacidad libre: el par le presta tareas solo
+cuando sus propios workers están llenos (robo de trabajo). El resultado
+vuelve por el mismo enlace al nodo que tiene al cliente, y el par aplica
+leases y reencolados como con cualquier worker
+"""
+
+import queue
+import socket
+import threading
+import time
+
+import bitacora
+from protocolo import (TAREA, RESULTADO, HOLA, LOTE, RESULTADO_LOTE, LATIDO, CODECS,
+                       CODEC_JSON, LectorMensajes, enviar_mensaje, ErrorProtocolo)
+
+# Cada cuánto un enlace revisa la capacidad libre del nodo y la anuncia al par
+INTERVALO_ANUNCIO = 0.05
+# Tope de tareas que un par le puede prestar a este nodo a la vez
+MAX_PRESTADAS = 32
+# Segundos entre intentos de reconexión con un par caído
+REINTENTO_CONEXION = 1.0
+
+log = bitacora.obtener('servidor.cluster')
+
+
+def leer_pares(texto):
+    """'host:5101,otro:5201' -> [('host', 5101), ('otro', 5201)]"""
+    pares = []
+    for parte in (texto or '').split(','):
+        if parte.strip():
+            host, _, puerto = parte.strip().rpartition(':')
+            pares.append((host or 'localhost', int(puerto)))
+    return pares
+
+
+class EsperaAjena:
+    """Espera de una tarea prestada por un par: al completarse, el resultado
+    vuelve por el enlace con el ID que la tarea tiene en su nodo de origen"""
+
+    def __init__(self, enlace, tarea_id, id_origen, tipo):
+        self.enlace = enlace
+        self.tarea_id = tarea_id
+        self.id_origen = id_origen
+        self.tipo = RESULTADO_LOTE if tipo == LOTE else RESULTADO
+        self.marcas = {}
+        self.ejecucion = None
+
+    def completar(self, resultado):
+        resultado = dict(resultado, id=self.id_origen)
+        # El par mide sus etapas con la ejecución que informó el worker
+        if self.ejecucion is not None:
+            resultado['ejecucion'] = self.ejecucion
+        self.enlace.devolver(self.tarea_id, self.tipo, resultado)
+
+
+class EnlacePar:
+    """Conexión saliente hacia el puerto de workers de un par. Recibe las
+    tareas que el par presta, las encola en este nodo y le devuelve los
+    resultados; se reconecta solo si el par se cae"""
+
+    def __init__(self, servidor, host, puerto):
+        self.servidor = servidor
+        self.host = host
+        self.puerto = puerto
+        self.nombre = f"{host}:{puerto}"
+
+        # Mensajes hacia el par (resultados y anuncios); una cola por conexión
+        self.salida = queue.Queue()
+        # IDs locales de las tareas prestadas sin responder
+        self.pendientes = set()
+        self.lock = threading.Lock()
+        self.conectado = False
+        self.capacidad = 0
+        self.recibidas = 0
+        self.devueltas = 0
+
+    def devolver(self, tarea_id, tipo, resultado):
+        """Envía al par el resultado de una de sus tareas (desde cualquier hilo)"""
+        with self.lock:
+            self.pendientes.discard(tarea_id)
+            self.devueltas += 1
+        self.salida.put((tipo, resultado))
+
+    def agregar_pendiente(self, tarea_id):
+        with self.lock:
+            self.pendientes.add(tarea_id)
+            self.recibidas += 1
+
+    def retirar_pendientes(self):
+        """Vacía y retorna los IDs locales de las tareas prestadas sin responder"""
+        with self.lock:
+            pendientes, self.pendientes = self.pendientes, set()
+        return pendientes
+
+    def anunciable(self):
+        """Créditos a anunciar: la parte de la capacidad libre del nodo que le
+        toca a este enlace, más lo que el par ya le prestó y sigue sin responder"""
+        with self.lock:
+            pendientes = len(self.pendientes)
+        return min(MAX_PRESTADAS, self.servidor.capacidad_para_pares() + pendientes)
+
+    def conectar(self):
+        """Abre la conexión y saluda como un worker que declara ser un par"""
+        sock = socket.create_connection((self.host, self.puerto), timeout=5)
+        sock.settimeout(None)
+        self.capacidad = self.anunciable()
+        enviar_mensaje(sock, HOLA, {
+            'nombre': f"par:{self.servidor.nombre_nodo}",
+            'capacidad': self.capacidad,
+            'operaciones': self.servidor.operaciones_conocidas(),
+            'codecs': list(CODECS),
+            'par': True,
+        })
+        lector = LectorMensajes(sock)
+        mensaje = lector.recibir()
+        if mensaje is None or mensaje[0] != HOLA:
+            raise ErrorProtocolo("El par no respondió el saludo")
+        codec = CODECS.get(mensaje[1].get('codec'), CODEC_JSON)
+        return sock, lector, codec, mensaje[1].get('latido')
+
+    def ejecutar(self):
+        """Hilo del enlace: conecta, atiende y reconecta para siempre"""
+        while True:
+            try:
+                sock, lector, codec, latido = self.conectar()
+            except (OSError, ErrorProtocolo) as e:
+                log.debug("Par %s no disponible: %s", self.nombre, e)
+                time.sleep(REINTENTO_CONEXION)
+                continue
+
+            log.info("Enlazado con el par %s", self.nombre)
+            self.conectado = True
+            self.salida = queue.Queue()
+            detener = threading.Event()
+            emisor = threading.Thread(target=self.enviar, args=(sock, codec, self.salida),
+                                      daemon=True)
+            anunciador = threading.Thread(target=self.anunciar, args=(latido, detener),
+                                          daemon=True)
+            emisor.start()
+            anunciador.start()
+            try:
+                self.recibir(lector)
+            except (OSError, ErrorProtocolo) as e:
+                log.error("Enlace con %s: %s", self.nombre, e)
+            finally:
+                self.conectado = False
+                detener.set()
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.salida.put(None)
+                emisor.join()
+                sock.close()
+                # El par reencola lo que tenía prestado aquí: ya nadie espera esos resultados
+                self.servidor.descartar_ajenas(self)
+                log.info("Enlace con el par %s cerrado", self.nombre)
+            time.sleep(REINTENTO_CONEXION)
+
+    def recibir(self, lector):
+        """Encola en este nodo cada tarea o sub-lote que presta el par"""
+        while True:
+            mensaje = lector.recibir()
+            if mensaje is None:
+                return
+            tipo, tarea = mensaje
+            if tipo not in (TAREA, LOTE):
+                raise ErrorProtocolo(f"Tipo de mensaje inesperado del par: {tipo}")
+            self.servidor.recibir_ajena(self, tipo, tarea)
+
+    def enviar(self, sock, codec, salida):
+        """Envía resultados y anuncios en orden, desde un único hilo"""
+        while True:
+            mensaje = salida.get()
+            if mensaje is None:
+                return
+            tipo, cuerpo = mensaje
+            try:
+                try:
+                    enviar_mensaje(sock, tipo, cuerpo, codec)
+                except ErrorProtocolo as e:
+                    # El resultado no entra en el codec: se informa el error en su lugar
+                    error = {'error': str(e), 'estado': 'error'}
+                    if tipo == RESULTADO_LOTE:
+                        error = {'resultados': [error] * len(cuerpo['resultados'])}
+                    enviar_mensaje(sock, tipo, dict(error, id=cuerpo['id']), codec)
+            except OSError:
+                return
+
+    def anunciar(self, latido, detener):
+        """Anuncia la capacidad libre cuando cambia; también sirve de latido"""
+        ultimo = time.monotonic()
+        while not detener.wait(INTERVALO_ANUNCIO):
+            capacidad = self.anunciable()
+            if capacidad != self.capacidad or (latido and time.monotonic() - ultimo >= latido):
+                self.capacidad = capacidad
+                ultimo = time.monotonic()
+                self.salida.put((LATIDO, {'capacidad': capacidad}))
+
+    def describir(self):
+        """Estado serializable para las estadísticas del nodo"""
+        with self.lock:
+            return {
+                'par': self.nombre,
+                'conectado': self.conectado,
+                'capacidad': self.capacidad,
+                'recibidas': self.recibidas,
+                'devueltas': self.devueltas,
+                'pendientes': len(self.pendientes),
+            }
@@ -0,0 +1,318 @@
+"""
+Diario (journal) de tareas
+Registro de solo-agregado de las tareas aceptadas, despachadas y completadas,
+para reencolar las que quedaron sin terminar si el servidor se reinicia. Un
+único hilo escribe y hace fsync por grupos: todas las tareas que llegan
+mientras se sincroniza un grupo viajan en el siguiente, así que el costo no
+es un fsync por tarea
+"""
+
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+import bitacora
+
+# Niveles de durabilidad: 'sincronica' espera el fsync antes de encolar la
+# tarea; 'diferida' sincroniza cada INTERVALO_DIFERIDO segundos y puede perder
+# las tareas del último intervalo si se cae la máquina
+DURABILIDADES = ('sincronica', 'diferida')
+INTERVALO_DIFERIDO = 0.05
+# Segundos entre reintentos cuando escribir o sincronizar el diario falla
+ESPERA_REINTENTO = 0.5
+
+# Al superar este tamaño el segmento se compacta: se abre uno nuevo con solo
+# las tareas vivas y se borran los anteriores
+TAMANO_SEGMENTO = 64 * 1024 * 1024
+
+PREFIJO_SEGMENTO = 'segmento-'
+
+log = bitacora.obtener('servidor.diario')
+
+# json.dumps con opciones arma un codificador nuevo en cada llamada
+_codificador = json.JSONEncoder(separators=(',', ':'))
+
+
+class Diario:
+    """Diario de tareas en un directorio de segmentos JSON (una línea por evento).
+    Thread-safe; la escritura y el fsync ocurren en un hilo propio"""
+
+    def __init__(self, directorio, durabilidad='sincronica', intervalo=INTERVALO_DIFERIDO,
+                 tamano_segmento=TAMANO_SEGMENTO):
+        if durabilidad not in DURABILIDADES:
+            raise ValueError(f"Durabilidad desconocida: {durabilidad}")
+        self.directorio = directorio
+        self.durabilidad = durabilidad
+        self.intervalo = intervalo
+        self.tamano_segmento = tamano_segmento
+
+        # Tareas aceptadas sin completar: id -> evento de aceptación con intentos;
+        # y el mayor ID aceptado, para no repetirlos tras un reinicio
+        self.vivas = {}
+        self.ultimo_id = 0
+        # Eventos por escribir y número de secuencia del último registrado y
+        # del último sincronizado en disco
+        self.pendientes = []
+        self.registrados = 0
+        self.durables = 0
+        # El escritor espera eventos y los clientes esperan el fsync: dos
+        # condiciones sobre el mismo lock para no despertarse entre sí
+        self.lock = threading.Lock()
+        self.hay_eventos = threading.Condition(self.lock)
+        self.sincronizado = threading.Condition(self.lock)
+        self.cerrado = False
+        # (secuencia, orden, función) a llamar cuando la secuencia esté en disco
+        self.avisos = []
+        self.orden_avisos = itertools.count()
+
+        self.archivo = None
+        self.numero_segmento = 0
+        self.hilo = None
+
+        self.grupos = 0
+        self.eventos = 0
+        self.compactaciones = 0
+        self.errores = 0
+
+    def segmentos(self):
+        """Números de los segmentos en disco, en orden"""
+        numeros = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith(PREFIJO_SEGMENTO) and nombre.endswith('.jsonl'):
+                numeros.append(int(nombre[len(PREFIJO_SEGMENTO):-len('.jsonl')]))
+        return sorted(numeros)
+
+    def ruta(self, numero):
+        return os.path.join(self.directorio, f"{PREFIJO_SEGMENTO}{numero:06d}.jsonl")
+
+    def leer_segmento(self, numero):
+        """Aplica los eventos de un segmento a las tareas vivas. Una última
+        línea cortada (caída a mitad de escritura) se ignora"""
+        with open(self.ruta(numero), 'rb') as f:
+            for linea in f:
+                try:
+                    evento = json.loads(linea)
+                except ValueError:
+                    log.warning("Segmento %d: línea incompleta ignorada", numero)
+                    continue
+                self.aplicar(evento)
+
+    def aplicar(self, evento):
+        tipo = evento['e']
+        if tipo == 'a':
+            self.vivas[evento['tarea']['id']] = evento
+            self.ultimo_id = max(self.ultimo_id, evento['tarea']['id'])
+        elif tipo == 'h':
+            self.ultimo_id = max(self.ultimo_id, evento['ultimo_id'])
+        elif tipo == 'd' and evento['id'] in self.vivas:
+            self.vivas[evento['id']]['intentos'] = self.vivas[evento['id']].get('intentos', 0) + 1
+        elif tipo == 'c':
+            self.vivas.pop(evento['id'], None)
+
+    def abrir(self):
+        """Lee los segmentos existentes, compacta y empieza a escribir.
+        Retorna (tareas sin completar, mayor ID visto); a cada tarea se le
+        restaura el plazo y la cantidad de veces que ya se despachó"""
+        os.makedirs(self.directorio, exist_ok=True)
+        anteriores = self.segmentos()
+        for numero in anteriores:
+            self.leer_segmento(numero)
+
+        self.numero_segmento = anteriores[-1] if anteriores else 0
+        self.compactar(self.foto(), self.ultimo_id, anteriores)
+
+        self.hilo = threading.Thread(target=self.escribir, daemon=True)
+        self.hilo.start()
+
+        tareas = []
+        for evento in self.vivas.values():
+            tarea = dict(evento['tarea'])
+            if evento.get('vence') is not None:
+                tarea['vence'] = time.monotonic() + evento['vence'] - time.time()
+            tarea['intentos'] = evento.get('intentos', 0)
+            tareas.append(tarea)
+        return tareas, self.ultimo_id
+
+    def foto(self):
+        """Copia de los eventos de las tareas vivas (desde el hilo escritor una vez abierto)"""
+        return [dict(evento) for evento in self.vivas.values()]
+
+    def compactar(self, vivas, ultimo_id, anteriores):
+        """Abre un segmento nuevo con la foto de las tareas vivas y borra los
+        anteriores. Corre en el hilo escritor (o antes de arrancarlo)"""
+        self.numero_segmento += 1
+        archivo = open(self.ruta(self.numero_segmento), 'ab')
+        # La cabecera conserva el mayor ID aunque ya no quede ninguna tarea viva
+        lineas = [self.linea({'e': 'h', 'ultimo_id': ultimo_id})]
+        lineas += [self.linea(evento) for evento in vivas]
+        try:
+            archivo.write(b''.join(lineas))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        except OSError:
+            archivo.close()
+            raise
+
+        if self.archivo is not None:
+            self.archivo.close()
+        self.archivo = archivo
+        for numero in anteriores:
+            os.remove(self.ruta(numero))
+        self.sincronizar_directorio()
+        if anteriores:
+            self.compactaciones += 1
+            log.info("Compactado: %d tareas vivas en el segmento %d",
+                     len(vivas), self.numero_segmento)
+
+    def sincronizar_directorio(self):
+        """fsync del directorio para que las altas y bajas de archivos persistan"""
+        try:
+            descriptor = os.open(self.directorio, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
+
+    def linea(self, evento):
+        return _codificador.encode(evento).encode() + b'\n'
+
+    def registrar(self, evento):
+        """Agrega un evento y retorna su número de secuencia. Serializarlo y
+        aplicarlo a las vivas queda para el hilo escritor: quien registra
+        (p. ej. el despachador) solo toma el lock y agrega a la lista"""
+        with self.lock:
+            self.pendientes.append(evento)
+            self.registrados += 1
+            # En modo diferido el escritor despierta solo por tiempo
+            if self.durabilidad == 'sincronica':
+                self.hay_eventos.notify()
+            return self.registrados
+
+    def aceptada(self, tarea):
+        """Registra una tarea (o sub-lote) aceptada; el plazo se guarda en hora
+        de reloj porque el monotónico no sobrevive a un reinicio"""
+        datos = {clave: valor for clave, valor in tarea.items() if clave != 'vence'}
+        vence = tarea.get('vence')
+        if vence is not None:
+            vence = time.time() + vence - time.monotonic()
+        return self.registrar({'e': 'a', 'tarea': datos, 'vence': vence})
+
+    def despachada(self, tarea_id, worker):
+        return self.registrar({'e': 'd', 'id': tarea_id, 'worker': worker})
+
+    def completada(self, tarea_id, estado):
+        return self.registrar({'e': 'c', 'id': tarea_id, 'estado': estado})
+
+    def esperar(self, secuencia):
+        """Bloquea hasta que el evento `secuencia` esté en disco (en modo
+        'sincronica'; en 'diferida' retorna enseguida)"""
+        if secuencia is None or self.durabilidad != 'sincronica':
+            return
+        with self.lock:
+            self.sincronizado.wait_for(lambda: self.durables >= secuencia or self.cerrado)
+
+    def al_sincronizar(self, secuencia, funcion):
+        """Llama a funcion() (desde el hilo escritor) cuando el evento
+        `secuencia` esté en disco; enseguida si ya lo está o no hay que esperar"""
+        if secuencia is not None and self.durabilidad == 'sincronica':
+            with self.lock:
+                if self.durables < secuencia and not self.cerrado:
+                    heapq.heappush(self.avisos, (secuencia, next(self.orden_avisos), funcion))
+                    return
+        funcion()
+
+    def serializar(self, grupo):
+        """Líneas de los eventos del grupo, aplicándolos a las tareas vivas.
+        Un evento que no se puede serializar se descarta: esa tarea sigue,
+        pero sin durabilidad"""
+        lineas = []
+        for evento in grupo:
+            try:
+                lineas.append(self.linea(evento))
+            except (TypeError, ValueError) as e:
+                log.warning("Evento no serializable en el diario: %s", e)
+                continue
+            self.aplicar(evento)
+        return lineas
+
+    def escribir(self):
+        """Hilo escritor: escribe y sincroniza los eventos pendientes por grupos.
+        Solo este hilo modifica las tareas vivas una vez abierto el diario.
+        Si escribir o sincronizar falla, nada se da por durable y se reintenta"""
+        reescribir = False
+        while True:
+            with self.lock:
+                if reescribir:
+                    self.hay_eventos.wait(ESPERA_REINTENTO)
+                elif self.durabilidad == 'diferida':
+                    self.hay_eventos.wait(self.intervalo)
+                else:
+                    self.hay_eventos.wait_for(lambda: self.pendientes or self.cerrado)
+                grupo, self.pendientes = self.pendientes, []
+                hasta = self.registrados
+                cerrado = self.cerrado
+
+            lineas = self.serializar(grupo)
+            try:
+                # Al compactar, la foto de las vivas ya incluye este grupo. Tras
+                # un error no se sabe qué quedó en el segmento (un fsync fallido
+                # puede descartar lo escrito): se compacta en uno nuevo
+                if reescribir or (lineas and self.archivo.tell() + sum(map(len, lineas))
+                                  > self.tamano_segmento):
+                    anteriores = [n for n in self.segmentos() if n <= self.numero_segmento]
+                    self.compactar(self.foto(), self.ultimo_id, anteriores)
+                elif lineas:
+                    self.archivo.write(b''.join(lineas))
+                    self.archivo.flush()
+                    os.fsync(self.archivo.fileno())
+                reescribir = False
+            except OSError as e:
+                self.errores += 1
+                reescribir = True
+                log.error("Escribiendo el diario (se reintenta en %gs): %s", ESPERA_REINTENTO, e)
+
+            listos = []
+            with self.lock:
+                if not reescribir:
+                    if lineas:
+                        self.grupos += 1
+                        self.eventos += len(lineas)
+                    self.durables = hasta
+                    self.sincronizado.notify_all()
+                while self.avisos and (self.avisos[0][0] <= self.durables or cerrado):
+                    listos.append(heapq.heappop(self.avisos)[2])
+            for funcion in listos:
+                funcion()
+            if cerrado:
+                return
+
+    def cerrar(self):
+        """Escribe lo pendiente y detiene el hilo escritor"""
+        with self.lock:
+            self.cerrado = True
+            self.hay_eventos.notify_all()
+        if self.hilo is not None:
+            self.hilo.join()
+        if self.archivo is not None:
+            self.archivo.close()
+
+    def estadisticas(self):
+        """Tareas vivas, eventos y grupos escritos (eventos por fsync)"""
+        with self.lock:
+            return {
+                'durabilidad': self.durabilidad,
+                'vivas': len(self.vivas),
+                'eventos': self.eventos,
+                'grupos': self.grupos,
+                'eventos_por_grupo': self.eventos / self.grupos if self.grupos else 0.0,
+                'segmento': self.numero_segmento,
+                'compactaciones': self.compactaciones,
+                'errores': self.errores,
+            }
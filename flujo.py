@@ -0,0 +1,61 @@
+"""
+Tareas con el texto o el resultado en flujo
+En vez de un único mensaje, el texto de una tarea y su resultado viajan como
+una secuencia de mensajes FRAGMENTO: ningún salto arma el cuerpo completo.
+Cada salto guarda a lo sumo VENTANA_FLUJO partes por tarea y, cuando se
+llena, deja de leer del anterior (que queda frenado por TCP)
+"""
+
+# Partes de una tarea que un salto guarda o tiene por enviar, en cada sentido
+VENTANA_FLUJO = 8
+# Caracteres por parte al partir un resultado (o un texto del cliente)
+TAMANO_PARTE = 256 * 1024
+
+
+class ParteFlujo:
+    """Parte del texto de una tarea en la cola de envío de un worker. Al
+    salir, libera su lugar en la ventana de la espera que la reenvió"""
+
+    __slots__ = ('mensaje', 'espera')
+
+    def __init__(self, mensaje, espera=None):
+        self.mensaje = mensaje
+        self.espera = espera
+
+    def enviada(self):
+        if self.espera is not None:
+            self.espera.enviada()
+
+
+def cancelacion(tarea_id):
+    """Última parte que se le envía a un worker cuando el texto no llega
+    completo (error, plazo vencido o cliente desconectado)"""
+    return ParteFlujo({'id': tarea_id, 'fin': True, 'cancelada': True})
+
+
+def partir_resultado(resultado, tamano=TAMANO_PARTE):
+    """(formato, partes) para enviar un resultado en flujo: un texto en partes
+    de `tamano` caracteres y un entero en dígitos hexadecimales (pasarlo a
+    base 16 es lineal; a decimal, cuadrático). Otros valores: (None, ())"""
+    if isinstance(resultado, int) and not isinstance(resultado, bool):
+        texto, formato = format(resultado, 'x'), 'hex'
+    elif isinstance(resultado, str):
+        texto, formato = resultado, 'texto'
+    else:
+        return None, ()
+    return formato, (texto[desde:desde + tamano] for desde in range(0, len(texto), tamano))
+
+
+def armar_resultado(formato, partes):
+    """Resultado completo a partir de las partes recibidas"""
+    texto = ''.join(partes)
+    return int(texto, 16) if formato == 'hex' else texto
+
+
+def partes_de_archivo(archivo, tamano=TAMANO_PARTE):
+    """Genera el contenido de un archivo de texto abierto de a `tamano` caracteres"""
+    while True:
+        texto = archivo.read(tamano)
+        if not texto:
+            return
+        yield texto
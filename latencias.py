@@ -0,0 +1,162 @@
+"""
+Latencias recientes por operación
+Ventana deslizante de muestras para estimar percentiles sin guardar historia,
+e histograma acumulado para percentiles de cola sobre muchas mediciones
+"""
+
+import math
+import threading
+from collections import deque
+
+# Muestras que se conservan por operación
+MUESTRAS_POR_OPERACION = 256
+# Con menos muestras el percentil no es confiable y no se informa
+MINIMO_MUESTRAS = 20
+
+# Rango y error relativo de las cubetas del histograma (segundos)
+HISTOGRAMA_MINIMO = 1e-6
+HISTOGRAMA_MAXIMO = 600.0
+HISTOGRAMA_PRECISION = 0.01
+
+# Percentiles que resume un histograma
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+
+class LatenciasOperacion:
+    """Percentiles de las últimas latencias (segundos) de cada operación"""
+
+    def __init__(self, muestras=MUESTRAS_POR_OPERACION, minimo=MINIMO_MUESTRAS):
+        self.muestras = muestras
+        self.minimo = minimo
+        self.ventanas = {}
+        # Copia ordenada de cada ventana; se rehace solo si llegaron muestras
+        self.ordenadas = {}
+        self.lock = threading.Lock()
+
+    def registrar(self, operacion, segundos):
+        """Agrega una muestra de latencia para la operación"""
+        with self.lock:
+            ventana = self.ventanas.get(operacion)
+            if ventana is None:
+                ventana = self.ventanas[operacion] = deque(maxlen=self.muestras)
+            ventana.append(segundos)
+            self.ordenadas.pop(operacion, None)
+
+    def percentil(self, operacion, p):
+        """Percentil p (0-100) de la operación, o None si hay pocas muestras"""
+        with self.lock:
+            ventana = self.ventanas.get(operacion)
+            if ventana is None or len(ventana) < self.minimo:
+                return None
+            ordenadas = self.ordenadas.get(operacion)
+            if ordenadas is None:
+                ordenadas = self.ordenadas[operacion] = sorted(ventana)
+        indice = min(int(len(ordenadas) * p / 100), len(ordenadas) - 1)
+        return ordenadas[indice]
+
+    def estadisticas(self):
+        """p50/p95/p99 y cantidad de muestras de cada operación con datos suficientes"""
+        with self.lock:
+            operaciones = list(self.ventanas)
+        resumen = {}
+        for operacion in operaciones:
+            if self.percentil(operacion, 50) is None:
+                continue
+            resumen[operacion] = {
+                'p50': self.percentil(operacion, 50),
+                'p95': self.percentil(operacion, 95),
+                'p99': self.percentil(operacion, 99),
+                'muestras': len(self.ventanas[operacion]),
+            }
+        return resumen
+
+
+class Histograma:
+    """Cantidad de mediciones por cubeta logarítmica: cada cubeta es un
+    `precision` más ancha que la anterior, así que cualquier percentil se
+    obtiene con ese error relativo y memoria fija, sin guardar las muestras"""
+
+    def __init__(self, minimo=HISTOGRAMA_MINIMO, maximo=HISTOGRAMA_MAXIMO,
+                 precision=HISTOGRAMA_PRECISION):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.precision = precision
+        self.factor = math.log1p(precision)
+        self.ultima = self._cubeta(maximo)
+        self.cubetas = [0] * (self.ultima + 1)
+        self.cantidad = 0
+        self.suma = 0.0
+        self.mayor = 0.0
+        self.menor = None
+        self.lock = threading.Lock()
+
+    def _cubeta(self, valor):
+        if valor <= self.minimo:
+            return 0
+        return int(math.log(valor / self.minimo) / self.factor) + 1
+
+    def registrar(self, valor):
+        """Agrega una medición (los valores fuera de rango van a los extremos)"""
+        # Se registra en cada etapa de cada tarea: sin llamadas evitables
+        if valor > self.minimo:
+            indice = int(math.log(valor / self.minimo) / self.factor) + 1
+            if indice > self.ultima:
+                indice = self.ultima
+        else:
+            indice = 0
+        with self.lock:
+            self.cubetas[indice] += 1
+            self.cantidad += 1
+            self.suma += valor
+            if valor > self.mayor:
+                self.mayor = valor
+            if self.menor is None or valor < self.menor:
+                self.menor = valor
+
+    def combinar(self, otro):
+        """Suma las mediciones de otro histograma con las mismas cubetas"""
+        with self.lock:
+            for i, cantidad in enumerate(otro.cubetas):
+                self.cubetas[i] += cantidad
+            self.cantidad += otro.cantidad
+            self.suma += otro.suma
+            self.mayor = max(self.mayor, otro.mayor)
+            if otro.menor is not None:
+                self.menor = otro.menor if self.menor is None else min(self.menor, otro.menor)
+
+    def percentil(self, p):
+        """Percentil p (0-100), o None si no hay mediciones"""
+        with self.lock:
+            if not self.cantidad:
+                return None
+            objetivo = max(1, math.ceil(self.cantidad * p / 100))
+            acumulado = 0
+            for indice, cantidad in enumerate(self.cubetas):
+                acumulado += cantidad
+                if acumulado >= objetivo:
+                    break
+            # Límite superior de la cubeta, sin pasarse del mayor valor visto
+            return min(self.minimo * math.exp(self.factor * indice), self.mayor)
+
+    def acumulados(self, limites):
+        """(cantidades <= cada límite, cantidad, suma) en una sola lectura, para
+        exportar con cubetas fijas; el error de cada límite es el de su cubeta"""
+        indices = [min(self._cubeta(limite), self.ultima) for limite in limites]
+        with self.lock:
+            acumulados = []
+            acumulado = 0
+            desde = 0
+            for indice in indices:
+                acumulado += sum(self.cubetas[desde:indice + 1])
+                desde = indice + 1
+                acumulados.append(acumulado)
+            return acumulados, self.cantidad, self.suma
+
+    def resumen(self):
+        """Cantidad, media, extremos y percentiles de cola (segundos)"""
+        resumen = {'cantidad': self.cantidad,
+                   'media': self.suma / self.cantidad if self.cantidad else None,
+                   'min': self.menor, 'max': self.mayor if self.cantidad else None}
+        for nombre, p in PERCENTILES:
+            resumen[nombre] = self.percentil(p)
+        return resumen
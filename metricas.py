@@ -0,0 +1,156 @@
+"""
+Métricas del servidor
+Histogramas de latencia por etapa y operación y contadores, expuestos en
+formato de texto de Prometheus en un puerto aparte. Registrar una medición
+cuesta un logaritmo y un lock, así que quedan siempre activas
+"""
+
+import threading
+
+from latencias import Histograma
+
+PUERTO_METRICAS = 5002
+
+# Etapas de una tarea en el servidor: (nombre, marca inicial, marca final).
+# Las marcas son instantes monotónicos que se anotan en la espera de la tarea
+ETAPAS = (
+    ('admision', 'aceptada', 'encolada'),
+    ('cola', 'encolada', 'despachada'),
+    ('worker', 'despachada', 'resultado'),
+    ('entrega', 'resultado', 'respondida'),
+    ('total', 'aceptada', 'respondida'),
+)
+
+# Límites (segundos) de las cubetas que se exportan; el histograma interno es
+# mucho más fino y se resume en estos al exponer
+LIMITES_EXPORTADOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                      0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Descripción de los contadores que registra el servidor
+AYUDA_CONTADORES = {
+    'tareas_respondidas': 'Tareas y sub-lotes respondidos por operación y estado',
+    'tareas_prestadas': 'Tareas y sub-lotes prestados a otros nodos del cluster',
+    'tareas_ajenas': 'Tareas y sub-lotes tomados prestados de otros nodos del cluster',
+    'tareas_fragmentadas': 'Tareas de texto grande repartidas en fragmentos entre los workers',
+    'tareas_coalescidas': 'Tareas respondidas con el resultado de otra igual ya en curso',
+}
+
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def etiquetas_texto(etiquetas):
+    """{'a': 'x'} -> '{a="x"}' con los valores escapados"""
+    if not etiquetas:
+        return ''
+    partes = []
+    for nombre, valor in etiquetas.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+def formatear_familia(nombre, tipo, ayuda, muestras):
+    """Líneas de una métrica simple: muestras es una lista de (etiquetas, valor)"""
+    lineas = [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+    for etiquetas, valor in muestras:
+        lineas.append(f"{nombre}{etiquetas_texto(etiquetas)} {valor:g}")
+    return lineas
+
+
+def orden_etiquetas(item):
+    """Orden de (clave, valor) por el texto de la clave: una etiqueta que no es
+    texto no impide ordenar las demás"""
+    return tuple(map(str, item[0]))
+
+
+class Metricas:
+    """Histogramas por (etapa, operación) y contadores con etiquetas; thread-safe"""
+
+    def __init__(self):
+        self.histogramas = {}
+        self.contadores = {}
+        self.lock = threading.Lock()
+
+    def observar(self, etapa, operacion, segundos):
+        """Agrega una medición de la etapa para la operación"""
+        histograma = self.histogramas.get((etapa, operacion))
+        if histograma is None:
+            with self.lock:
+                histograma = self.histogramas.setdefault((etapa, operacion), Histograma())
+        histograma.registrar(segundos)
+
+    def registrar_tarea(self, operacion, marcas, ejecucion=None):
+        """Mide las etapas de una tarea respondida a partir de sus marcas.
+        `ejecucion` son los segundos que midió el worker; el resto del tiempo
+        en el worker es red y espera en su pool"""
+        for etapa, desde, hasta in ETAPAS:
+            if desde in marcas and hasta in marcas:
+                self.observar(etapa, operacion, marcas[hasta] - marcas[desde])
+        if ejecucion is not None:
+            self.observar('ejecucion', operacion, ejecucion)
+            if 'despachada' in marcas and 'resultado' in marcas:
+                en_worker = marcas['resultado'] - marcas['despachada']
+                self.observar('red', operacion, max(0.0, en_worker - ejecucion))
+
+    def contar(self, nombre, cantidad=1, **etiquetas):
+        """Suma al contador `nombre` con esas etiquetas"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self.lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+
+    def resumen(self):
+        """{etapa: {operación: p50/p99/cantidad}} para las estadísticas del servidor"""
+        with self.lock:
+            histogramas = list(self.histogramas.items())
+        resumen = {}
+        for (etapa, operacion), histograma in sorted(histogramas, key=orden_etiquetas):
+            resumen.setdefault(etapa, {})[operacion] = {
+                'p50': histograma.percentil(50),
+                'p99': histograma.percentil(99),
+                'cantidad': histograma.cantidad,
+            }
+        return resumen
+
+    def exponer(self, medidores=()):
+        """Texto en formato Prometheus: los histogramas, los contadores propios
+        y los `medidores` del servidor, (nombre, tipo, ayuda, muestras)"""
+        with self.lock:
+            histogramas = sorted(self.histogramas.items(), key=orden_etiquetas)
+            contadores = sorted(self.contadores.items(), key=orden_etiquetas)
+
+        lineas = ["# HELP tareas_etapa_segundos Latencia de cada etapa de una tarea",
+                  "# TYPE tareas_etapa_segundos histogram"]
+        for (etapa, operacion), histograma in histogramas:
+            acumulados, cantidad, suma = histograma.acumulados(LIMITES_EXPORTADOS)
+            etiquetas = {'etapa': etapa, 'operacion': operacion}
+            for limite, acumulado in zip(LIMITES_EXPORTADOS, acumulados):
+                texto = etiquetas_texto(dict(etiquetas, le=f'{limite:g}'))
+                lineas.append(f"tareas_etapa_segundos_bucket{texto} {acumulado}")
+            texto = etiquetas_texto(dict(etiquetas, le='+Inf'))
+            lineas.append(f"tareas_etapa_segundos_bucket{texto} {cantidad}")
+            lineas.append(f"tareas_etapa_segundos_sum{etiquetas_texto(etiquetas)} {suma:g}")
+            lineas.append(f"tareas_etapa_segundos_count{etiquetas_texto(etiquetas)} {cantidad}")
+
+        familias = {}
+        for (nombre, etiquetas), valor in contadores:
+            familias.setdefault(nombre, []).append((dict(etiquetas), valor))
+        for nombre, muestras in familias.items():
+            lineas += formatear_familia(f"{nombre}_total", 'counter',
+                                        AYUDA_CONTADORES.get(nombre, nombre), muestras)
+
+        for nombre, tipo, ayuda, muestras in medidores:
+            lineas += formatear_familia(nombre, tipo, ayuda, muestras)
+        return '\n'.join(lineas) + '\n'
+
+
+def respuesta_http(peticion, generar):
+    """Bytes de la respuesta a una petición HTTP: `generar()` en /metrics"""
+    partes = peticion.split(b' ', 2)
+    ruta = partes[1].split(b'?')[0] if len(partes) > 1 else b''
+    if partes[0] == b'GET' and ruta in (b'/', b'/metrics'):
+        estado, cuerpo = '200 OK', generar().encode()
+    else:
+        estado, cuerpo = '404 Not Found', b'Solo se expone GET /metrics\n'
+    cabecera = (f"HTTP/1.1 {estado}\r\nContent-Type: {TIPO_CONTENIDO}\r\n"
+                f"Content-Length: {len(cuerpo)}\r\nConnection: close\r\n\r\n")
+    return cabecera.encode() + cuerpo
@@ -0,0 +1,112 @@
+"""
+Núcleos numéricos del worker
+Fibonacci por duplicación rápida, Miller-Rabin y criba de primos pequeños
+"""
+
+import random
+
+# Criba compartida: se usa para descartar rápido divisores pequeños
+LIMITE_CRIBA = 1000
+
+
+def primos_hasta(limite):
+    """Criba de Eratóstenes: lista de primos <= limite"""
+    if limite < 2:
+        return []
+    es_primo = bytearray([1]) * (limite + 1)
+    es_primo[0] = es_primo[1] = 0
+    for i in range(2, int(limite ** 0.5) + 1):
+        if es_primo[i]:
+            es_primo[i * i::i] = bytes(len(range(i * i, limite + 1, i)))
+    return [i for i, primo in enumerate(es_primo) if primo]
+
+
+PRIMOS_PEQUENOS = primos_hasta(LIMITE_CRIBA)
+CONJUNTO_PRIMOS_PEQUENOS = frozenset(PRIMOS_PEQUENOS)
+
+# Por debajo de LIMITE_CRIBA² la división por los primos de la criba es exacta
+LIMITE_DIVISION = LIMITE_CRIBA * LIMITE_CRIBA
+
+# Divisores pequeños que se prueban antes de Miller-Rabin en números grandes
+PRIMOS_FILTRO = [p for p in PRIMOS_PEQUENOS if p < 100]
+
+# (límite, bases): Miller-Rabin con esas bases es determinista para n < límite.
+# La última fila cubre todo el rango de 64 bits.
+BASES_DETERMINISTAS = (
+    (3215031751, (2, 3, 5, 7)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051, (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+)
+
+# Rondas extra con bases aleatorias para números más grandes
+RONDAS_PROBABILISTAS = 20
+
+
+def _pasa_miller_rabin(n, d, s, a):
+    """Una ronda de Miller-Rabin con base a, donde n - 1 = d * 2^s"""
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def es_primo(n):
+    """Verifica si n es primo (determinista hasta 64 bits, probabilístico más arriba)"""
+    if n != int(n):
+        return False
+    n = int(n)
+
+    if n <= LIMITE_CRIBA:
+        return n in CONJUNTO_PRIMOS_PEQUENOS
+
+    if n < LIMITE_DIVISION:
+        for p in PRIMOS_PEQUENOS:
+            if p * p > n:
+                return True
+            if n % p == 0:
+                return False
+        return True
+
+    for p in PRIMOS_FILTRO:
+        if n % p == 0:
+            return False
+
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    for limite, bases in BASES_DETERMINISTAS:
+        if n < limite:
+            return all(_pasa_miller_rabin(n, d, s, a) for a in bases)
+
+    # Fuera del rango determinista: bases fijas más rondas aleatorias
+    bases = BASES_DETERMINISTAS[-1][1]
+    if not all(_pasa_miller_rabin(n, d, s, a) for a in bases):
+        return False
+    return all(_pasa_miller_rabin(n, d, s, random.randrange(2, n - 1))
+               for _ in range(RONDAS_PROBABILISTAS))
+
+
+def fibonacci(n):
+    """Calcula el n-ésimo número de Fibonacci en O(log n) multiplicaciones"""
+    n = int(n)
+    if n <= 0:
+        return 0
+
+    # Invariante: a = F(k), b = F(k + 1) recorriendo los bits de n
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        c = a * (2 * b - a)   # F(2k)
+        d = a * a + b * b     # F(2k + 1)
+        if bit == '1':
+            a, b = d, c + d
+        else:
+            a, b = c, d
+    return a
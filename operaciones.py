@@ -0,0 +1,321 @@
+"""
+Registro de operaciones
+Cada operación declara su handler y metadatos: si es pura, si conviene
+cachearla, si es de CPU o de E/S, su costo estimado y una latencia simulada
+"""
+
+import math
+import re
+import time
+
+from numerico import es_primo, fibonacci
+
+# Costo (en segundos estimados) cuando no se puede calcular a partir de los datos
+COSTO_DESCONOCIDO = 1e-3
+COSTO_TRIVIAL = 1e-6
+
+# Caracteres por fragmento al repartir un texto grande entre workers
+TAMANO_FRAGMENTO = 1024 * 1024
+
+
+class Operacion:
+    """Handler de una operación y sus metadatos"""
+
+    def __init__(self, nombre, funcion, pura=False, cacheable=False, tipo='cpu',
+                 costo=None, latencia=0.0, partir=None, combinar=None, en_flujo=None):
+        self.nombre = nombre
+        self.funcion = funcion
+        # Pura: mismos datos => mismo resultado y sin efectos (idempotente)
+        self.pura = pura
+        # Cacheable: pura y lo bastante cara como para que guardarla valga la pena
+        self.cacheable = pura and cacheable
+        # 'cpu' o 'io': decide si vale la pena mandarla a otro proceso
+        self.tipo = tipo
+        self.costo = costo
+        # Retardo artificial tras ejecutar, para simular trabajo (0 = ninguno)
+        self.latencia = latencia
+        # Reparto de un texto grande: partir(texto, tamano) -> fragmentos y
+        # combinar(resultados de cada fragmento, en orden) -> resultado
+        self.partir = partir
+        self.combinar = combinar
+        # Texto en flujo: en_flujo(datos) -> procesador que consume el texto de a
+        # partes (ver MayusculasEnFlujo); None si necesita el texto completo
+        self.en_flujo = en_flujo
+
+    def costo_estimado(self, datos):
+        """Segundos estimados para ejecutar la operación con estos datos"""
+        if self.costo is None:
+            return COSTO_TRIVIAL
+        try:
+            return self.costo(datos)
+        except (TypeError, ValueError, OverflowError, AttributeError):
+            return COSTO_DESCONOCIDO
+
+    def describir(self):
+        """Metadatos serializables para intercambiar con el servidor"""
+        return {
+            'pura': self.pura,
+            'cacheable': self.cacheable,
+            'tipo': self.tipo,
+            'latencia': self.latencia,
+            'en_flujo': self.en_flujo is not None,
+        }
+
+
+REGISTRO = {}
+
+
+def operacion(nombre, pura=False, cacheable=False, tipo='cpu', costo=None,
+              partir=None, combinar=None, en_flujo=None):
+    """Decorador que registra una función como handler de una operación"""
+    def registrar(funcion):
+        REGISTRO[nombre] = Operacion(nombre, funcion, pura=pura, cacheable=cacheable,
+                                     tipo=tipo, costo=costo, partir=partir,
+                                     combinar=combinar, en_flujo=en_flujo)
+        return funcion
+    return registrar
+
+
+def obtener(nombre):
+    """Operación registrada con ese nombre (ValueError si no existe)"""
+    op = REGISTRO.get(nombre)
+    if op is None:
+        raise ValueError(f"Operación desconocida: {nombre}")
+    return op
+
+
+def ejecutar(nombre, datos):
+    """Ejecuta una operación y retorna su resultado (lanza excepción si falla)"""
+    return obtener(nombre).funcion(datos)
+
+
+def costo_estimado(nombre, datos):
+    """Costo estimado de una operación; COSTO_DESCONOCIDO si no está registrada"""
+    op = REGISTRO.get(nombre)
+    if op is None:
+        return COSTO_DESCONOCIDO
+    return op.costo_estimado(datos)
+
+
+def operaciones_cacheables():
+    """Nombres de las operaciones cuyo resultado conviene cachear"""
+    return {nombre for nombre, op in REGISTRO.items() if op.cacheable}
+
+
+def fragmentar(nombre, datos, tamano=TAMANO_FRAGMENTO):
+    """Datos de cada fragmento si la operación se puede repartir y su texto
+    supera `tamano` caracteres; None si va entera a un worker"""
+    op = REGISTRO.get(nombre)
+    texto = datos.get('texto') if isinstance(datos, dict) else None
+    if op is None or op.partir is None or not isinstance(texto, str) or len(texto) <= tamano:
+        return None
+    fragmentos = op.partir(texto, tamano)
+    if len(fragmentos) < 2:
+        return None
+    return [dict(datos, texto=fragmento) for fragmento in fragmentos]
+
+
+def combinar(nombre, parciales):
+    """Resultado de la operación a partir de los de sus fragmentos, en orden"""
+    return obtener(nombre).combinar(parciales)
+
+
+def procesador_en_flujo(nombre, datos):
+    """Procesador que consume el texto de la operación de a partes
+    (ValueError si la operación necesita el texto completo)"""
+    op = obtener(nombre)
+    if op.en_flujo is None:
+        raise ValueError(f"La operación {nombre} no admite el texto en flujo")
+    return op.en_flujo(datos)
+
+
+def configurar_latencia(nombre, segundos):
+    """Fija la latencia simulada de una operación ('*' para todas)"""
+    if nombre == '*':
+        for op in REGISTRO.values():
+            op.latencia = segundos
+    else:
+        obtener(nombre).latencia = segundos
+
+
+def describir():
+    """Registro completo en forma serializable: {nombre: metadatos}"""
+    return {nombre: op.describir() for nombre, op in REGISTRO.items()}
+
+
+# --- Reparto de textos grandes ---------------------------------------------
+
+_ESPACIO = re.compile(r'\s')
+
+
+def partir_en_espacios(texto, tamano):
+    """Fragmentos de unos `tamano` caracteres cortados justo antes de un
+    espacio, para no partir ninguna palabra (si no hay, queda entero)"""
+    fragmentos = []
+    inicio = 0
+    while len(texto) - inicio > tamano:
+        espacio = _ESPACIO.search(texto, inicio + tamano)
+        if espacio is None:
+            break
+        fragmentos.append(texto[inicio:espacio.start()])
+        inicio = espacio.start()
+    fragmentos.append(texto[inicio:])
+    return fragmentos
+
+
+def partir_en_caracteres(texto, tamano):
+    """Fragmentos de `tamano` code points (operaciones carácter a carácter)"""
+    return [texto[inicio:inicio + tamano] for inicio in range(0, len(texto), tamano)]
+
+
+def _concatenar(parciales):
+    return ''.join(parciales)
+
+
+def _concatenar_invertido(parciales):
+    # Cada fragmento llega invertido: el último del texto va primero
+    return ''.join(reversed(parciales))
+
+
+# --- Texto en flujo ----------------------------------------------------------
+
+class MayusculasEnFlujo:
+    """Cada parte del texto sale en mayúsculas apenas llega"""
+
+    def __init__(self, datos):
+        pass
+
+    def alimentar(self, texto):
+        """Procesa una parte; retorna la parte del resultado que produce (o None)"""
+        return texto.upper()
+
+    def terminar(self):
+        """Resultado final; None si el resultado es la concatenación de las partes"""
+        return None
+
+
+class ContarPalabrasEnFlujo:
+    """Cuenta palabras sin guardar el texto: una palabra cortada entre dos
+    partes se cuenta una sola vez"""
+
+    def __init__(self, datos):
+        self.palabras = 0
+        self.en_palabra = False
+
+    def alimentar(self, texto):
+        if texto:
+            self.palabras += len(texto.split())
+            if self.en_palabra and not texto[0].isspace():
+                self.palabras -= 1
+            self.en_palabra = not texto[-1].isspace()
+        return None
+
+    def terminar(self):
+        return self.palabras
+
+
+# --- Modelos de costo -------------------------------------------------------
+
+def _costo_texto(datos):
+    return COSTO_TRIVIAL + len(datos.get('texto', '')) * 5e-9
+
+
+def _costo_potencia(datos):
+    exponente = abs(datos.get('exponente', 1))
+    bits = exponente * math.log2(abs(datos.get('base', 0)) + 2)
+    return COSTO_TRIVIAL + (bits / 1e6) ** 1.6 * 0.05
+
+
+def _costo_factorial(datos):
+    return COSTO_TRIVIAL + (max(datos.get('n', 0), 0) / 1e5) ** 1.6 * 0.3
+
+
+def _costo_fibonacci(datos):
+    return COSTO_TRIVIAL + (max(datos.get('n', 0), 0) / 1e6) ** 1.6 * 0.12
+
+
+def _costo_primo(datos):
+    bits = int(datos.get('n', 2)).bit_length()
+    return 1e-5 + (bits / 64) ** 3 * 2e-4
+
+
+# --- Operaciones ------------------------------------------------------------
+
+@operacion('suma', pura=True)
+def suma(datos):
+    return datos.get('a', 0) + datos.get('b', 0)
+
+
+@operacion('resta', pura=True)
+def resta(datos):
+    return datos.get('a', 0) - datos.get('b', 0)
+
+
+@operacion('multiplicacion', pura=True)
+def multiplicacion(datos):
+    return datos.get('a', 0) * datos.get('b', 0)
+
+
+@operacion('division', pura=True)
+def division(datos):
+    a = datos.get('a', 0)
+    b = datos.get('b', 1)
+    if b == 0:
+        raise ValueError("División por cero")
+    return a / b
+
+
+@operacion('potencia', pura=True, cacheable=True, costo=_costo_potencia)
+def potencia(datos):
+    return datos.get('base', 0) ** datos.get('exponente', 1)
+
+
+@operacion('raiz', pura=True, cacheable=True)
+def raiz(datos):
+    numero = datos.get('numero', 0)
+    if numero < 0:
+        raise ValueError("No se puede calcular raíz de número negativo")
+    return math.sqrt(numero)
+
+
+@operacion('factorial', pura=True, cacheable=True, costo=_costo_factorial)
+def factorial(datos):
+    n = datos.get('n', 0)
+    if n < 0:
+        raise ValueError("Factorial no definido para negativos")
+    return math.factorial(n)
+
+
+@operacion('primo', pura=True, cacheable=True, costo=_costo_primo)
+def primo(datos):
+    return es_primo(datos.get('n', 2))
+
+
+@operacion('fibonacci', pura=True, cacheable=True, costo=_costo_fibonacci)
+def fibonacci_n(datos):
+    return fibonacci(datos.get('n', 0))
+
+
+@operacion('inverso_texto', pura=True, costo=_costo_texto,
+           partir=partir_en_caracteres, combinar=_concatenar_invertido)
+def inverso_texto(datos):
+    return datos.get('texto', '')[::-1]
+
+
+@operacion('mayusculas', pura=True, costo=_costo_texto,
+           partir=partir_en_caracteres, combinar=_concatenar, en_flujo=MayusculasEnFlujo)
+def mayusculas(datos):
+    return datos.get('texto', '').upper()
+
+
+@operacion('contar_palabras', pura=True, costo=_costo_texto,
+           partir=partir_en_espacios, combinar=sum, en_flujo=ContarPalabrasEnFlujo)
+def contar_palabras(datos):
+    return len(datos.get('texto', '').split())
+
+
+@operacion('sleep', tipo='io', costo=lambda datos: float(datos.get('segundos', 1)))
+def dormir(datos):
+    segundos = datos.get('segundos', 1)
+    time.sleep(segundos)
+    return f"Dormido por {segundos} segundos"
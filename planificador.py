@@ -0,0 +1,173 @@
+"""
+Planificador de tareas por prioridad y plazo
+Clases de prioridad estrictas, EDF dentro de cada clase, envejecimiento
+para evitar inanición y descarte de tareas vencidas antes de despacharlas
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+# Clases de prioridad: la 0 se despacha siempre antes que la 1, y así sucesivamente
+PRIORIDADES = {'alta': 0, 'normal': 1, 'baja': 2}
+PRIORIDAD_POR_DEFECTO = PRIORIDADES['normal']
+
+# Segundos de espera tras los cuales una tarea sube una clase de prioridad
+ENVEJECIMIENTO_POR_DEFECTO = 5.0
+
+SIN_PLAZO = float('inf')
+
+
+def normalizar_prioridad(prioridad):
+    """Convierte 'alta'/'normal'/'baja' o un entero en una clase válida"""
+    if isinstance(prioridad, str):
+        return PRIORIDADES.get(prioridad, PRIORIDAD_POR_DEFECTO)
+    if isinstance(prioridad, (int, float)):
+        return min(max(int(prioridad), 0), len(PRIORIDADES) - 1)
+    return PRIORIDAD_POR_DEFECTO
+
+
+class _Entrada:
+    """Tarea encolada; `activa` pasa a False cuando se despacha o asciende"""
+
+    __slots__ = ('tarea', 'vence', 'orden', 'desde', 'activa')
+
+    def __init__(self, tarea, vence, orden, desde):
+        self.tarea = tarea
+        self.vence = vence
+        self.orden = orden
+        self.desde = desde
+        self.activa = True
+
+    def __lt__(self, otra):
+        # EDF; a igual plazo (o sin plazo), orden de llegada
+        return (self.vence, self.orden) < (otra.vence, otra.orden)
+
+
+class Planificador:
+    """Reemplazo de queue.Queue con prioridades, plazos y envejecimiento"""
+
+    def __init__(self, envejecimiento=ENVEJECIMIENTO_POR_DEFECTO, al_vencer=None):
+        self.envejecimiento = envejecimiento
+        # Se llama (fuera del lock) con cada tarea descartada por plazo vencido
+        self.al_vencer = al_vencer
+
+        clases = len(PRIORIDADES)
+        # Por clase: heap EDF para elegir y deque por antigüedad para envejecer
+        self.heaps = [[] for _ in range(clases)]
+        self.antiguedad = [deque() for _ in range(clases)]
+        self.pendientes = [0] * clases
+
+        self.contador = itertools.count()
+        self.condicion = threading.Condition()
+
+        self.vencidas = 0
+        self.ascensos = 0
+
+    def __len__(self):
+        return sum(self.pendientes)
+
+    def poner(self, tarea):
+        """Encola una tarea; usa tarea['prioridad'] y tarea['vence'] (monotónico)"""
+        clase = normalizar_prioridad(tarea.get('prioridad'))
+        vence = tarea.get('vence')
+        entrada = _Entrada(tarea, SIN_PLAZO if vence is None else vence,
+                           next(self.contador), time.monotonic())
+
+        with self.condicion:
+            self._agregar(clase, entrada)
+            self.condicion.notify()
+
+    def _agregar(self, clase, entrada):
+        heapq.heappush(self.heaps[clase], entrada)
+        if clase > 0:
+            # La clase más alta no envejece: no hace falta seguir su antigüedad
+            self.antiguedad[clase].append(entrada)
+        self.pendientes[clase] += 1
+
+    def _envejecer(self, ahora):
+        """Sube de clase las tareas que esperaron más que `envejecimiento`"""
+        if not self.envejecimiento:
+            return
+        for clase in range(1, len(self.heaps)):
+            cola = self.antiguedad[clase]
+            while cola and (not cola[0].activa or
+                            ahora - cola[0].desde >= self.envejecimiento):
+                entrada = cola.popleft()
+                if not entrada.activa:
+                    continue
+                # La entrada vieja queda inactiva en el heap y se descarta al salir
+                entrada.activa = False
+                self.pendientes[clase] -= 1
+                nueva = _Entrada(entrada.tarea, entrada.vence, entrada.orden, ahora)
+                self._agregar(clase - 1, nueva)
+                self.ascensos += 1
+
+    def _extraer(self, ahora, vencidas):
+        """Saca la próxima tarea despachable o None (requiere el lock)"""
+        self._envejecer(ahora)
+
+        for clase, heap in enumerate(self.heaps):
+            while heap:
+                entrada = heapq.heappop(heap)
+                if not entrada.activa:
+                    continue
+                entrada.activa = False
+                self.pendientes[clase] -= 1
+
+                if entrada.vence < ahora:
+                    # Nadie va a usar el resultado: no ocupar un worker con ella
+                    self.vencidas += 1
+                    vencidas.append(entrada.tarea)
+                    continue
+                return entrada.tarea
+
+            # Las entradas inactivas solo se limpian del deque de antigüedad aquí
+            cola = self.antiguedad[clase]
+            while cola and not cola[0].activa:
+                cola.popleft()
+        return None
+
+    def _notificar_vencidas(self, vencidas):
+        if self.al_vencer is not None:
+            for tarea in vencidas:
+                self.al_vencer(tarea)
+
+    def extraer(self):
+        """Versión no bloqueante: la próxima tarea o None si no hay"""
+        vencidas = []
+        with self.condicion:
+            tarea = self._extraer(time.monotonic(), vencidas)
+        self._notificar_vencidas(vencidas)
+        return tarea
+
+    def tomar(self, timeout=None):
+        """Bloquea hasta obtener una tarea; None si vence el timeout"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        vencidas = []
+        tarea = None
+
+        with self.condicion:
+            while True:
+                ahora = time.monotonic()
+                tarea = self._extraer(ahora, vencidas)
+                if tarea is not None:
+                    break
+                if limite is not None and ahora >= limite:
+                    break
+                self.condicion.wait(None if limite is None else limite - ahora)
+
+        self._notificar_vencidas(vencidas)
+        return tarea
+
+    def estadisticas(self):
+        """Tareas pendientes por clase y contadores de descartes y ascensos"""
+        nombres = {clase: nombre for nombre, clase in PRIORIDADES.items()}
+        with self.condicion:
+            return {
+                'pendientes': {nombres[c]: n for c, n in enumerate(self.pendientes)},
+                'vencidas': self.vencidas,
+                'ascensos': self.ascensos,
+            }
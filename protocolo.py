@@ -0,0 +1,190 @@
+"""
+Protocolo de mensajes con framing por longitud
+Cada mensaje viaja como: versión (1 byte) | tipo (1 byte) | longitud (4 bytes) | cuerpo
+"""
+
+import asyncio
+import json
+import struct
+
+import codec_binario
+
+# El byte de versión indica cómo está codificado el cuerpo de cada mensaje,
+# así que el receptor entiende ambos sin saber qué se negoció
+CODEC_JSON = 1
+CODEC_BINARIO = 2
+CODECS = {'json': CODEC_JSON, 'binario': CODEC_BINARIO}
+NOMBRES_CODEC = {codigo: nombre for nombre, codigo in CODECS.items()}
+VERSION = CODEC_JSON
+
+# Cabecera fija: versión (codec), tipo de mensaje y longitud del cuerpo (big-endian)
+CABECERA = struct.Struct('!BBI')
+
+# Tipos de mensaje
+TAREA = 1
+RESULTADO = 2
+HOLA = 3       # Saludo inicial del worker: nombre y capacidad (créditos)
+LOTE = 4       # Varias tareas que viajan y se ejecutan como una unidad
+RESULTADO_LOTE = 5
+ESTADISTICAS = 6  # Consulta de contadores del servidor (cliente ↔ servidor)
+LATIDO = 7     # El worker avisa que sigue vivo aunque no termine tareas
+FRAGMENTO = 8  # Una parte del texto de una tarea o de su resultado, en flujo
+CONSULTA = 9   # Resultados de tareas enviadas con ticket, en bloque
+SUSCRIPCION = 10  # Tickets cuyos resultados se envían apenas llegan
+
+# Límite de seguridad para no reservar memoria por una cabecera corrupta
+MAX_MENSAJE = 64 * 1024 * 1024
+
+# Por debajo de este tamaño la cabecera y el cuerpo se envían juntos
+UMBRAL_ENVIO_UNICO = 64 * 1024
+
+# Un buffer de recepción que creció más que esto vuelve a su tamaño inicial
+# después del mensaje: una conexión larga no retiene la memoria de uno grande
+MAX_BUFFER_RETENIDO = 1024 * 1024
+
+
+class ErrorProtocolo(Exception):
+    """Mensaje mal formado o de una versión no soportada"""
+
+
+def elegir_codec(ofrecidos):
+    """Codec preferido entre los que ofrece el otro extremo (JSON si ninguno)"""
+    for nombre in ('binario', 'json'):
+        if nombre in (ofrecidos or ()):
+            return CODECS[nombre]
+    return CODEC_JSON
+
+
+def codificar(mensaje, codec=CODEC_JSON):
+    """Serializa un mensaje a bytes"""
+    try:
+        if codec == CODEC_BINARIO:
+            return codec_binario.codificar(mensaje)
+        return json.dumps(mensaje).encode('utf-8')
+    except ValueError as e:
+        # p. ej. enteros de más de 4300 dígitos en JSON
+        raise ErrorProtocolo(f"No se pudo codificar el mensaje: {e}") from None
+
+
+def decodificar(cuerpo, codec=CODEC_JSON):
+    """Deserializa el cuerpo de un mensaje (bytes o memoryview)"""
+    try:
+        if codec == CODEC_BINARIO:
+            return codec_binario.decodificar(cuerpo)
+        return json.loads(str(cuerpo, 'utf-8'))
+    except ValueError as e:
+        raise ErrorProtocolo(f"Cuerpo mal formado: {e}") from None
+
+
+def empaquetar(tipo, mensaje, codec=CODEC_JSON):
+    """Retorna la cabecera y el cuerpo listos para enviar"""
+    cuerpo = codificar(mensaje, codec)
+    if len(cuerpo) > MAX_MENSAJE:
+        raise ErrorProtocolo(f"Mensaje demasiado grande: {len(cuerpo)} bytes")
+    return CABECERA.pack(codec, tipo, len(cuerpo)), cuerpo
+
+
+def desempaquetar_cabecera(cabecera):
+    """Valida la cabecera y retorna (codec, tipo, longitud)"""
+    codec, tipo, longitud = CABECERA.unpack(cabecera)
+    if codec not in NOMBRES_CODEC:
+        raise ErrorProtocolo(f"Versión de protocolo no soportada: {codec}")
+    if longitud > MAX_MENSAJE:
+        raise ErrorProtocolo(f"Mensaje demasiado grande: {longitud} bytes")
+    return codec, tipo, longitud
+
+
+def enviar_mensaje(sock, tipo, mensaje, codec=CODEC_JSON):
+    """Envía un mensaje completo por el socket"""
+    cabecera, cuerpo = empaquetar(tipo, mensaje, codec)
+    if len(cuerpo) < UMBRAL_ENVIO_UNICO:
+        sock.sendall(cabecera + cuerpo)
+    else:
+        # Evita copiar cuerpos grandes solo para anteponer 6 bytes
+        sock.sendall(cabecera)
+        sock.sendall(cuerpo)
+
+
+class LectorMensajes:
+    """Lee mensajes de un socket reutilizando el mismo buffer"""
+
+    def __init__(self, sock, tamano_inicial=4096):
+        self.sock = sock
+        self.tamano_inicial = tamano_inicial
+        self.buffer = bytearray(tamano_inicial)
+        self.vista = memoryview(self.buffer)
+        self.cabecera = bytearray(CABECERA.size)
+        self.vista_cabecera = memoryview(self.cabecera)
+        # Codec del último mensaje recibido (para responder en el mismo)
+        self.codec = CODEC_JSON
+
+    def _asegurar_capacidad(self, n):
+        """Agranda el buffer (al doble) si no alcanza para n bytes"""
+        if n <= len(self.buffer):
+            return
+        tamano = len(self.buffer)
+        while tamano < n:
+            tamano *= 2
+        self._reemplazar_buffer(tamano)
+
+    def _reemplazar_buffer(self, tamano):
+        """Usa un buffer nuevo de `tamano` bytes"""
+        self.buffer = bytearray(tamano)
+        self.vista = memoryview(self.buffer)
+
+    def _leer_exacto(self, destino, n):
+        """Llena destino[:n] desde el socket; retorna False si se cerró"""
+        leidos = 0
+        while leidos < n:
+            recibidos = self.sock.recv_into(destino[leidos:n])
+            if recibidos == 0:
+                if leidos == 0:
+                    return False
+                raise ErrorProtocolo("Conexión cerrada a mitad de mensaje")
+            leidos += recibidos
+        return True
+
+    def recibir(self):
+        """Retorna (tipo, mensaje) o None si el otro extremo cerró"""
+        if not self._leer_exacto(self.vista_cabecera, CABECERA.size):
+            return None
+        self.codec, tipo, longitud = desempaquetar_cabecera(self.cabecera)
+
+        self._asegurar_capacidad(longitud)
+        if longitud and not self._leer_exacto(self.vista, longitud):
+            raise ErrorProtocolo("Conexión cerrada a mitad de mensaje")
+        mensaje = decodificar(self.vista[:longitud], self.codec)
+        if len(self.buffer) > MAX_BUFFER_RETENIDO:
+            self._reemplazar_buffer(self.tamano_inicial)
+        return tipo, mensaje
+
+
+async def leer_mensaje_codec(reader):
+    """Como leer_mensaje, pero retorna (tipo, mensaje, codec)"""
+    try:
+        cabecera = await reader.readexactly(CABECERA.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ErrorProtocolo("Conexión cerrada a mitad de mensaje")
+    codec, tipo, longitud = desempaquetar_cabecera(cabecera)
+
+    try:
+        cuerpo = await reader.readexactly(longitud)
+    except asyncio.IncompleteReadError:
+        raise ErrorProtocolo("Conexión cerrada a mitad de mensaje")
+    return tipo, decodificar(cuerpo, codec), codec
+
+
+async def leer_mensaje(reader):
+    """Versión asyncio de LectorMensajes.recibir (reader es un StreamReader)"""
+    mensaje = await leer_mensaje_codec(reader)
+    return None if mensaje is None else mensaje[:2]
+
+
+async def escribir_mensaje(writer, tipo, mensaje, codec=CODEC_JSON):
+    """Versión asyncio de enviar_mensaje (writer es un StreamWriter)"""
+    cabecera, cuerpo = empaquetar(tipo, mensaje, codec)
+    writer.write(cabecera)
+    writer.write(cuerpo)
+    await writer.drain()
@@ -0,0 +1,287 @@
+"""
+Registro de workers conectados
+Lleva créditos, tareas en vuelo, latencia reciente y último latido de cada
+worker, y elige el menos cargado para cada tarea
+"""
+
+import threading
+import time
+from collections import deque
+
+from latencias import LatenciasOperacion
+from protocolo import CODEC_JSON
+
+# Segundos entre latidos que el servidor le pide a cada worker
+INTERVALO_LATIDO = 2.0
+# Sin mensajes del worker durante este tiempo, se lo da de baja
+TOLERANCIA_LATIDO = 3 * INTERVALO_LATIDO
+
+# Peso de la última medición en la latencia promedio (EWMA)
+PESO_LATENCIA = 0.2
+
+# Segundos de respuestas recientes con los que se mide el ritmo de vaciado de la cola
+VENTANA_RITMO = 2.0
+
+# Segundos que un worker tiene para responder una tarea, más un múltiplo de su
+# costo estimado; al vencer, la tarea se reencola en otro worker
+LEASE_BASE = 10.0
+FACTOR_LEASE = 4
+
+# A otro servidor del cluster solo se le prestan tareas (o sub-lotes) de al
+# menos este costo estimado: en las más baratas el salto extra cuesta más
+# de lo que se gana
+COSTO_MINIMO_PAR = 1e-3
+
+
+class ConexionWorker:
+    """Estado de la conexión con un worker: créditos, tareas en vuelo y salud"""
+
+    def __init__(self, addr, nombre, capacidad, operaciones=None, canal=None, salida=None,
+                 codec=CODEC_JSON, par=False):
+        self.addr = addr
+        self.nombre = nombre
+        # Cantidad máxima de tareas en vuelo (créditos)
+        self.capacidad = capacidad
+        # Otro servidor del cluster: su capacidad cambia con lo que tiene libre
+        self.par = par
+        self.en_vuelo = {}
+        self.activa = True
+        # Operaciones que el worker declaró saber ejecutar
+        self.operaciones = set(operaciones or ())
+        # Suma del costo estimado de las tareas en vuelo (segundos)
+        self.costo_en_vuelo = 0.0
+
+        # Socket o stream del motor, y cola de tareas asignadas pendientes de envío
+        self.canal = canal
+        self.salida = salida
+        # Codec negociado en el saludo para los mensajes hacia el worker
+        self.codec = codec
+
+        # Instante de envío y vencimiento del lease de cada tarea en vuelo
+        self.enviadas = {}
+        self.leases = {}
+        self.latencia = None
+        self.completadas = 0
+        self.ultimo_mensaje = time.monotonic()
+
+    def libres(self):
+        """Créditos disponibles"""
+        return self.capacidad - len(self.en_vuelo)
+
+    def sabe(self, tarea):
+        """Indica si el worker declaró todas las operaciones de la tarea o sub-lote"""
+        tareas = tarea['tareas'] if 'tareas' in tarea else (tarea,)
+        return all(t.get('operacion') in self.operaciones for t in tareas)
+
+    def carga(self):
+        """Clave de orden: menor = menos cargado"""
+        return (self.costo_en_vuelo / self.capacidad,
+                len(self.en_vuelo) / self.capacidad,
+                self.latencia or 0.0)
+
+    def describir(self):
+        """Estado serializable para las estadísticas del servidor"""
+        return {
+            'nombre': self.nombre,
+            'par': self.par,
+            'capacidad': self.capacidad,
+            'en_vuelo': len(self.en_vuelo),
+            'costo_en_vuelo': self.costo_en_vuelo,
+            'latencia': self.latencia,
+            'completadas': self.completadas,
+            'ultimo_mensaje': time.monotonic() - self.ultimo_mensaje,
+        }
+
+
+class RegistroWorkers:
+    """Workers conectados; thread-safe y usable también desde un event loop"""
+
+    def __init__(self):
+        self.conexiones = []
+        self.condicion = threading.Condition()
+        self.expulsados = 0
+        # Latencia de ida y vuelta de las tareas sueltas, por operación
+        self.latencias = LatenciasOperacion()
+        # Instantes de las últimas respuestas (tareas o sub-lotes)
+        self.respuestas = deque()
+
+    def __len__(self):
+        return len(self.conexiones)
+
+    def agregar(self, conexion):
+        """Da de alta un worker que ya completó el saludo"""
+        with self.condicion:
+            self.conexiones.append(conexion)
+            self.condicion.notify_all()
+
+    def quitar(self, conexion):
+        """Da de baja un worker; retorna False si ya no estaba registrado"""
+        with self.condicion:
+            conexion.activa = False
+            if conexion not in self.conexiones:
+                return False
+            self.conexiones.remove(conexion)
+            return True
+
+    def latido(self, conexion):
+        """Registra que llegó un mensaje (resultado o latido) del worker"""
+        conexion.ultimo_mensaje = time.monotonic()
+
+    def ajustar_capacidad(self, conexion, capacidad):
+        """Cambia los créditos de un par; retorna True si quedaron créditos libres"""
+        with self.condicion:
+            conexion.capacidad = max(0, capacidad)
+            if conexion.libres() > 0:
+                self.condicion.notify_all()
+                return True
+            return False
+
+    def _hay_libres(self, locales=False):
+        return any(c.libres() > 0 for c in self.conexiones if not (locales and c.par))
+
+    def hay_libres(self, locales=False):
+        """Indica si algún worker (solo los propios si `locales`) tiene créditos disponibles"""
+        with self.condicion:
+            return self._hay_libres(locales)
+
+    def esperar_libre(self, timeout, locales=False):
+        """Bloquea hasta que algún worker tenga créditos; False si vence el timeout"""
+        with self.condicion:
+            return self.condicion.wait_for(lambda: self._hay_libres(locales), timeout)
+
+    def libres_locales(self):
+        """Créditos disponibles en los workers propios (sin contar pares)"""
+        with self.condicion:
+            return sum(max(0, c.libres()) for c in self.conexiones if not c.par)
+
+    def asignar(self, tarea, lease=LEASE_BASE, excluir=None):
+        """Reserva un crédito en el worker menos cargado que sabe ejecutar la tarea
+        y se la presta por `lease` segundos. Retorna la conexión o None si no hay
+        créditos libres"""
+        with self.condicion:
+            # Un worker que ya tiene la tarea en vuelo no recibe otra copia
+            libres = [c for c in self.conexiones if c.libres() > 0 and c is not excluir
+                      and tarea['id'] not in c.en_vuelo]
+            # Los pares reciben solo lo que no entra en los workers propios, y
+            # nunca una tarea barata o que ya vino prestada de otro nodo
+            locales = [c for c in libres if not c.par]
+            # Las tareas en flujo no se prestan: el par no reenvía sus partes
+            prestable = ('origen' not in tarea and tarea.get('costo', 0.0) >= COSTO_MINIMO_PAR
+                         and not tarea.get('entrada_flujo') and not tarea.get('salida_flujo'))
+            libres = locales if locales or not prestable else libres
+            # Si ningún worker declaró la operación, cualquiera responde el error
+            candidatos = [c for c in libres if c.sabe(tarea)] or libres
+            if not candidatos:
+                return None
+
+            conexion = min(candidatos, key=ConexionWorker.carga)
+            ahora = time.monotonic()
+            conexion.en_vuelo[tarea['id']] = tarea
+            conexion.enviadas[tarea['id']] = ahora
+            conexion.leases[tarea['id']] = ahora + lease
+            conexion.costo_en_vuelo += tarea.get('costo', 0.0)
+            return conexion
+
+    def _liberar(self, conexion, tarea_id):
+        """Quita una tarea de las en vuelo del worker (requiere el lock)"""
+        tarea = conexion.en_vuelo.pop(tarea_id)
+        conexion.costo_en_vuelo -= tarea.get('costo', 0.0)
+        conexion.leases.pop(tarea_id)
+        return tarea, conexion.enviadas.pop(tarea_id)
+
+    def completar(self, conexion, tarea_id):
+        """Libera el crédito de una tarea respondida y actualiza la latencia.
+        Retorna la tarea enviada o None si no estaba en vuelo"""
+        with self.condicion:
+            if tarea_id not in conexion.en_vuelo:
+                return None
+
+            tarea, enviada = self._liberar(conexion, tarea_id)
+            medida = time.monotonic() - enviada
+            if 'tareas' not in tarea:
+                self.latencias.registrar(tarea.get('operacion'), medida)
+            if conexion.latencia is None:
+                conexion.latencia = medida
+            else:
+                conexion.latencia += PESO_LATENCIA * (medida - conexion.latencia)
+            conexion.completadas += 1
+            self.respuestas.append(time.monotonic())
+            self._recortar_respuestas()
+
+            self.condicion.notify_all()
+            return tarea
+
+    def en_vuelo(self, tarea_id, excluir=None):
+        """Indica si la tarea está en vuelo en algún worker registrado (salvo `excluir`)"""
+        with self.condicion:
+            return any(tarea_id in c.en_vuelo for c in self.conexiones if c is not excluir)
+
+    def rezagadas(self, umbral):
+        """(conexión, tarea) en vuelo hace más de umbral(tarea) segundos.
+        `umbral` retorna None para las tareas que no se deben considerar"""
+        ahora = time.monotonic()
+        rezagadas = []
+        with self.condicion:
+            for conexion in self.conexiones:
+                for tarea_id, enviada in conexion.enviadas.items():
+                    tarea = conexion.en_vuelo[tarea_id]
+                    limite = umbral(tarea)
+                    if limite is not None and ahora - enviada > limite:
+                        rezagadas.append((conexion, tarea))
+        return rezagadas
+
+    def recuperar(self, conexion):
+        """Retira y retorna todas las tareas en vuelo de un worker desconectado"""
+        with self.condicion:
+            return [self._liberar(conexion, tarea_id)[0]
+                    for tarea_id in list(conexion.en_vuelo)]
+
+    def leases_vencidos(self):
+        """(conexión, tarea) en vuelo cuyo lease venció. El crédito sigue tomado:
+        el worker puede estar ejecutándola todavía, y se libera cuando responda
+        o se desconecte"""
+        ahora = time.monotonic()
+        with self.condicion:
+            return [(conexion, conexion.en_vuelo[tarea_id])
+                    for conexion in self.conexiones
+                    for tarea_id, vence in conexion.leases.items() if vence < ahora]
+
+    def renovar_lease(self, conexion, tarea_id, lease):
+        """Extiende por `lease` segundos el préstamo de una tarea en vuelo"""
+        with self.condicion:
+            if tarea_id in conexion.leases:
+                conexion.leases[tarea_id] = time.monotonic() + lease
+
+    def vencidos(self, tolerancia):
+        """Da de baja y retorna los workers sin mensajes hace más de `tolerancia` s"""
+        limite = time.monotonic() - tolerancia
+        with self.condicion:
+            vencidos = [c for c in self.conexiones if c.ultimo_mensaje < limite]
+            for conexion in vencidos:
+                conexion.activa = False
+                self.conexiones.remove(conexion)
+            self.expulsados += len(vencidos)
+        return vencidos
+
+    def _recortar_respuestas(self):
+        limite = time.monotonic() - VENTANA_RITMO
+        while self.respuestas and self.respuestas[0] < limite:
+            self.respuestas.popleft()
+
+    def ritmo(self):
+        """Respuestas por segundo en los últimos VENTANA_RITMO segundos (None sin datos)"""
+        with self.condicion:
+            self._recortar_respuestas()
+            # Con pocas respuestas la medición es puro ruido
+            if len(self.respuestas) < 10:
+                return None
+            transcurrido = time.monotonic() - self.respuestas[0]
+            return len(self.respuestas) / max(transcurrido, 0.1)
+
+    def estadisticas(self):
+        """Estado de cada worker conectado y cantidad de expulsados por latidos"""
+        with self.condicion:
+            return {
+                'conectados': [c.describir() for c in self.conexiones],
+                'expulsados': self.expulsados,
+            }
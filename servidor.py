@@ -5,38 +5,282 @@ Recibe tareas de clientes y las distribuye a workers disponibles
 
 import socket
 import threading
-import json
 import queue
 import time
-from datetime import datetime
+from collections import deque
+
+from protocolo import (TAREA, RESULTADO, HOLA, LOTE, RESULTADO_LOTE, ESTADISTICAS,
+                       LATIDO, FRAGMENTO, CONSULTA, SUSCRIPCION, CODEC_JSON, NOMBRES_CODEC,
+                       LectorMensajes, enviar_mensaje, elegir_codec, ErrorProtocolo)
+import operaciones
+import bitacora
+from cache import CacheResultados, clave_canonica
+from almacen import AlmacenResultados, TTL_RESULTADOS, MAX_BYTES_RESULTADOS
+from diario import Diario, DURABILIDADES
+from flujo import VENTANA_FLUJO, ParteFlujo, cancelacion
+from cluster import EnlacePar, EsperaAjena, leer_pares
+from admision import (ControlAdmision, MAX_COLA, MAX_PENDIENTES, MAX_POR_CLIENTE,
+                      REINTENTO_MINIMO, REINTENTO_MAXIMO, REINTENTO_SIN_DATOS)
+from metricas import Metricas, PUERTO_METRICAS, respuesta_http
+from planificador import Planificador, normalizar_prioridad, ENVEJECIMIENTO_POR_DEFECTO
+from registro_workers import (ConexionWorker, RegistroWorkers, INTERVALO_LATIDO,
+                              TOLERANCIA_LATIDO, LEASE_BASE, FACTOR_LEASE)
+
+# Veces que se reencola una tarea cuyo worker murió o no respondió a tiempo
+REINTENTOS_POR_DEFECTO = 2
+
+# Una tarea idempotente que tarda más que este percentil de su operación se
+# duplica en otro worker libre (0 = nunca); nunca antes de DUPLICADO_MINIMO s
+PERCENTIL_DUPLICADO = 95
+DUPLICADO_MINIMO = 0.05
+INTERVALO_REZAGADAS = 0.05
+
+# Cada cuánto se responden las tareas con ticket que pasaron su límite
+INTERVALO_TICKETS = 1.0
+
+# Los mensajes de cada tarea van en DEBUG (y se muestrean); el ciclo de vida en INFO
+log = bitacora.obtener('servidor')
+log_clientes = bitacora.obtener('servidor.cliente')
+log_workers = bitacora.obtener('servidor.worker')
+log_lotes = bitacora.obtener('servidor.lote')
+
+class EsperaResultado:
+    """Resultado pendiente de una tarea: el worker lo completa y el cliente lo espera"""
+    
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        # Instantes de cada etapa y segundos de ejecución medidos por el worker
+        self.marcas = {}
+        self.ejecucion = None
+        # Clave (operación, datos) con la que otras tareas iguales se unen a esta
+        self.clave = None
+    
+    def completar(self, resultado):
+        """Guarda el resultado y despierta al cliente que espera"""
+        self.resultado = resultado
+        self.evento.set()
+    
+    def esperar(self, timeout):
+        """Bloquea hasta tener resultado o vencer el plazo; None si venció"""
+        if self.evento.wait(timeout):
+            return self.resultado
+        return None
+
+class EsperaTicket:
+    """Espera de una tarea enviada con ticket: nadie queda bloqueado en ella.
+    Al completarse, el resultado pasa al almacén para que el cliente lo retire"""
+    
+    def __init__(self, servidor, tarea, origen=None, unidades=1):
+        self.servidor = servidor
+        self.tarea = tarea
+        # Lo que se admitió por la tarea (0 si viene del diario) y hasta cuándo se espera
+        self.origen = origen
+        self.unidades = unidades
+        self.limite = servidor.limite_ticket(tarea)
+        self.marcas = {}
+        self.ejecucion = None
+    
+    def completar(self, resultado):
+        self.servidor.cerrar_ticket(self, resultado)
+
+class EsperaFlujo:
+    """Espera de una tarea en flujo. Reenvía al worker las partes del texto a
+    medida que llegan del cliente y guarda las del resultado hasta que se le
+    envían, con a lo sumo VENTANA_FLUJO partes en cada sentido"""
+    
+    def __init__(self):
+        self.condicion = threading.Condition()
+        self.marcas = {}
+        self.ejecucion = None
+        # Worker que ya recibió la tarea y partes del texto en su cola de envío
+        self.conexion = None
+        self.por_enviar = 0
+        self.sin_entrada = False
+        # Partes del resultado y, al final, la respuesta del worker
+        self.salida = deque()
+        self.resuelta = False
+        self.cerrada = False
+    
+    def puede_reenviar(self):
+        return self.resuelta or self.cerrada or (
+            self.conexion is not None and self.por_enviar < VENTANA_FLUJO)
+    
+    def abrir(self, conexion):
+        """El worker recibió la tarea: desde ahora se le reenvía el texto.
+        False si el texto ya no va a llegar"""
+        with self.condicion:
+            if self.sin_entrada:
+                return False
+            self.conexion = conexion
+            self.condicion.notify_all()
+            return True
+    
+    def reservar(self, limite):
+        """Espera lugar en la ventana para reenviar una parte del texto.
+        Retorna la conexión del worker, o None si la tarea ya terminó o se
+        pasó el límite"""
+        with self.condicion:
+            self.condicion.wait_for(self.puede_reenviar, max(0, limite - time.monotonic()))
+            if (self.resuelta or self.cerrada or time.monotonic() >= limite
+                    or not self.puede_reenviar()):
+                return None
+            self.por_enviar += 1
+            return self.conexion
+    
+    def enviada(self):
+        """Una parte del texto salió hacia el worker"""
+        with self.condicion:
+            self.por_enviar -= 1
+            self.condicion.notify_all()
+    
+    def cancelar_entrada(self, tarea_id):
+        """El texto no llega completo: si el worker ya tiene la tarea, se le
+        avisa que no espere más partes"""
+        with self.condicion:
+            self.sin_entrada = True
+            conexion = self.conexion
+        if conexion is not None:
+            conexion.salida.put_nowait(cancelacion(tarea_id))
+    
+    def agregar(self, parte):
+        """Guarda una parte del resultado; con la ventana llena espera a que
+        el cliente reciba alguna (el worker queda frenado)"""
+        with self.condicion:
+            self.condicion.wait_for(lambda: self.cerrada or len(self.salida) < VENTANA_FLUJO)
+            if not self.cerrada:
+                self.salida.append(parte)
+                self.condicion.notify_all()
+    
+    def completar(self, resultado):
+        """La respuesta final va detrás de las partes del resultado"""
+        with self.condicion:
+            self.resuelta = True
+            self.salida.append(resultado)
+            self.condicion.notify_all()
+    
+    def siguiente(self, timeout):
+        """Próxima parte del resultado (texto), la respuesta final (dict) o
+        None si venció el plazo"""
+        with self.condicion:
+            if not self.condicion.wait_for(lambda: self.salida or self.cerrada, timeout):
+                return None
+            if self.cerrada:
+                return None
+            elemento = self.salida.popleft()
+            self.condicion.notify_all()
+            return elemento
+    
+    def cerrar(self):
+        """El cliente ya no espera: se descartan las partes pendientes"""
+        with self.condicion:
+            self.cerrada = True
+            self.salida.clear()
+            self.condicion.notify_all()
+
+def leer_hola(mensaje, addr):
+    """Valida el saludo de un worker y retorna (nombre, capacidad, operaciones,
+    codec, par); `par` indica otro servidor del cluster que pide trabajo"""
+    if mensaje is None:
+        raise ErrorProtocolo("El worker cerró la conexión antes de saludar")
+    tipo, hola = mensaje
+    if tipo != HOLA:
+        raise ErrorProtocolo(f"Se esperaba saludo del worker, llegó tipo {tipo}")
+    par = bool(hola.get('par'))
+    # Un par sin capacidad libre se conecta igual y la anuncia después
+    capacidad = max(0 if par else 1, int(hola.get('capacidad', 1)))
+    return (hola.get('nombre', str(addr)), capacidad, hola.get('operaciones', {}),
+            elegir_codec(hola.get('codecs')), par)
 
 class ServidorTareas:
-    def __init__(self, host='localhost', puerto_clientes=5000, puerto_workers=5001):
+    def __init__(self, host='localhost', puerto_clientes=5000, puerto_workers=5001,
+                 backlog=128, tamano_lote=100, cache_bytes=64 * 1024 * 1024,
+                 envejecimiento=ENVEJECIMIENTO_POR_DEFECTO,
+                 intervalo_latido=INTERVALO_LATIDO, tolerancia_latido=TOLERANCIA_LATIDO,
+                 lease=LEASE_BASE, reintentos=REINTENTOS_POR_DEFECTO,
+                 percentil_duplicado=PERCENTIL_DUPLICADO, max_cola=MAX_COLA,
+                 max_pendientes=MAX_PENDIENTES, max_por_cliente=MAX_POR_CLIENTE,
+                 puerto_metricas=PUERTO_METRICAS, diario=None, durabilidad='sincronica',
+                 pares=(), tamano_fragmento=operaciones.TAMANO_FRAGMENTO,
+                 ttl_resultados=TTL_RESULTADOS, resultados_bytes=MAX_BYTES_RESULTADOS,
+                 coalescer=True):
         self.host = host
         self.puerto_clientes = puerto_clientes
         self.puerto_workers = puerto_workers
+        self.backlog = backlog
+        
+        # Latencia por etapa y contadores, expuestos en puerto_metricas (0 = no se abre)
+        self.puerto_metricas = puerto_metricas
+        self.metricas = Metricas()
+        
+        # Cola de tareas (prioridad + plazo) y resultados pendientes por tarea_id
+        self.planificador = Planificador(envejecimiento=envejecimiento,
+                                         al_vencer=self.descartar_vencida)
+        self.esperas = {}
+        self.lock_esperas = threading.Lock()
+        self.max_espera = 30  # 30 segundos máximo por tarea
+        
+        # Límites de trabajo aceptado: lo que los excede se rechaza al instante
+        self.admision = ControlAdmision(max_cola, max_pendientes, max_por_cliente)
+        
+        # Los lotes de clientes se parten en sub-lotes de este tamaño para los workers
+        self.tamano_lote = tamano_lote
+        
+        # Los textos más largos que esto se reparten en fragmentos entre los
+        # workers y se combinan los resultados (0 = nunca)
+        self.tamano_fragmento = tamano_fragmento
+        
+        # Resultados de operaciones deterministas (cache_bytes=0 lo desactiva)
+        self.cache = CacheResultados(max_bytes=cache_bytes)
+        
+        # Resultados de las tareas enviadas con ticket, hasta que el cliente
+        # los retire o venzan (una tarea con ticket tampoco espera más que el TTL)
+        self.almacen = AlmacenResultados(max_bytes=resultados_bytes, ttl=ttl_resultados)
+        
+        # Metadatos de operaciones: los del registro local más los que
+        # declaran los workers al conectarse
+        self.operaciones = operaciones.describir()
+        self.lock_operaciones = threading.Lock()
+        
+        # Workers conectados: cada tarea va al menos cargado con créditos libres.
+        # Los que no envían mensajes en `tolerancia_latido` segundos se dan de baja
+        self.registro = RegistroWorkers()
+        self.intervalo_latido = intervalo_latido
+        self.tolerancia_latido = tolerancia_latido
+        
+        # Cada tarea despachada se presta al worker por un tiempo acotado; si el
+        # worker muere o el préstamo vence, se reencola hasta `reintentos` veces
+        self.lease = lease
+        self.reintentos = reintentos
         
-        # Colas para manejar tareas y resultados
-        self.cola_tareas = queue.Queue()
-        self.resultados = {}
-        self.lock_resultados = threading.Lock()
+        # Tareas de operaciones puras en cola o en un worker, por (operación,
+        # datos): las iguales que llegan mientras tanto esperan ese resultado
+        self.coalescer = coalescer
+        self.en_curso = {}
+        self.total_coalescidas = 0
         
-        # Lista de workers disponibles
-        self.workers_disponibles = queue.Queue()
-        self.workers_conectados = []
-        self.lock_workers = threading.Lock()
+        # Tareas rezagadas duplicadas: tarea_id -> worker que recibió la copia
+        self.percentil_duplicado = percentil_duplicado
+        self.duplicadas = {}
+        self.total_duplicadas = 0
+        self.duplicadas_ganadoras = 0
         
         # Control de tareas
         self.tarea_id = 0
         self.lock_tarea_id = threading.Lock()
         
-        # Mapeo de tarea_id a socket del cliente
-        self.clientes_esperando = {}
-        self.lock_clientes = threading.Lock()
+        # Diario opcional en disco: las tareas aceptadas sin terminar se
+        # reencolan al reiniciar (se abre en iniciar())
+        self.diario = Diario(diario, durabilidad) if diario else None
         
-        print(f"[SERVIDOR] Inicializado en {host}")
-        print(f"[SERVIDOR] Puerto clientes: {puerto_clientes}")
-        print(f"[SERVIDOR] Puerto workers: {puerto_workers}")
+        # Cluster: enlaces hacia el puerto de workers de otros nodos, para
+        # tomar prestadas sus tareas cuando los workers propios están ociosos
+        self.nombre_nodo = f"{host}:{puerto_clientes}"
+        self.enlaces = [EnlacePar(self, host_par, puerto_par) for host_par, puerto_par in pares]
+        
+        log.info("Inicializado en %s", host)
+        log.info("Puerto clientes: %s", puerto_clientes)
+        log.info("Puerto workers: %s", puerto_workers)
     
     def obtener_tarea_id(self):
         """Genera un ID único para cada tarea"""
@@ -44,126 +288,1372 @@ class ServidorTareas:
             self.tarea_id += 1
             return self.tarea_id
     
+    def crear_espera(self):
+        """Crea el objeto de espera propio del motor (hilos)"""
+        return EsperaResultado()
+    
+    def crear_espera_flujo(self):
+        """Crea la espera de una tarea en flujo propia del motor (hilos)"""
+        return EsperaFlujo()
+    
+    def registrar_espera(self, tarea_id, flujo=False):
+        """Crea el punto de espera para el resultado de una tarea"""
+        espera = self.crear_espera_flujo() if flujo else self.crear_espera()
+        with self.lock_esperas:
+            self.esperas[tarea_id] = espera
+        return espera
+    
+    def clave_en_curso(self, tarea):
+        """Clave con la que se unen las tareas iguales, o None si la operación
+        no es pura (su resultado puede cambiar entre una ejecución y otra)"""
+        if not self.coalescer:
+            return None
+        operacion = tarea.get('operacion')
+        with self.lock_operaciones:
+            pura = self.operaciones.get(operacion, {}).get('pura')
+        return clave_canonica(operacion, tarea.get('datos', {})) if pura else None
+    
+    def unirse_en_curso(self, clave, tarea):
+        """Espera de una tarea igual que ya está en cola o en un worker, o None.
+        Solo sirve una sin un plazo anterior al de esta y que no está en una
+        clase de prioridad más baja: si no, esta recibiría un vencimiento ajeno
+        o esperaría detrás de tareas menos urgentes"""
+        if clave is None:
+            return None
+        with self.lock_esperas:
+            en_curso = self.en_curso.get(clave)
+        if en_curso is None:
+            return None
+        espera, original = en_curso
+        if (original.get('vence', float('inf')) < tarea.get('vence', float('inf'))
+                or original['prioridad'] > tarea['prioridad']):
+            return None
+        return espera
+    
+    def abrir_en_curso(self, clave, espera, tarea):
+        """Deja que las tareas iguales que lleguen esperen el resultado de esta.
+        Si ya había otra igual (que no le servía a esta), las siguientes se unen
+        a esta, que vence más tarde o tiene más prioridad"""
+        if clave is None:
+            return
+        with self.lock_esperas:
+            espera.clave = clave
+            self.en_curso[clave] = (espera, tarea)
+    
+    def cerrar_en_curso(self, espera):
+        """La tarea ya tiene resultado o nadie la espera (con lock_esperas tomado)"""
+        clave = getattr(espera, 'clave', None)
+        if clave is not None and self.en_curso.get(clave, (None,))[0] is espera:
+            del self.en_curso[clave]
+    
+    def registrar_ticket(self, tarea, origen=None, unidades=1, ticket=None):
+        """Crea la espera de una tarea con ticket: su resultado va al almacén.
+        El ticket (nuevo, o el que ya tenía la tarea recuperada del diario)
+        queda en la tarea para que el diario lo conserve"""
+        espera = EsperaTicket(self, tarea, origen, unidades)
+        tarea['ticket'] = self.almacen.abrir(tarea['id'], ticket)
+        with self.lock_esperas:
+            self.esperas[tarea['id']] = espera
+        return espera
+    
+    def descartar_espera(self, tarea_id):
+        """Elimina la espera de una tarea (respondida o vencida)"""
+        with self.lock_esperas:
+            espera = self.esperas.pop(tarea_id, None)
+            self.duplicadas.pop(tarea_id, None)
+            self.cerrar_en_curso(espera)
+        
+        # Ningún worker respondió: el cliente ya recibió el timeout
+        if espera is not None and self.diario is not None:
+            self.diario.completada(tarea_id, 'timeout')
+    
+    def entregar_resultado(self, resultado):
+        """Entrega el resultado de un worker al cliente que lo espera"""
+        tarea_id = resultado.get('id')
+        with self.lock_esperas:
+            espera = self.esperas.pop(tarea_id, None)
+            self.cerrar_en_curso(espera)
+        
+        if espera is None:
+            log.debug("Resultado descartado: el cliente ya no espera",
+                      extra={'tarea': tarea_id})
+            return False
+        
+        espera.marcas['resultado'] = time.monotonic()
+        espera.ejecucion = resultado.pop('ejecucion', None)
+        if self.diario is not None:
+            self.diario.completada(tarea_id, resultado.get('estado', 'lote'))
+        espera.completar(resultado)
+        return True
+    
+    def cerrar_ticket(self, espera, resultado):
+        """Guarda el resultado de una tarea con ticket y libera lo que se admitió por ella"""
+        tarea = espera.tarea
+        self.guardar_en_cache(tarea, resultado)
+        self.almacen.guardar(resultado)
+        self.medir_respuesta(self.etiqueta_operacion(tarea), espera,
+                             resultado.get('estado', 'desconocido'))
+        if espera.unidades:
+            self.admision.liberar(espera.origen, espera.unidades)
+    
+    def vencer_tickets(self):
+        """Responde con timeout (o vencida) las tareas con ticket que pasaron
+        su límite y libera los resultados que pasaron su TTL"""
+        ahora = time.monotonic()
+        vencidas = []
+        with self.lock_esperas:
+            for tarea_id, espera in list(self.esperas.items()):
+                if isinstance(espera, EsperaTicket) and espera.limite <= ahora:
+                    del self.esperas[tarea_id]
+                    self.duplicadas.pop(tarea_id, None)
+                    vencidas.append(espera)
+        
+        for espera in vencidas:
+            tarea_id = espera.tarea['id']
+            log.warning("Timeout - ticket sin resultado", extra={'tarea': tarea_id})
+            if self.diario is not None:
+                self.diario.completada(tarea_id, 'timeout')
+            espera.completar(self.respuesta_sin_resultado(espera.tarea))
+        self.almacen.purgar()
+    
+    def espera_en_flujo(self, tarea_id):
+        """Espera de una tarea en flujo que sigue pendiente, o None"""
+        with self.lock_esperas:
+            espera = self.esperas.get(tarea_id)
+        return espera if hasattr(espera, 'agregar') else None
+    
+    def abrir_entrada(self, tarea, conexion):
+        """El worker ya recibió una tarea con el texto en flujo: desde ahora
+        se le reenvían las partes. False si el texto ya no va a llegar"""
+        espera = self.espera_en_flujo(tarea['id'])
+        return espera is not None and espera.abrir(conexion)
+    
+    def recibir_parte(self, parte):
+        """Pasa al cliente una parte del resultado de una tarea en flujo; con
+        la ventana llena, deja de leer del worker hasta que el cliente la reciba"""
+        espera = self.espera_en_flujo(parte.get('id'))
+        if espera is not None:
+            espera.agregar(parte.get('parte', ''))
+    
+    def marcar(self, tarea_id, marca):
+        """Anota el instante de una etapa en la espera de la tarea"""
+        with self.lock_esperas:
+            espera = self.esperas.get(tarea_id)
+        if espera is not None:
+            espera.marcas[marca] = time.monotonic()
+    
+    def anotar_aceptadas(self, tareas):
+        """Registra en el diario tareas (o sub-lotes) aceptadas; retorna la
+        secuencia hasta la que hay que esperar el disco (None sin diario)"""
+        if self.diario is None:
+            return None
+        secuencia = None
+        for tarea in tareas:
+            # Sin el texto, que solo pasó en flujo, no se podría reencolar
+            if not tarea.get('entrada_flujo'):
+                secuencia = self.diario.aceptada(tarea) or secuencia
+        return secuencia
+    
+    def esperar_diario(self, secuencia):
+        """Bloquea hasta que las tareas aceptadas estén en disco (según la durabilidad)"""
+        if self.diario is not None:
+            self.diario.esperar(secuencia)
+    
+    def recuperar_diario(self):
+        """Abre el diario y reencola las tareas que quedaron sin terminar antes
+        del último reinicio. Nadie espera su resultado: se ejecutan, su
+        finalización queda registrada en el diario y el resultado, en el
+        almacén, con el mismo ticket que recibió el cliente"""
+        if self.diario is None:
+            return
+        
+        tareas, ultimo_id = self.diario.abrir()
+        with self.lock_tarea_id:
+            self.tarea_id = max(self.tarea_id, ultimo_id)
+        
+        reencoladas = 0
+        for tarea in tareas:
+            if tarea.get('vence', float('inf')) <= time.monotonic():
+                self.diario.completada(tarea['id'], 'vencida')
+            elif tarea['intentos'] > self.reintentos:
+                log.warning("Abandonada al recuperar: despachada %d veces", tarea['intentos'],
+                            extra={'tarea': tarea['id']})
+                self.diario.completada(tarea['id'], 'error')
+            else:
+                # El cliente puede retirar el resultado con el ticket que ya recibió
+                self.registrar_ticket(tarea, unidades=0, ticket=tarea.get('ticket'))
+                self.encolar(tarea)
+                reencoladas += 1
+        log.info("Diario en %s (%s): %d tareas reencoladas de %d sin terminar",
+                 self.diario.directorio, self.diario.durabilidad, reencoladas, len(tareas))
+    
+    def capacidad_para_pares(self):
+        """Tareas que este nodo puede tomar prestadas por cada par enlazado:
+        los créditos libres de sus workers que no cubre su propia cola"""
+        libres = self.registro.libres_locales() - len(self.planificador)
+        enlazados = sum(1 for enlace in self.enlaces if enlace.conectado) or 1
+        return max(0, -(-libres // enlazados))
+    
+    def operaciones_conocidas(self):
+        """Metadatos de las operaciones que este nodo sabe despachar"""
+        with self.lock_operaciones:
+            return dict(self.operaciones)
+    
+    def recibir_ajena(self, enlace, tipo, tarea):
+        """Encola una tarea (o sub-lote) que prestó un par; el resultado vuelve
+        por el enlace con el ID original"""
+        id_origen = tarea['id']
+        tarea['id'] = self.obtener_tarea_id()
+        tarea['origen'] = enlace.nombre
+        # El plazo viaja como segundos restantes: los relojes monotónicos no se comparan
+        restante = tarea.pop('restante', None)
+        if restante is not None:
+            tarea['vence'] = time.monotonic() + restante
+        
+        espera = EsperaAjena(enlace, tarea['id'], id_origen, tipo)
+        espera.marcas['aceptada'] = espera.marcas['encolada'] = time.monotonic()
+        with self.lock_esperas:
+            self.esperas[tarea['id']] = espera
+        enlace.agregar_pendiente(tarea['id'])
+        self.metricas.contar('tareas_ajenas', par=enlace.nombre)
+        log.debug("Prestada por %s (ID %s allí)", enlace.nombre, id_origen,
+                  extra={'tarea': tarea['id']})
+        self.encolar_ajena(tarea)
+    
+    def encolar_ajena(self, tarea):
+        """Encola desde el hilo de un enlace (en este motor, como cualquier tarea)"""
+        self.encolar(tarea)
+    
+    def descartar_ajenas(self, enlace):
+        """El enlace con un par se cortó: el par ya reencoló sus tareas, así
+        que las que quedan aquí se dejan de esperar y no se despachan"""
+        pendientes = enlace.retirar_pendientes()
+        with self.lock_esperas:
+            for tarea_id in pendientes:
+                self.esperas.pop(tarea_id, None)
+        if pendientes:
+            log.info("%d tareas prestadas por %s descartadas", len(pendientes), enlace.nombre)
+    
+    def mensaje_para(self, conexion, tarea):
+        """Lo que se envía a un worker por una tarea; a un par, con el plazo
+        en segundos restantes"""
+        if not conexion.par or 'vence' not in tarea:
+            return tarea
+        mensaje = dict(tarea, restante=tarea['vence'] - time.monotonic())
+        del mensaje['vence']
+        return mensaje
+    
+    def recibir_latido(self, conexion, latido):
+        """Un par anuncia en sus latidos cuántas tareas puede tomar.
+        Retorna True si quedaron créditos libres"""
+        if conexion.par and 'capacidad' in latido:
+            return self.registro.ajustar_capacidad(conexion, int(latido['capacidad']))
+        return False
+    
+    def iniciar_enlaces(self):
+        """Arranca un hilo por par del cluster"""
+        for enlace in self.enlaces:
+            threading.Thread(target=enlace.ejecutar, daemon=True).start()
+        if self.enlaces:
+            log.info("Nodo %s enlazado con %d pares", self.nombre_nodo, len(self.enlaces))
+    
+    def etiqueta_operacion(self, tarea):
+        """Operación de la tarea como etiqueta de las métricas: la que no está
+        registrada (o no es texto) cuenta como 'desconocida', así un cliente no
+        puede crear etiquetas sin límite"""
+        operacion = tarea.get('operacion')
+        if not isinstance(operacion, str):
+            return 'desconocida'
+        with self.lock_operaciones:
+            return operacion if operacion in self.operaciones else 'desconocida'
+    
+    def medir_respuesta(self, operacion, espera, estado):
+        """Registra las etapas de una tarea (o sub-lote) ya respondida al cliente"""
+        espera.marcas['respondida'] = time.monotonic()
+        self.metricas.registrar_tarea(operacion, espera.marcas, espera.ejecucion)
+        self.metricas.contar('tareas_respondidas', operacion=operacion, estado=estado)
+    
     def manejar_cliente(self, conn, addr):
         """Maneja la conexión de un cliente que envía tareas"""
-        print(f"[CLIENTE] Conectado desde {addr}")
+        log_clientes.debug("Conectado desde %s", addr)
+        
+        lector = LectorMensajes(conn)
+        try:
+            # La conexión puede reutilizarse para varias tareas seguidas
+            while True:
+                mensaje = lector.recibir()
+                if mensaje is None:
+                    break
+                
+                # Se responde en el mismo codec en que llegó el pedido
+                tipo, tarea = mensaje
+                codec = lector.codec
+                if tipo == TAREA and (tarea.get('entrada_flujo') or tarea.get('salida_flujo')):
+                    self.procesar_flujo_cliente(conn, lector, tarea, addr[0], codec)
+                elif tipo == TAREA and tarea.get('ticket'):
+                    self.procesar_ticket_cliente(conn, tarea, addr[0], codec)
+                elif tipo == TAREA:
+                    self.procesar_tarea_cliente(conn, tarea, addr[0], codec)
+                elif tipo == LOTE:
+                    self.procesar_lote_cliente(conn, tarea, addr[0], codec)
+                elif tipo == CONSULTA:
+                    enviar_mensaje(conn, CONSULTA, self.consultar_tickets(tarea), codec)
+                elif tipo == SUSCRIPCION:
+                    # Desde aquí la conexión solo recibe resultados
+                    self.atender_suscripcion(conn, lector, tarea, codec)
+                    break
+                elif tipo == ESTADISTICAS:
+                    enviar_mensaje(conn, ESTADISTICAS, self.estadisticas(), codec)
+                else:
+                    raise ErrorProtocolo(f"Tipo de mensaje inesperado: {tipo}")
+        
+        except Exception as e:
+            log.error("Manejando cliente: %s", e)
+        
+        finally:
+            conn.close()
+    
+    def aplicar_planificacion(self, destino, origen):
+        """Copia prioridad y plazo (segundos) del cliente como clase y vencimiento"""
+        destino['prioridad'] = normalizar_prioridad(origen.get('prioridad'))
+        plazo = origen.get('plazo')
+        if plazo is not None:
+            destino['vence'] = time.monotonic() + float(plazo)
+    
+    def preparar_tarea(self, tarea):
+        """Asigna ID, timestamp, prioridad y plazo a una tarea recibida de un cliente"""
+        tarea_id = self.obtener_tarea_id()
+        tarea['id'] = tarea_id
+        tarea['timestamp'] = time.time()
+        self.aplicar_planificacion(tarea, tarea)
+        
+        log.debug("Recibida: %s", tarea.get('operacion', 'desconocida'),
+                  extra={'tarea': tarea_id})
+        return tarea_id
+    
+    def dividir_lote(self, lote):
+        """Parte un lote del cliente en sub-lotes que se despachan como unidad"""
+        tareas = lote.get('tareas', [])
+        timestamp = time.time()
+        
+        partes = []
+        for desde in range(0, len(tareas), self.tamano_lote):
+            parte = {
+                'id': self.obtener_tarea_id(),
+                'desde': desde,
+                'tareas': tareas[desde:desde + self.tamano_lote],
+                'timestamp': timestamp
+            }
+            self.aplicar_planificacion(parte, lote)
+            partes.append(parte)
+        
+        log_lotes.debug("Recibidas %d tareas en %d sub-lotes", len(tareas), len(partes))
+        return partes
+    
+    def fragmentar_tarea(self, tarea):
+        """Parte una tarea de texto grande en tareas independientes, una por
+        fragmento; None si la tarea va entera a un worker"""
+        if not self.tamano_fragmento:
+            return None
+        fragmentos = operaciones.fragmentar(tarea.get('operacion'), tarea.get('datos'),
+                                            self.tamano_fragmento)
+        if fragmentos is None:
+            return None
+        
+        partes = []
+        for datos in fragmentos:
+            parte = {
+                'id': self.obtener_tarea_id(),
+                'operacion': tarea['operacion'],
+                'datos': datos,
+                'timestamp': tarea['timestamp'],
+                'prioridad': tarea['prioridad']
+            }
+            if 'vence' in tarea:
+                parte['vence'] = tarea['vence']
+            partes.append(parte)
+        
+        log.debug("Repartida en %d fragmentos", len(partes), extra={'tarea': tarea['id']})
+        return partes
+    
+    def combinar_fragmentos(self, tarea, respuestas):
+        """Resultado de la tarea a partir de las respuestas de sus fragmentos
+        (None = sin respuesta); si alguno falló, su error es el de la tarea"""
+        for respuesta in respuestas:
+            if respuesta is None:
+                return self.respuesta_sin_resultado(tarea)
+            if respuesta.get('estado') != 'completado':
+                return dict(respuesta, id=tarea['id'])
         
         try:
-            # Recibir datos del cliente
-            data = conn.recv(4096).decode('utf-8')
-            if not data:
+            resultado = operaciones.combinar(tarea['operacion'],
+                                             [respuesta['resultado'] for respuesta in respuestas])
+        except Exception as e:
+            return {'id': tarea['id'], 'error': f"Combinando fragmentos: {e}", 'estado': 'error'}
+        
+        workers = dict.fromkeys(respuesta.get('worker') for respuesta in respuestas)
+        return {
+            'id': tarea['id'],
+            'operacion': tarea['operacion'],
+            'resultado': resultado,
+            'estado': 'completado',
+            'worker': ','.join(str(worker) for worker in workers),
+            'fragmentos': len(respuestas)
+        }
+    
+    def tipo_mensaje(self, tarea):
+        """Tipo de mensaje con el que se envía una entrada de la cola al worker"""
+        return LOTE if 'tareas' in tarea else TAREA
+    
+    def resultados_parte(self, parte, respuesta):
+        """Resultados de un sub-lote, o timeouts si el worker no respondió"""
+        if respuesta is not None:
+            return respuesta.get('resultados', [])
+        return [self.respuesta_sin_resultado(parte)] * len(parte['tareas'])
+    
+    def encolar(self, tarea):
+        """Entrega una tarea (o sub-lote) al planificador"""
+        self.planificador.poner(tarea)
+    
+    def limite_espera(self, tarea):
+        """Instante (monotónico) hasta el que el cliente espera el resultado"""
+        limite = time.monotonic() + self.max_espera
+        return min(limite, tarea.get('vence', limite))
+    
+    def limite_ticket(self, tarea):
+        """Instante hasta el que se espera el resultado de una tarea con ticket"""
+        limite = time.monotonic() + self.almacen.ttl
+        return min(limite, tarea.get('vence', limite))
+    
+    def responder_sin_ejecutar(self, tarea, respuesta):
+        """Entrega la misma respuesta a una tarea o a cada elemento de un sub-lote"""
+        if 'tareas' in tarea:
+            respuesta = {'id': tarea['id'],
+                         'resultados': [respuesta] * len(tarea['tareas'])}
+        self.entregar_resultado(respuesta)
+    
+    def descartar_vencida(self, tarea):
+        """El planificador descartó la tarea por plazo vencido: avisar al cliente"""
+        log.info("Descartada: plazo vencido antes de despachar", extra={'tarea': tarea['id']})
+        self.responder_sin_ejecutar(tarea, self.respuesta_vencida(tarea['id']))
+    
+    def esperando(self, tarea_id):
+        """Indica si algún cliente sigue esperando el resultado de la tarea"""
+        with self.lock_esperas:
+            return tarea_id in self.esperas
+    
+    def reencolar(self, tarea, motivo):
+        """Devuelve al planificador una tarea que un worker no completó"""
+        # Sin cliente esperando, o con una copia duplicada todavía en otro worker
+        if not self.esperando(tarea['id']) or self.registro.en_vuelo(tarea['id']):
+            return
+        
+        # El texto en flujo ya se consumió y el cliente pudo haber recibido
+        # partes del resultado: la tarea no se puede repetir
+        if tarea.get('entrada_flujo') or tarea.get('salida_flujo'):
+            log.warning("Tarea en flujo perdida (%s)", motivo, extra={'tarea': tarea['id']})
+            self.responder_sin_ejecutar(tarea, {
+                'id': tarea['id'],
+                'error': f"La tarea en flujo no se completó: {motivo}",
+                'estado': 'error'
+            })
+            return
+        
+        tarea['intentos'] = tarea.get('intentos', 0) + 1
+        if tarea['intentos'] > self.reintentos:
+            log.warning("Abandonada tras %d reintentos (%s)", self.reintentos, motivo,
+                        extra={'tarea': tarea['id']})
+            self.responder_sin_ejecutar(tarea, {
+                'id': tarea['id'],
+                'error': (f"La tarea no se completó tras {tarea['intentos']} intentos: "
+                          f"{motivo}"),
+                'estado': 'error'
+            })
+            return
+        
+        # Ya esperó su turno una vez: vuelve en la clase más alta
+        log.warning("Reencolada (%s), intento %d", motivo, tarea['intentos'] + 1,
+                    extra={'tarea': tarea['id']})
+        tarea['prioridad'] = 0
+        self.encolar(tarea)
+    
+    def buscar_en_cache(self, tarea):
+        """Resultado cacheado para la tarea (con su nuevo ID) o None"""
+        resultado = self.cache.obtener(tarea.get('operacion'), tarea.get('datos', {}))
+        if resultado is None:
+            return None
+        
+        resultado['id'] = tarea['id']
+        resultado['cache'] = True
+        log.debug("Respondida desde cache", extra={'tarea': tarea['id']})
+        return resultado
+    
+    def guardar_en_cache(self, tarea, resultado):
+        """Guarda el resultado si la operación es determinista"""
+        self.cache.guardar(tarea.get('operacion'), tarea.get('datos', {}), resultado)
+    
+    def estadisticas(self):
+        """Contadores del servidor que se exponen a los clientes"""
+        return {
+            'workers': len(self.registro),
+            'registro': self.registro.estadisticas(),
+            'tareas': self.tarea_id,
+            'cola': self.planificador.estadisticas(),
+            'admision': self.admision.estadisticas(),
+            'cache': self.cache.estadisticas(),
+            'tickets': self.almacen.estadisticas(),
+            'latencias': self.registro.latencias.estadisticas(),
+            'duplicadas': {'enviadas': self.total_duplicadas,
+                           'ganadoras': self.duplicadas_ganadoras},
+            'coalescidas': self.total_coalescidas,
+            'etapas': self.metricas.resumen(),
+            'log': {'descartados': bitacora.descartados()},
+            'diario': self.diario.estadisticas() if self.diario is not None else None,
+            'cluster': {'nodo': self.nombre_nodo,
+                        'pares': [enlace.describir() for enlace in self.enlaces]}
+        }
+    
+    def texto_metricas(self):
+        """Métricas en formato de texto de Prometheus"""
+        cola = self.planificador.estadisticas()
+        admision = self.admision.estadisticas()
+        cache = self.cache.estadisticas()
+        almacen = self.almacen.estadisticas()
+        registro = self.registro.estadisticas()
+        return self.metricas.exponer([
+            ('tareas_en_cola', 'gauge', 'Tareas y sub-lotes en cola por prioridad',
+             [({'prioridad': p}, n) for p, n in cola['pendientes'].items()]),
+            ('tareas_en_vuelo', 'gauge', 'Tareas y sub-lotes despachados sin respuesta',
+             [({'worker': w['nombre']}, w['en_vuelo']) for w in registro['conectados']]),
+            ('tareas_pendientes', 'gauge', 'Tareas admitidas sin responder al cliente',
+             [({}, admision['pendientes'])]),
+            ('tareas_rechazadas_total', 'counter', 'Tareas rechazadas por motivo',
+             [({'motivo': m}, n) for m, n in admision['rechazadas'].items()]),
+            ('tareas_vencidas_total', 'counter', 'Tareas descartadas en cola por plazo',
+             [({}, cola['vencidas'])]),
+            ('tareas_duplicadas_total', 'counter', 'Copias de tareas rezagadas',
+             [({}, self.total_duplicadas)]),
+            ('tareas_en_curso_unibles', 'gauge',
+             'Tareas puras en cola o en un worker a las que se unen las iguales',
+             [({}, len(self.en_curso))]),
+            ('workers_conectados', 'gauge', 'Workers registrados',
+             [({}, len(registro['conectados']))]),
+            ('workers_expulsados_total', 'counter', 'Workers dados de baja sin latidos',
+             [({}, registro['expulsados'])]),
+            ('cache_aciertos_total', 'counter', 'Tareas respondidas desde cache',
+             [({}, cache['aciertos'])]),
+            ('cache_fallos_total', 'counter', 'Consultas al cache sin resultado',
+             [({}, cache['fallos'])]),
+            ('cache_bytes', 'gauge', 'Memoria usada por el cache',
+             [({}, cache['bytes'])]),
+            ('tickets_pendientes', 'gauge', 'Tareas con ticket sin resultado',
+             [({}, almacen['pendientes'])]),
+            ('tickets_resultados', 'gauge', 'Resultados de tickets guardados sin vencer',
+             [({}, almacen['resultados'])]),
+            ('tickets_bytes', 'gauge', 'Memoria usada por los resultados de tickets',
+             [({}, almacen['bytes'])]),
+            ('tickets_desalojados_total', 'counter',
+             'Resultados de tickets desalojados antes de vencer por falta de memoria',
+             [({}, almacen['desalojados'])]),
+            ('log_descartados_total', 'counter', 'Mensajes de log descartados por cola llena',
+             [({}, bitacora.descartados())]),
+        ] + self.medidores_diario())
+    
+    def medidores_diario(self):
+        """Métricas del diario, si está activo"""
+        if self.diario is None:
+            return []
+        diario = self.diario.estadisticas()
+        return [
+            ('diario_tareas_vivas', 'gauge', 'Tareas aceptadas sin terminar en el diario',
+             [({}, diario['vivas'])]),
+            ('diario_eventos_total', 'counter', 'Eventos escritos en el diario',
+             [({}, diario['eventos'])]),
+            ('diario_fsync_total', 'counter', 'Grupos de eventos sincronizados en disco',
+             [({}, diario['grupos'])]),
+        ]
+    
+    def registrar_operaciones_worker(self, nombre, declaradas):
+        """Incorpora el registro de operaciones que anunció un worker"""
+        with self.lock_operaciones:
+            for operacion, metadatos in declaradas.items():
+                if operacion not in self.operaciones:
+                    log_workers.info("%s agrega la operación '%s'", nombre, operacion)
+                    self.operaciones[operacion] = metadatos
+                    if metadatos.get('cacheable'):
+                        self.cache.operaciones.add(operacion)
+    
+    def saludo_servidor(self, codec=CODEC_JSON):
+        """Respuesta al saludo de un worker: operaciones con modelo de costo,
+        cada cuántos segundos debe enviar un latido y el codec elegido"""
+        return {'operaciones': sorted(operaciones.REGISTRO),
+                'latido': self.intervalo_latido,
+                'codec': NOMBRES_CODEC[codec]}
+    
+    def asignar_tarea(self, tarea, devolver=True):
+        """Reserva la tarea en el worker menos cargado; si ninguno tiene créditos
+        (se desconectó mientras tanto) la devuelve al planificador, salvo que
+        `devolver` sea False"""
+        # El cliente ya recibió respuesta (p. ej. de un intento anterior)
+        if not self.esperando(tarea['id']):
+            return None
+        
+        tarea['costo'] = self.costo_estimado(tarea)
+        conexion = self.registro.asignar(tarea, self.lease_de(tarea))
+        if conexion is None:
+            if devolver:
+                self.encolar(tarea)
+        else:
+            self.marcar(tarea['id'], 'despachada')
+            if self.diario is not None:
+                self.diario.despachada(tarea['id'], conexion.nombre)
+            if conexion.par:
+                self.metricas.contar('tareas_prestadas', par=conexion.nombre)
+        return conexion
+    
+    def retener(self, tarea, conexion):
+        """La tarea que no se pudo asignar (solo había créditos en pares que no
+        la pueden recibir, o el worker se desconectó) queda en el despachador
+        hasta que un worker propio tenga créditos: devuelta a la cola quedaría
+        detrás de todas las de su clase. Retorna la tarea retenida o None"""
+        if conexion is None and self.esperando(tarea['id']):
+            return tarea
+        return None
+    
+    def lease_de(self, tarea):
+        """Segundos que se presta una tarea a un worker"""
+        if tarea.get('entrada_flujo'):
+            # El costo no se conoce hasta que llega todo el texto
+            return self.max_espera
+        return self.lease + FACTOR_LEASE * tarea['costo']
+    
+    def recibir_resultado(self, conexion, resultado):
+        """Libera el crédito de la tarea respondida y entrega el resultado al cliente.
+        Retorna True si se liberó un crédito"""
+        tarea_id = resultado.get('id')
+        liberado = self.registro.completar(conexion, tarea_id) is not None
+        
+        if self.entregar_resultado(resultado):
+            # Si la tarea estaba duplicada, la otra copia se ignora al llegar
+            with self.lock_esperas:
+                if self.duplicadas.pop(tarea_id, None) is conexion:
+                    self.duplicadas_ganadoras += 1
+        return liberado
+    
+    def umbral_duplicado(self, tarea):
+        """Segundos en vuelo tras los cuales conviene duplicar la tarea, o None
+        si no corresponde (lotes, operaciones no idempotentes, pocas muestras)"""
+        if (not self.percentil_duplicado or 'tareas' in tarea or tarea.get('duplicada')
+                or tarea.get('entrada_flujo') or tarea.get('salida_flujo')):
+            return None
+        
+        operacion = tarea.get('operacion')
+        with self.lock_operaciones:
+            idempotente = self.operaciones.get(operacion, {}).get('pura')
+        if not idempotente:
+            return None
+        
+        percentil = self.registro.latencias.percentil(operacion, self.percentil_duplicado)
+        return None if percentil is None else max(percentil, DUPLICADO_MINIMO)
+    
+    def duplicar_rezagadas(self):
+        """Envía una copia de cada tarea rezagada a otro worker con créditos libres"""
+        # Con tareas en cola, los créditos libres son para ellas
+        if len(self.planificador):
+            return
+        
+        for conexion, tarea in self.registro.rezagadas(self.umbral_duplicado):
+            if not self.esperando(tarea['id']):
+                continue
+            otra = self.registro.asignar(tarea, self.lease_de(tarea), excluir=conexion)
+            if otra is None:
                 return
             
-            tarea = json.loads(data)
-            tarea_id = self.obtener_tarea_id()
-            tarea['id'] = tarea_id
-            tarea['timestamp'] = datetime.now().isoformat()
+            tarea['duplicada'] = True
+            with self.lock_esperas:
+                self.duplicadas[tarea['id']] = otra
+                self.total_duplicadas += 1
+            log.info("Rezagada en %s: duplicada en %s", conexion.nombre, otra.nombre,
+                     extra={'tarea': tarea['id']})
+            otra.salida.put_nowait(tarea)
+    
+    def descartar_no_codificable(self, conexion, tarea, error):
+        """La tarea no entra en el codec del worker (p. ej. un entero enorme en
+        JSON): se libera su crédito y se responde el error al cliente.
+        Retorna True si se liberó un crédito"""
+        log.warning("No se puede enviar a %s: %s", conexion.nombre, error,
+                    extra={'tarea': tarea['id']})
+        liberado = self.registro.completar(conexion, tarea['id']) is not None
+        self.responder_sin_ejecutar(tarea, {'id': tarea['id'], 'error': str(error),
+                                            'estado': 'error'})
+        return liberado
+    
+    def reencolar_leases_vencidos(self):
+        """Envía a otro worker una copia de cada tarea que un worker vivo no
+        respondió antes del lease. El original conserva su crédito hasta que
+        responda o se desconecte: puede estar ejecutándola todavía"""
+        for conexion, tarea in self.registro.leases_vencidos():
+            tarea_id = tarea['id']
+            motivo = f"sin respuesta de {conexion.nombre} antes del lease"
+            lease = self.lease_de(tarea)
+            
+            # Sin cliente esperando, o con una copia todavía en otro worker
+            if not self.esperando(tarea_id) or self.registro.en_vuelo(tarea_id, excluir=conexion):
+                self.registro.renovar_lease(conexion, tarea_id, lease)
+                continue
+            
+            if tarea.get('entrada_flujo') or tarea.get('salida_flujo'):
+                log.warning("Tarea en flujo perdida (%s)", motivo, extra={'tarea': tarea_id})
+                self.registro.renovar_lease(conexion, tarea_id, lease)
+                self.responder_sin_ejecutar(tarea, {
+                    'id': tarea_id,
+                    'error': f"La tarea en flujo no se completó: {motivo}",
+                    'estado': 'error'
+                })
+                continue
+            
+            if tarea.get('intentos', 0) + 1 > self.reintentos:
+                log.warning("Abandonada tras %d reintentos (%s)", self.reintentos, motivo,
+                            extra={'tarea': tarea_id})
+                self.registro.renovar_lease(conexion, tarea_id, lease)
+                self.responder_sin_ejecutar(tarea, {
+                    'id': tarea_id,
+                    'error': (f"La tarea no se completó tras {tarea.get('intentos', 0) + 1} "
+                              f"intentos: {motivo}"),
+                    'estado': 'error'
+                })
+                continue
+            
+            # Sin otro worker libre el lease sigue vencido y se reintenta en la
+            # próxima revisión
+            otra = self.registro.asignar(tarea, lease, excluir=conexion)
+            if otra is None:
+                continue
             
-            print(f"[TAREA {tarea_id}] Recibida: {tarea.get('operacion', 'desconocida')}")
+            tarea['intentos'] = tarea.get('intentos', 0) + 1
+            # La copia no se vuelve a duplicar por rezagada
+            tarea['duplicada'] = True
+            self.registro.renovar_lease(conexion, tarea_id, lease)
+            log.warning("%s: copia en %s, intento %d", motivo, otra.nombre,
+                        tarea['intentos'] + 1, extra={'tarea': tarea_id})
+            otra.salida.put_nowait(tarea)
+    
+    def recuperar_tareas(self, conexion):
+        """Reencola las tareas que quedaron en vuelo en un worker desconectado"""
+        for tarea in self.registro.recuperar(conexion):
+            self.reencolar(tarea, f"{conexion.nombre} se desconectó")
+    
+    def expulsar_inactivos(self):
+        """Da de baja a los workers sin latidos recientes y corta su conexión"""
+        for conexion in self.registro.vencidos(self.tolerancia_latido):
+            log_workers.warning("%s (%s) sin mensajes hace más de %gs: se da de baja",
+                                conexion.nombre, conexion.addr, self.tolerancia_latido)
+            self.cortar_conexion(conexion)
+    
+    def cortar_conexion(self, conexion):
+        """Cierra el socket de un worker para que su hilo lector termine"""
+        try:
+            conexion.canal.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def costo_estimado(self, tarea):
+        """Segundos estimados de una tarea o sub-lote, según el registro"""
+        if 'tareas' in tarea:
+            return sum(operaciones.costo_estimado(t.get('operacion'), t.get('datos', {}))
+                       for t in tarea['tareas'])
+        return operaciones.costo_estimado(tarea.get('operacion'), tarea.get('datos', {}))
+    
+    def respuesta_timeout(self, tarea_id):
+        """Resultado que se envía al cliente cuando vence el plazo"""
+        return {
+            'id': tarea_id,
+            'error': 'Timeout: no hay workers disponibles',
+            'estado': 'timeout'
+        }
+    
+    def respuesta_vencida(self, tarea_id):
+        """Resultado para una tarea cuyo plazo pedido por el cliente venció"""
+        return {
+            'id': tarea_id,
+            'error': 'Plazo vencido antes de procesar la tarea',
+            'estado': 'vencida'
+        }
+    
+    def sugerir_reintento(self):
+        """Segundos sugeridos al cliente rechazado: lo que tarda en vaciarse la cola"""
+        if not len(self.registro):
+            return REINTENTO_MAXIMO
+        ritmo = self.registro.ritmo()
+        if not ritmo:
+            return REINTENTO_SIN_DATOS
+        estimado = (len(self.planificador) + 1) / ritmo
+        return min(REINTENTO_MAXIMO, max(REINTENTO_MINIMO, estimado))
+    
+    def admitir(self, origen, unidades):
+        """None si se admiten `unidades` tareas del cliente; si no, la respuesta
+        de rechazo con el tiempo sugerido para reintentar"""
+        motivo = self.admision.admitir(origen, unidades, len(self.planificador))
+        if motivo is None:
+            return None
+        
+        log_clientes.debug("%s: rechazadas %d tareas (%s)", origen, unidades, motivo)
+        return {
+            'error': f'Servidor ocupado: {motivo}',
+            'estado': 'rechazado',
+            'reintentar_en': round(self.sugerir_reintento(), 3)
+        }
+    
+    def respuesta_sin_resultado(self, tarea):
+        """Vencida si se pasó el plazo del cliente; timeout en otro caso"""
+        if tarea.get('vence', float('inf')) <= time.monotonic():
+            return self.respuesta_vencida(tarea['id'])
+        return self.respuesta_timeout(tarea['id'])
+    
+    def procesar_tarea_cliente(self, conn, tarea, origen=None, codec=CODEC_JSON):
+        """Encola una tarea del cliente y le responde con su resultado"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+        
+        # Las operaciones deterministas ya calculadas no pasan por la cola
+        resultado = self.buscar_en_cache(tarea)
+        if resultado is not None:
+            enviar_mensaje(conn, RESULTADO, resultado, codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='cache')
+            return
+        
+        # Los textos grandes se reparten entre todos los workers
+        partes = self.fragmentar_tarea(tarea)
+        if partes is not None:
+            self.procesar_fragmentada(conn, tarea, partes, aceptada, origen, codec)
+            return
+        
+        # Una copia de una tarea en curso también ocupa un hilo y una conexión:
+        # cuenta para la admisión como cualquier otra
+        rechazo = self.admitir(origen, 1)
+        if rechazo is not None:
+            enviar_mensaje(conn, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='rechazado')
+            return
+        
+        try:
+            # La misma tarea ya está en cola o en un worker: se espera ese resultado
+            clave = self.clave_en_curso(tarea)
+            limite = self.limite_espera(tarea)
+            original = self.unirse_en_curso(clave, tarea)
+            if original is not None:
+                resultado = original.esperar(max(0, limite - time.monotonic()))
+                resultado = self.respuesta_coalescida(tarea, resultado, limite)
+                if resultado is not None:
+                    enviar_mensaje(conn, RESULTADO, resultado, codec)
+                    self.metricas.contar('tareas_respondidas', operacion=operacion,
+                                         estado=resultado.get('estado', 'desconocido'))
+                    return
             
-            # Registrar cliente esperando resultado
-            with self.lock_clientes:
-                self.clientes_esperando[tarea_id] = conn
+            # Registrar la espera antes de encolar para no perder el resultado
+            espera = self.registrar_espera(tarea_id)
+            espera.marcas['aceptada'] = aceptada
+            self.abrir_en_curso(clave, espera, tarea)
+            
+            # Con diario, la tarea se encola recién cuando está en disco
+            self.esperar_diario(self.anotar_aceptadas([tarea]))
             
             # Agregar tarea a la cola
-            self.cola_tareas.put(tarea)
-            
-            # Esperar resultado (con timeout)
-            tiempo_espera = 0
-            max_espera = 30  # 30 segundos máximo
-            
-            while tiempo_espera < max_espera:
-                with self.lock_resultados:
-                    if tarea_id in self.resultados:
-                        resultado = self.resultados.pop(tarea_id)
-                        respuesta = json.dumps(resultado)
-                        conn.sendall(respuesta.encode('utf-8'))
-                        print(f"[TAREA {tarea_id}] Resultado enviado al cliente")
-                        break
-                
-                time.sleep(0.1)
-                tiempo_espera += 0.1
+            espera.marcas['encolada'] = time.monotonic()
+            self.encolar(tarea)
+            
+            # Esperar resultado hasta el plazo máximo (o el del cliente si es menor)
+            resultado = espera.esperar(max(0, limite - time.monotonic()))
+            
+            if resultado is not None:
+                self.guardar_en_cache(tarea, resultado)
+                enviar_mensaje(conn, RESULTADO, resultado, codec)
+                log.debug("Resultado enviado al cliente", extra={'tarea': tarea_id})
             else:
                 # Timeout
-                error = {
-                    'id': tarea_id,
-                    'error': 'Timeout: no hay workers disponibles',
-                    'estado': 'timeout'
-                }
-                conn.sendall(json.dumps(error).encode('utf-8'))
-                print(f"[TAREA {tarea_id}] Timeout - no procesada")
-        
-        except Exception as e:
-            print(f"[ERROR] Manejando cliente: {e}")
+                resultado = self.respuesta_sin_resultado(tarea)
+                enviar_mensaje(conn, RESULTADO, resultado, codec)
+                log.warning("Timeout - no procesada", extra={'tarea': tarea_id})
+            self.medir_respuesta(operacion, espera, resultado.get('estado', 'desconocido'))
         
         finally:
-            with self.lock_clientes:
-                if tarea_id in self.clientes_esperando:
-                    del self.clientes_esperando[tarea_id]
-            conn.close()
+            self.descartar_espera(tarea_id)
+            self.admision.liberar(origen, 1)
     
-    def manejar_worker(self, conn, addr):
-        """Maneja la conexión de un worker que procesa tareas"""
-        print(f"[WORKER] Conectado desde {addr}")
+    def respuesta_coalescida(self, tarea, resultado, limite):
+        """Respuesta de una tarea unida a otra igual: el resultado de la
+        original con el ID propio, o timeout/vencida si no llegó antes del
+        límite de esta. None si la original terminó sin resultado (timeout o
+        vencida) y a esta todavía le queda tiempo: se encola ella misma"""
+        if resultado is None or resultado.get('estado') in ('timeout', 'vencida'):
+            if limite > time.monotonic():
+                return None
+            return self.respuesta_sin_resultado(tarea)
+        with self.lock_esperas:
+            self.total_coalescidas += 1
+        self.metricas.contar('tareas_coalescidas', operacion=self.etiqueta_operacion(tarea))
+        log.debug("Respondida con el resultado de la tarea %s", resultado.get('id'),
+                  extra={'tarea': tarea['id']})
+        return dict(resultado, id=tarea['id'], coalescida=True)
+    
+    def respuesta_ticket(self, tarea):
+        """Respuesta inmediata a una tarea con ticket"""
+        return {'id': tarea['id'], 'ticket': tarea['ticket'], 'estado': 'aceptada'}
+    
+    def procesar_ticket_cliente(self, conn, tarea, origen=None, codec=CODEC_JSON):
+        """Encola una tarea del cliente y le responde enseguida con un ticket;
+        el resultado queda en el almacén y la conexión sigue libre"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+        
+        # Ya calculada: el resultado queda disponible de inmediato
+        resultado = self.buscar_en_cache(tarea)
+        if resultado is not None:
+            tarea['ticket'] = self.almacen.abrir(tarea_id)
+            self.almacen.guardar(resultado)
+            enviar_mensaje(conn, RESULTADO, self.respuesta_ticket(tarea), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='cache')
+            return
+        
+        rechazo = self.admitir(origen, 1)
+        if rechazo is not None:
+            enviar_mensaje(conn, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='rechazado')
+            return
+        
+        # La admisión se libera cuando llega el resultado (o vence el ticket)
+        espera = self.registrar_ticket(tarea, origen)
+        espera.marcas['aceptada'] = aceptada
+        
+        # Con diario, el ticket se entrega cuando la tarea ya está en disco
+        self.esperar_diario(self.anotar_aceptadas([tarea]))
+        espera.marcas['encolada'] = time.monotonic()
+        self.encolar(tarea)
+        enviar_mensaje(conn, RESULTADO, self.respuesta_ticket(tarea), codec)
+    
+    def leer_consulta(self, consulta):
+        """(tickets, segundos a esperar) de una consulta o suscripción"""
+        # Un ticket siempre es texto: cualquier otro valor es desconocido
+        tickets = [ticket if isinstance(ticket, str) else ''
+                   for ticket in consulta.get('tickets', [])]
+        espera = min(float(consulta.get('espera') or 0), self.max_espera)
+        return tickets, espera
+    
+    def consultar_tickets(self, consulta):
+        """Resultados de los tickets pedidos, en el mismo orden. Con 'espera',
+        aguarda hasta esos segundos a que se resuelvan los pendientes"""
+        tickets, espera = self.leer_consulta(consulta)
+        recibidos = {}
+        if espera > 0:
+            avisos = queue.Queue()
+            self.almacen.suscribir(tickets, avisos.put)
+            limite = time.monotonic() + espera
+            try:
+                for _ in tickets:
+                    resultado = avisos.get(timeout=max(0, limite - time.monotonic()))
+                    recibidos[resultado['ticket']] = resultado
+            except queue.Empty:
+                pass
+            finally:
+                self.almacen.desuscribir(tickets, avisos.put)
+        return {'resultados': [recibidos.get(ticket) or self.almacen.obtener(ticket)
+                               for ticket in tickets]}
+    
+    def atender_suscripcion(self, conn, lector, suscripcion, codec=CODEC_JSON):
+        """Envía cada resultado de los tickets suscritos apenas llega. El
+        cliente puede sumar tickets con más mensajes SUSCRIPCION; la
+        suscripción dura hasta que cierra la conexión"""
+        avisos = queue.Queue()
+        suscritos = []
         
-        with self.lock_workers:
-            self.workers_conectados.append(addr)
+        def agregar(mensaje):
+            tickets, _ = self.leer_consulta(mensaje)
+            suscritos.extend(tickets)
+            self.almacen.suscribir(tickets, avisos.put)
+        
+        def leer():
+            try:
+                while True:
+                    mensaje = lector.recibir()
+                    if mensaje is None:
+                        break
+                    tipo, cuerpo = mensaje
+                    if tipo != SUSCRIPCION:
+                        raise ErrorProtocolo(f"Se esperaba una suscripción: tipo {tipo}")
+                    agregar(cuerpo)
+            except (OSError, ErrorProtocolo) as e:
+                log_clientes.error("En suscripción: %s", e)
+            finally:
+                avisos.put(None)
         
+        agregar(suscripcion)
+        # Un hilo lee los tickets nuevos; este es el único que escribe
+        threading.Thread(target=leer, daemon=True).start()
         try:
             while True:
-                # Worker está disponible, agregar a la cola
-                self.workers_disponibles.put(conn)
-                
-                # Esperar por una tarea
-                try:
-                    tarea = self.cola_tareas.get(timeout=1)
-                except queue.Empty:
-                    continue
-                
-                # Sacar worker de la cola de disponibles
-                try:
-                    self.workers_disponibles.get_nowait()
-                except queue.Empty:
+                resultado = avisos.get()
+                if resultado is None:
+                    break
+                enviar_mensaje(conn, RESULTADO, resultado, codec)
+        finally:
+            self.almacen.desuscribir(list(suscritos), avisos.put)
+    
+    def procesar_fragmentada(self, conn, tarea, partes, aceptada, origen=None,
+                             codec=CODEC_JSON):
+        """Encola los fragmentos de una tarea y responde con los resultados combinados"""
+        rechazo = self.admitir(origen, len(partes))
+        if rechazo is not None:
+            enviar_mensaje(conn, RESULTADO, dict(rechazo, id=tarea['id']), codec)
+            self.metricas.contar('tareas_respondidas', operacion=tarea['operacion'],
+                                 estado='rechazado')
+            return
+        
+        esperas = [self.registrar_espera(parte['id']) for parte in partes]
+        
+        try:
+            self.esperar_diario(self.anotar_aceptadas(partes))
+            for parte, espera in zip(partes, esperas):
+                espera.marcas.update(aceptada=aceptada, encolada=time.monotonic())
+                self.encolar(parte)
+            
+            # Los fragmentos se ejecutan en paralelo; se recogen en orden
+            limite = self.limite_espera(tarea)
+            respuestas = [espera.esperar(max(0, limite - time.monotonic()))
+                          for espera in esperas]
+            
+            resultado = self.combinar_fragmentos(tarea, respuestas)
+            if resultado['estado'] == 'completado':
+                self.guardar_en_cache(tarea, resultado)
+            enviar_mensaje(conn, RESULTADO, resultado, codec)
+            log.debug("Resultado de %d fragmentos enviado al cliente", len(partes),
+                      extra={'tarea': tarea['id']})
+            
+            self.metricas.contar('tareas_fragmentadas', operacion=tarea['operacion'],
+                                 estado=resultado['estado'])
+            for espera, respuesta in zip(esperas, respuestas):
+                self.medir_respuesta('fragmento', espera,
+                                     respuesta.get('estado', 'desconocido')
+                                     if respuesta is not None else 'timeout')
+        
+        finally:
+            for parte in partes:
+                self.descartar_espera(parte['id'])
+            self.admision.liberar(origen, len(partes))
+    
+    def error_flujo(self, tarea):
+        """Respuesta de error si la tarea no se puede atender en flujo (con
+        ticket, o una operación que no recibe el texto en flujo); None si se puede"""
+        if tarea.get('ticket'):
+            return {'error': "Una tarea en flujo no admite ticket: necesita la conexión",
+                    'estado': 'error'}
+        if not tarea.get('entrada_flujo'):
+            return None
+        operacion = tarea.get('operacion')
+        with self.lock_operaciones:
+            en_flujo = self.operaciones.get(operacion, {}).get('en_flujo')
+        if en_flujo:
+            return None
+        return {'error': f"La operación {operacion} no admite el texto en flujo",
+                'estado': 'error'}
+    
+    def leer_parte(self, mensaje):
+        """Cuerpo de una parte del texto que envía el cliente"""
+        if mensaje is None:
+            raise ErrorProtocolo("El cliente cerró la conexión a mitad del texto")
+        tipo, parte = mensaje
+        if tipo != FRAGMENTO:
+            raise ErrorProtocolo(f"Se esperaba una parte del texto: tipo {tipo}")
+        return parte
+    
+    def procesar_flujo_cliente(self, conn, lector, tarea, origen=None, codec=CODEC_JSON):
+        """Tarea con el texto o el resultado en flujo: reenvía cada parte del
+        texto al worker apenas llega y cada parte del resultado al cliente,
+        sin armar ninguno de los dos completo"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+        
+        rechazo = self.error_flujo(tarea) or self.admitir(origen, 1)
+        if rechazo is not None:
+            # El cliente ya está enviando el texto: se lee y se descarta
+            if tarea.get('entrada_flujo'):
+                while not self.leer_parte(lector.recibir()).get('fin'):
                     pass
+            enviar_mensaje(conn, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion,
+                                 estado=rechazo['estado'])
+            return
+        
+        espera = self.registrar_espera(tarea_id, flujo=True)
+        espera.marcas['aceptada'] = aceptada
+        subida = None
+        
+        try:
+            self.esperar_diario(self.anotar_aceptadas([tarea]))
+            espera.marcas['encolada'] = time.monotonic()
+            self.encolar(tarea)
+            limite = self.limite_espera(tarea)
+            
+            # El texto sube en otro hilo mientras este baja el resultado: si no,
+            # con ambos en flujo cada lado esperaría a que el otro lea
+            if tarea.get('entrada_flujo'):
+                subida = threading.Thread(target=self.reenviar_entrada,
+                                          args=(conn, lector, tarea_id, espera, limite))
+                subida.daemon = True
+                subida.start()
+            
+            resultado = self.responder_en_flujo(conn, espera, limite, codec)
+            if subida is not None:
+                subida.join()
+            if resultado is None:
+                resultado = self.respuesta_sin_resultado(tarea)
+                log.warning("Timeout - no procesada", extra={'tarea': tarea_id})
+            enviar_mensaje(conn, RESULTADO, resultado, codec)
+            self.medir_respuesta(operacion, espera, resultado.get('estado', 'desconocido'))
+        
+        finally:
+            espera.cerrar()
+            if subida is not None:
+                subida.join()
+            self.descartar_espera(tarea_id)
+            self.admision.liberar(origen, 1)
+    
+    def reenviar_entrada(self, conn, lector, tarea_id, espera, limite):
+        """Reenvía al worker cada parte del texto que manda el cliente apenas
+        llega. Si la tarea termina antes (error, plazo), descarta el resto"""
+        reenviando = True
+        fin = False
+        try:
+            while not fin:
+                parte = self.leer_parte(lector.recibir())
+                fin = bool(parte.get('fin'))
+                conexion = espera.reservar(limite) if reenviando else None
+                if conexion is None:
+                    # Ya no se reenvía: el worker deja de esperar el resto
+                    reenviando = False
+                    espera.cancelar_entrada(tarea_id)
+                    continue
+                conexion.salida.put_nowait(ParteFlujo(
+                    {'id': tarea_id, 'texto': parte.get('texto', ''), 'fin': fin}, espera))
+        
+        except (OSError, ErrorProtocolo) as e:
+            # Sin el resto del texto la conexión queda desincronizada: se corta
+            log_clientes.error("Recibiendo el texto: %s", e, extra={'tarea': tarea_id})
+            espera.cerrar()
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        
+        finally:
+            if reenviando and not fin:
+                espera.cancelar_entrada(tarea_id)
+    
+    def responder_en_flujo(self, conn, espera, limite, codec):
+        """Envía al cliente cada parte del resultado apenas llega del worker.
+        Retorna la respuesta final, o None si venció el plazo"""
+        while True:
+            elemento = espera.siguiente(max(0, limite - time.monotonic()))
+            if not isinstance(elemento, str):
+                return elemento
+            enviar_mensaje(conn, FRAGMENTO, {'parte': elemento}, codec)
+    
+    def rechazo_lote(self, rechazo, cantidad):
+        """Respuesta final de un lote rechazado completo"""
+        return dict(rechazo, desde=0, resultados=[rechazo] * cantidad, fin=True)
+    
+    def procesar_lote_cliente(self, conn, lote, origen=None, codec=CODEC_JSON):
+        """Encola los sub-lotes de un lote y responde todo junto o en flujo"""
+        aceptada = time.monotonic()
+        cantidad = len(lote.get('tareas', []))
+        rechazo = self.admitir(origen, cantidad)
+        if rechazo is not None:
+            enviar_mensaje(conn, RESULTADO_LOTE, self.rechazo_lote(rechazo, cantidad), codec)
+            self.metricas.contar('tareas_respondidas', operacion='lote', estado='rechazado')
+            return
+        
+        flujo = lote.get('flujo', False)
+        partes = self.dividir_lote(lote)
+        esperas = [self.registrar_espera(parte['id']) for parte in partes]
+        
+        try:
+            self.esperar_diario(self.anotar_aceptadas(partes))
+            for parte, espera in zip(partes, esperas):
+                espera.marcas.update(aceptada=aceptada, encolada=time.monotonic())
+                self.encolar(parte)
+            
+            # Un único plazo para todo el lote (las partes comparten el vencimiento)
+            limite = self.limite_espera(partes[0]) if partes else time.monotonic()
+            resultados = []
+            
+            estados = []
+            
+            for parte, espera in zip(partes, esperas):
+                respuesta = espera.esperar(max(0, limite - time.monotonic()))
+                parciales = self.resultados_parte(parte, respuesta)
+                estados.append('completado' if respuesta is not None else 'timeout')
                 
-                # Enviar tarea al worker
-                tarea_json = json.dumps(tarea)
-                conn.sendall(tarea_json.encode('utf-8'))
-                print(f"[TAREA {tarea['id']}] Enviada a worker {addr}")
-                
-                # Recibir resultado del worker
-                data = conn.recv(4096).decode('utf-8')
-                if not data:
-                    print(f"[WORKER] {addr} desconectado")
+                if flujo:
+                    # Cada sub-lote se envía apenas está listo
+                    enviar_mensaje(conn, RESULTADO_LOTE, {
+                        'desde': parte['desde'], 'resultados': parciales, 'fin': False
+                    }, codec)
+                    self.medir_respuesta('lote', espera, estados[-1])
+                else:
+                    resultados.extend(parciales)
+            
+            enviar_mensaje(conn, RESULTADO_LOTE, {
+                'desde': 0, 'resultados': resultados, 'fin': True
+            }, codec)
+            log_lotes.debug("%d resultados enviados al cliente", cantidad)
+            if not flujo:
+                for espera, estado in zip(esperas, estados):
+                    self.medir_respuesta('lote', espera, estado)
+        
+        finally:
+            for parte in partes:
+                self.descartar_espera(parte['id'])
+            self.admision.liberar(origen, cantidad)
+    
+    def manejar_worker(self, conn, addr):
+        """Maneja la conexión de un worker que procesa tareas"""
+        log_workers.info("Conectado desde %s", addr)
+        
+        lector = LectorMensajes(conn)
+        conexion = None
+        try:
+            # El worker anuncia cuántas tareas puede tener en vuelo y qué operaciones sabe
+            nombre, capacidad, declaradas, codec, par = leer_hola(lector.recibir(), addr)
+            conexion = ConexionWorker(addr, nombre, capacidad, declaradas,
+                                      canal=conn, salida=queue.Queue(), codec=codec, par=par)
+            self.registrar_operaciones_worker(nombre, declaradas)
+            enviar_mensaje(conn, HOLA, self.saludo_servidor(codec))
+            log_workers.info("%s (%s) con capacidad %d, codec %s",
+                             nombre, addr, capacidad, NOMBRES_CODEC[codec])
+            
+            # Un hilo envía las tareas que el despachador le asigna; este lee resultados
+            thread = threading.Thread(target=self.enviar_a_worker,
+                                      args=(conn, conexion))
+            thread.daemon = True
+            thread.start()
+            
+            self.registro.agregar(conexion)
+            
+            while True:
+                mensaje = lector.recibir()
+                if mensaje is None:
                     break
                 
-                resultado = json.loads(data)
+                # Cualquier mensaje cuenta como señal de vida
+                self.registro.latido(conexion)
+                tipo, resultado = mensaje
+                if tipo == LATIDO:
+                    self.recibir_latido(conexion, resultado)
+                    continue
+                if tipo == FRAGMENTO:
+                    self.recibir_parte(resultado)
+                    continue
+                if tipo not in (RESULTADO, RESULTADO_LOTE):
+                    raise ErrorProtocolo(f"Tipo de mensaje inesperado: {tipo}")
                 tarea_id = resultado.get('id')
                 
-                # Guardar resultado
-                with self.lock_resultados:
-                    self.resultados[tarea_id] = resultado
+                # Los resultados pueden llegar en cualquier orden
+                self.recibir_resultado(conexion, resultado)
                 
-                print(f"[TAREA {tarea_id}] Resultado recibido de worker {addr}")
+                log.debug("Resultado recibido de worker %s", addr, extra={'tarea': tarea_id})
         
         except Exception as e:
-            print(f"[ERROR] Worker {addr}: {e}")
+            log.error("Worker %s: %s", addr, e)
         
         finally:
-            with self.lock_workers:
-                if addr in self.workers_conectados:
-                    self.workers_conectados.remove(addr)
+            if conexion is not None:
+                self.registro.quitar(conexion)
+                self.recuperar_tareas(conexion)
+                conexion.salida.put(None)
             conn.close()
-            print(f"[WORKER] {addr} desconectado")
+            log_workers.info("%s desconectado", addr)
+    
+    def enviar_a_worker(self, conn, conexion):
+        """Envía a un worker las tareas que le asignó el despachador"""
+        while True:
+            tarea = conexion.salida.get()
+            if tarea is None:
+                break
+            
+            # Parte del texto de una tarea en flujo
+            if isinstance(tarea, ParteFlujo):
+                try:
+                    enviar_mensaje(conn, FRAGMENTO, tarea.mensaje, conexion.codec)
+                except OSError as e:
+                    log.error("Enviando texto a %s: %s", conexion.addr, e)
+                    break
+                finally:
+                    tarea.enviada()
+                continue
+            
+            # Enviar tarea (o sub-lote) al worker
+            try:
+                enviar_mensaje(conn, self.tipo_mensaje(tarea), self.mensaje_para(conexion, tarea),
+                               conexion.codec)
+                if tarea.get('entrada_flujo') and not self.abrir_entrada(tarea, conexion):
+                    enviar_mensaje(conn, FRAGMENTO, cancelacion(tarea['id']).mensaje,
+                                   conexion.codec)
+            except ErrorProtocolo as e:
+                self.descartar_no_codificable(conexion, tarea, e)
+                continue
+            except OSError as e:
+                log.error("Enviando tarea %s a %s: %s", tarea['id'], conexion.addr, e)
+                break
+            
+            log.debug("Enviada a worker %s (%d/%d en vuelo)", conexion.nombre,
+                      len(conexion.en_vuelo), conexion.capacidad, extra={'tarea': tarea['id']})
+    
+    def despachar(self):
+        """Asigna cada tarea del planificador al worker menos cargado"""
+        retenida = None
+        while True:
+            # Sacar una tarea solo cuando algún worker puede recibirla
+            if not self.registro.esperar_libre(timeout=1, locales=retenida is not None):
+                continue
+            
+            tarea = retenida or self.planificador.tomar(timeout=1)
+            if tarea is None:
+                continue
+            
+            conexion = self.asignar_tarea(tarea, devolver=False)
+            retenida = self.retener(tarea, conexion)
+            if conexion is not None:
+                conexion.salida.put(tarea)
+    
+    def vigilar_workers(self):
+        """Revisa periódicamente los latidos de los workers"""
+        while True:
+            time.sleep(self.intervalo_latido)
+            self.expulsar_inactivos()
+            self.reencolar_leases_vencidos()
+    
+    def vigilar_rezagadas(self):
+        """Revisa con frecuencia las tareas en vuelo que tardan más de lo normal"""
+        while True:
+            time.sleep(INTERVALO_REZAGADAS)
+            self.duplicar_rezagadas()
+    
+    def vigilar_tickets(self):
+        """Vence los tickets sin resultado y los resultados viejos"""
+        while True:
+            time.sleep(INTERVALO_TICKETS)
+            self.vencer_tickets()
     
     def aceptar_clientes(self):
         """Acepta conexiones de clientes"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((self.host, self.puerto_clientes))
-        sock.listen(5)
+        sock.listen(self.backlog)
         
-        print(f"[SERVIDOR] Escuchando clientes en puerto {self.puerto_clientes}")
+        log.info("Escuchando clientes en puerto %s", self.puerto_clientes)
         
         while True:
             conn, addr = sock.accept()
@@ -176,9 +1666,9 @@ class ServidorTareas:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((self.host, self.puerto_workers))
-        sock.listen(5)
+        sock.listen(self.backlog)
         
-        print(f"[SERVIDOR] Escuchando workers en puerto {self.puerto_workers}")
+        log.info("Escuchando workers en puerto %s", self.puerto_workers)
         
         while True:
             conn, addr = sock.accept()
@@ -186,9 +1676,42 @@ class ServidorTareas:
             thread.daemon = True
             thread.start()
     
+    def atender_metricas(self, conn):
+        """Responde una consulta HTTP de métricas (p. ej. de Prometheus)"""
+        try:
+            conn.settimeout(5)
+            peticion = b''
+            while b'\r\n\r\n' not in peticion and len(peticion) < 65536:
+                datos = conn.recv(4096)
+                if not datos:
+                    return
+                peticion += datos
+            conn.sendall(respuesta_http(peticion, self.texto_metricas))
+        except OSError as e:
+            log.error("Atendiendo métricas: %s", e)
+        finally:
+            conn.close()
+    
+    def aceptar_metricas(self):
+        """Acepta consultas de métricas en su propio puerto"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.puerto_metricas))
+        sock.listen(self.backlog)
+        
+        log.info("Métricas en http://%s:%s/metrics", self.host, self.puerto_metricas)
+        
+        while True:
+            conn, addr = sock.accept()
+            thread = threading.Thread(target=self.atender_metricas, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    
     def iniciar(self):
         """Inicia el servidor"""
-        print("[SERVIDOR] Iniciando...")
+        log.info("Iniciando...")
+        self.recuperar_diario()
+        self.iniciar_enlaces()
         
         # Thread para aceptar clientes
         thread_clientes = threading.Thread(target=self.aceptar_clientes)
@@ -200,15 +1723,107 @@ class ServidorTareas:
         thread_workers.daemon = True
         thread_workers.start()
         
-        print("[SERVIDOR] Listo para recibir conexiones")
-        print("Presiona Ctrl+C para detener")
+        # Threads que reparten tareas, dan de baja workers sin latidos,
+        # duplican tareas rezagadas, vencen tickets y exponen métricas
+        objetivos = [self.despachar, self.vigilar_workers, self.vigilar_rezagadas,
+                     self.vigilar_tickets]
+        if self.puerto_metricas:
+            objetivos.append(self.aceptar_metricas)
+        for objetivo in objetivos:
+            thread = threading.Thread(target=objetivo)
+            thread.daemon = True
+            thread.start()
+        
+        log.info("Listo para recibir conexiones")
+        log.info("Presiona Ctrl+C para detener")
         
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
-            print("\n[SERVIDOR] Deteniendo...")
+            log.info("Deteniendo...")
+            if self.diario is not None:
+                self.diario.cerrar()
 
 if __name__ == '__main__':
-    servidor = ServidorTareas()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Servidor de distribución de tareas')
+    parser.add_argument('--motor', choices=['hilos', 'asyncio'], default='hilos',
+                        help='motor de red: un hilo por conexión o un único event loop')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--puerto-clientes', type=int, default=5000)
+    parser.add_argument('--puerto-workers', type=int, default=5001)
+    parser.add_argument('--backlog', type=int, default=128,
+                        help='tamaño de la cola de conexiones pendientes')
+    parser.add_argument('--tamano-lote', type=int, default=100,
+                        help='tareas por sub-lote enviado a un worker')
+    parser.add_argument('--tamano-fragmento', type=int, default=operaciones.TAMANO_FRAGMENTO,
+                        help='caracteres a partir de los cuales un texto se reparte '
+                             'entre los workers (0 = nunca)')
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help='memoria para el cache de resultados (0 = desactivado)')
+    parser.add_argument('--ttl-resultados', type=float, default=TTL_RESULTADOS,
+                        help='segundos que se guarda el resultado de una tarea con ticket '
+                             '(y que puede tardar en completarse)')
+    parser.add_argument('--resultados-mb', type=float, default=MAX_BYTES_RESULTADOS / 2**20,
+                        help='memoria para los resultados de tareas con ticket')
+    parser.add_argument('--sin-coalescer', action='store_true',
+                        help='encolar cada copia de una tarea pura aunque otra igual '
+                             'ya esté en cola o en un worker')
+    parser.add_argument('--envejecimiento', type=float, default=ENVEJECIMIENTO_POR_DEFECTO,
+                        help='segundos de espera para subir una clase de prioridad (0 = nunca)')
+    parser.add_argument('--latido', type=float, default=INTERVALO_LATIDO,
+                        help='segundos entre latidos que se piden a cada worker')
+    parser.add_argument('--tolerancia-latido', type=float, default=TOLERANCIA_LATIDO,
+                        help='segundos sin mensajes tras los cuales se da de baja a un worker')
+    parser.add_argument('--lease', type=float, default=LEASE_BASE,
+                        help='segundos base que tiene un worker para responder una tarea')
+    parser.add_argument('--reintentos', type=int, default=REINTENTOS_POR_DEFECTO,
+                        help='veces que se reencola una tarea de un worker caído')
+    parser.add_argument('--max-cola', type=int, default=MAX_COLA,
+                        help='entradas en cola a partir de las cuales se rechaza (0 = sin límite)')
+    parser.add_argument('--max-pendientes', type=int, default=MAX_PENDIENTES,
+                        help='tareas admitidas sin responder (0 = sin límite)')
+    parser.add_argument('--max-por-cliente', type=int, default=MAX_POR_CLIENTE,
+                        help='tareas sin responder por dirección IP (0 = sin límite)')
+    parser.add_argument('--puerto-metricas', type=int, default=PUERTO_METRICAS,
+                        help='puerto HTTP con métricas para Prometheus (0 = desactivado)')
+    parser.add_argument('--percentil-duplicado', type=float, default=PERCENTIL_DUPLICADO,
+                        help='percentil de latencia a partir del cual se duplica una '
+                             'tarea idempotente (0 = nunca)')
+    parser.add_argument('--diario', default=None, metavar='DIRECTORIO',
+                        help='guardar las tareas aceptadas en disco y reencolarlas al reiniciar')
+    parser.add_argument('--durabilidad', choices=DURABILIDADES, default='sincronica',
+                        help="'sincronica': encolar tras el fsync; 'diferida': fsync periódico")
+    parser.add_argument('--pares', default='', metavar='HOST:PUERTO,...',
+                        help='puertos de workers de otros nodos del cluster a los que '
+                             'pedir tareas cuando los workers propios están ociosos')
+    bitacora.agregar_argumentos(parser)
+    args = parser.parse_args()
+    bitacora.configurar_desde(args)
+    
+    if args.motor == 'asyncio':
+        from servidor_async import ServidorTareasAsync as Motor
+    else:
+        Motor = ServidorTareas
+    
+    servidor = Motor(host=args.host, puerto_clientes=args.puerto_clientes,
+                     puerto_workers=args.puerto_workers, backlog=args.backlog,
+                     tamano_lote=args.tamano_lote,
+                     tamano_fragmento=args.tamano_fragmento,
+                     cache_bytes=int(args.cache_mb * 1024 * 1024),
+                     ttl_resultados=args.ttl_resultados,
+                     resultados_bytes=int(args.resultados_mb * 1024 * 1024),
+                     coalescer=not args.sin_coalescer,
+                     envejecimiento=args.envejecimiento,
+                     intervalo_latido=args.latido,
+                     tolerancia_latido=args.tolerancia_latido,
+                     lease=args.lease, reintentos=args.reintentos,
+                     percentil_duplicado=args.percentil_duplicado,
+                     max_cola=args.max_cola, max_pendientes=args.max_pendientes,
+                     max_por_cliente=args.max_por_cliente,
+                     puerto_metricas=args.puerto_metricas,
+                     diario=args.diario, durabilidad=args.durabilidad,
+                     pares=leer_pares(args.pares))
     servidor.iniciar()
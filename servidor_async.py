@@ -0,0 +1,746 @@
+"""
+Motor asyncio del servidor de distribución de tareas
+Atiende clientes y workers desde un único event loop usando streams
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from flujo import VENTANA_FLUJO, ParteFlujo, cancelacion
+from protocolo import (TAREA, RESULTADO, HOLA, LOTE, RESULTADO_LOTE, ESTADISTICAS,
+                       LATIDO, FRAGMENTO, CONSULTA, SUSCRIPCION, NOMBRES_CODEC, CODEC_JSON,
+                       leer_mensaje, leer_mensaje_codec, escribir_mensaje, ErrorProtocolo)
+from metricas import respuesta_http
+from registro_workers import ConexionWorker
+from servidor import (ServidorTareas, leer_hola, INTERVALO_REZAGADAS, INTERVALO_TICKETS, log,
+                      log_clientes, log_workers, log_lotes)
+
+
+class EsperaResultadoAsync:
+    """Equivalente de EsperaResultado basado en un future del event loop"""
+
+    def __init__(self, loop):
+        self.futuro = loop.create_future()
+        self.marcas = {}
+        self.ejecucion = None
+        self.clave = None
+
+    def completar(self, resultado):
+        """Resuelve el future (siempre desde el hilo del event loop)"""
+        if not self.futuro.done():
+            self.futuro.set_result(resultado)
+
+    async def esperar(self, timeout):
+        """Espera el resultado hasta el plazo; None si venció. Varias corrutinas
+        pueden esperar el mismo future (tareas coalescidas): el plazo de una no lo cancela"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.futuro), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EsperaFlujoAsync:
+    """Equivalente de EsperaFlujo para el event loop: cada cambio de estado
+    despierta con un Event a las corrutinas que esperan"""
+
+    def __init__(self):
+        self.cambio = asyncio.Event()
+        self.marcas = {}
+        self.ejecucion = None
+        self.conexion = None
+        self.por_enviar = 0
+        self.sin_entrada = False
+        self.salida = deque()
+        self.resuelta = False
+        self.cerrada = False
+
+    async def esperar_que(self, condicion, limite=None):
+        """Espera hasta que condicion() se cumpla o se pase el límite (monotónico)"""
+        while not condicion():
+            self.cambio.clear()
+            timeout = None if limite is None else max(0, limite - time.monotonic())
+            try:
+                await asyncio.wait_for(self.cambio.wait(), timeout)
+            except asyncio.TimeoutError:
+                return condicion()
+        return True
+
+    def puede_reenviar(self):
+        return self.resuelta or self.cerrada or (
+            self.conexion is not None and self.por_enviar < VENTANA_FLUJO)
+
+    def abrir(self, conexion):
+        if self.sin_entrada:
+            return False
+        self.conexion = conexion
+        self.cambio.set()
+        return True
+
+    async def reservar(self, limite):
+        """Espera lugar en la ventana sin bloquear el loop; None si ya no se reenvía"""
+        await self.esperar_que(self.puede_reenviar, limite)
+        if (self.resuelta or self.cerrada or time.monotonic() >= limite
+                or not self.puede_reenviar()):
+            return None
+        self.por_enviar += 1
+        return self.conexion
+
+    def enviada(self):
+        self.por_enviar -= 1
+        self.cambio.set()
+
+    def cancelar_entrada(self, tarea_id):
+        self.sin_entrada = True
+        if self.conexion is not None:
+            self.conexion.salida.put_nowait(cancelacion(tarea_id))
+
+    async def agregar(self, parte):
+        """Guarda una parte del resultado; con la ventana llena deja de leer del worker"""
+        await self.esperar_que(lambda: self.cerrada or len(self.salida) < VENTANA_FLUJO)
+        if not self.cerrada:
+            self.salida.append(parte)
+            self.cambio.set()
+
+    def completar(self, resultado):
+        self.resuelta = True
+        self.salida.append(resultado)
+        self.cambio.set()
+
+    async def siguiente(self, timeout):
+        """Próxima parte del resultado, la respuesta final o None si venció el plazo"""
+        if not await self.esperar_que(lambda: self.salida or self.cerrada,
+                                      time.monotonic() + timeout):
+            return None
+        if self.cerrada:
+            return None
+        elemento = self.salida.popleft()
+        self.cambio.set()
+        return elemento
+
+    def cerrar(self):
+        self.cerrada = True
+        self.salida.clear()
+        self.cambio.set()
+
+
+class ServidorTareasAsync(ServidorTareas):
+    """ServidorTareas que atiende ambos puertos desde un único event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Los eventos y los futures se crean dentro del loop en servir()
+        self.loop = None
+        self.hay_tareas = None
+        self.hay_creditos = None
+
+    def crear_espera(self):
+        """Crea el objeto de espera propio del motor (future del loop)"""
+        return EsperaResultadoAsync(self.loop)
+
+    def crear_espera_flujo(self):
+        """Crea la espera de una tarea en flujo propia del motor (event loop)"""
+        return EsperaFlujoAsync()
+    
+    def encolar(self, tarea):
+        """Encola en el planificador y despierta a los despachadores"""
+        self.planificador.poner(tarea)
+        self.hay_tareas.set()
+    
+    def encolar_ajena(self, tarea):
+        """Los enlaces con pares corren en hilos: se encola desde el loop"""
+        self.loop.call_soon_threadsafe(self.encolar, tarea)
+
+    async def esperar_diario(self, secuencia):
+        """Espera el fsync del diario sin bloquear el loop"""
+        if self.diario is None or self.diario.durabilidad != 'sincronica':
+            return
+        listo = self.loop.create_future()
+
+        def avisar():
+            # El cliente pudo haberse ido mientras tanto (futuro cancelado)
+            if not listo.done():
+                listo.set_result(None)
+
+        self.diario.al_sincronizar(
+            secuencia, lambda: self.loop.call_soon_threadsafe(avisar))
+        await listo
+
+    async def siguiente_tarea(self):
+        """Espera sin bloquear el loop hasta que el planificador tenga una tarea"""
+        while True:
+            tarea = self.planificador.extraer()
+            if tarea is not None:
+                return tarea
+            self.hay_tareas.clear()
+            await self.hay_tareas.wait()
+
+    async def manejar_cliente(self, reader, writer):
+        """Maneja la conexión de un cliente que envía tareas"""
+        addr = writer.get_extra_info('peername')
+        log_clientes.debug("Conectado desde %s", addr)
+
+        try:
+            # La conexión puede reutilizarse para varias tareas seguidas
+            while True:
+                mensaje = await leer_mensaje_codec(reader)
+                if mensaje is None:
+                    break
+
+                # Se responde en el mismo codec en que llegó el pedido
+                tipo, tarea, codec = mensaje
+                if tipo == TAREA and (tarea.get('entrada_flujo') or tarea.get('salida_flujo')):
+                    await self.procesar_flujo_cliente(reader, writer, tarea, addr[0], codec)
+                elif tipo == TAREA and tarea.get('ticket'):
+                    await self.procesar_ticket_cliente(writer, tarea, addr[0], codec)
+                elif tipo == TAREA:
+                    await self.procesar_tarea_cliente(writer, tarea, addr[0], codec)
+                elif tipo == LOTE:
+                    await self.procesar_lote_cliente(writer, tarea, addr[0], codec)
+                elif tipo == CONSULTA:
+                    await escribir_mensaje(writer, CONSULTA, await self.consultar_tickets(tarea),
+                                           codec)
+                elif tipo == SUSCRIPCION:
+                    # Desde aquí la conexión solo recibe resultados
+                    await self.atender_suscripcion(reader, writer, tarea, codec)
+                    break
+                elif tipo == ESTADISTICAS:
+                    await escribir_mensaje(writer, ESTADISTICAS, self.estadisticas(), codec)
+                else:
+                    raise ErrorProtocolo(f"Tipo de mensaje inesperado: {tipo}")
+
+        except Exception as e:
+            log.error("Manejando cliente: %s", e)
+
+        finally:
+            writer.close()
+
+    async def procesar_tarea_cliente(self, writer, tarea, origen=None, codec=CODEC_JSON):
+        """Encola una tarea del cliente y le responde con su resultado"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+
+        # Las operaciones deterministas ya calculadas no pasan por la cola
+        resultado = self.buscar_en_cache(tarea)
+        if resultado is not None:
+            await escribir_mensaje(writer, RESULTADO, resultado, codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='cache')
+            return
+
+        # Los textos grandes se reparten entre todos los workers
+        partes = self.fragmentar_tarea(tarea)
+        if partes is not None:
+            await self.procesar_fragmentada(writer, tarea, partes, aceptada, origen, codec)
+            return
+
+        # Una copia de una tarea en curso también ocupa una conexión: cuenta
+        # para la admisión como cualquier otra
+        rechazo = self.admitir(origen, 1)
+        if rechazo is not None:
+            await escribir_mensaje(writer, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='rechazado')
+            return
+
+        try:
+            # La misma tarea ya está en cola o en un worker: se espera ese resultado
+            clave = self.clave_en_curso(tarea)
+            limite = self.limite_espera(tarea)
+            original = self.unirse_en_curso(clave, tarea)
+            if original is not None:
+                resultado = await original.esperar(max(0, limite - time.monotonic()))
+                resultado = self.respuesta_coalescida(tarea, resultado, limite)
+                if resultado is not None:
+                    await escribir_mensaje(writer, RESULTADO, resultado, codec)
+                    self.metricas.contar('tareas_respondidas', operacion=operacion,
+                                         estado=resultado.get('estado', 'desconocido'))
+                    return
+
+            # Registrar la espera antes de encolar para no perder el resultado
+            espera = self.registrar_espera(tarea_id)
+            espera.marcas['aceptada'] = aceptada
+            self.abrir_en_curso(clave, espera, tarea)
+
+            await self.esperar_diario(self.anotar_aceptadas([tarea]))
+            espera.marcas['encolada'] = time.monotonic()
+            self.encolar(tarea)
+
+            resultado = await espera.esperar(max(0, limite - time.monotonic()))
+
+            if resultado is not None:
+                self.guardar_en_cache(tarea, resultado)
+                await escribir_mensaje(writer, RESULTADO, resultado, codec)
+                log.debug("Resultado enviado al cliente", extra={'tarea': tarea_id})
+            else:
+                resultado = self.respuesta_sin_resultado(tarea)
+                await escribir_mensaje(writer, RESULTADO, resultado, codec)
+                log.warning("Timeout - no procesada", extra={'tarea': tarea_id})
+            self.medir_respuesta(operacion, espera, resultado.get('estado', 'desconocido'))
+
+        finally:
+            self.descartar_espera(tarea_id)
+            self.admision.liberar(origen, 1)
+
+    async def procesar_ticket_cliente(self, writer, tarea, origen=None, codec=CODEC_JSON):
+        """Encola una tarea del cliente y le responde enseguida con un ticket;
+        el resultado queda en el almacén y la conexión sigue libre"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+
+        resultado = self.buscar_en_cache(tarea)
+        if resultado is not None:
+            tarea['ticket'] = self.almacen.abrir(tarea_id)
+            self.almacen.guardar(resultado)
+            await escribir_mensaje(writer, RESULTADO, self.respuesta_ticket(tarea), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='cache')
+            return
+
+        rechazo = self.admitir(origen, 1)
+        if rechazo is not None:
+            await escribir_mensaje(writer, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion, estado='rechazado')
+            return
+
+        espera = self.registrar_ticket(tarea, origen)
+        espera.marcas['aceptada'] = aceptada
+        await self.esperar_diario(self.anotar_aceptadas([tarea]))
+        espera.marcas['encolada'] = time.monotonic()
+        self.encolar(tarea)
+        await escribir_mensaje(writer, RESULTADO, self.respuesta_ticket(tarea), codec)
+
+    def avisos_en_loop(self):
+        """(cola, avisar): avisar(resultado) se puede llamar desde cualquier
+        hilo y deja el resultado en la cola del loop"""
+        avisos = asyncio.Queue()
+
+        def avisar(resultado):
+            self.loop.call_soon_threadsafe(avisos.put_nowait, resultado)
+        return avisos, avisar
+
+    async def consultar_tickets(self, consulta):
+        """Resultados de los tickets pedidos, en el mismo orden. Con 'espera',
+        aguarda hasta esos segundos a que se resuelvan los pendientes"""
+        tickets, espera = self.leer_consulta(consulta)
+        recibidos = {}
+        if espera > 0:
+            avisos, avisar = self.avisos_en_loop()
+            self.almacen.suscribir(tickets, avisar)
+            limite = time.monotonic() + espera
+            try:
+                for _ in tickets:
+                    resultado = await asyncio.wait_for(avisos.get(),
+                                                       max(0, limite - time.monotonic()))
+                    recibidos[resultado['ticket']] = resultado
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.almacen.desuscribir(tickets, avisar)
+        return {'resultados': [recibidos.get(ticket) or self.almacen.obtener(ticket)
+                               for ticket in tickets]}
+
+    async def atender_suscripcion(self, reader, writer, suscripcion, codec=CODEC_JSON):
+        """Envía cada resultado de los tickets suscritos apenas llega; el
+        cliente puede sumar tickets con más mensajes SUSCRIPCION"""
+        avisos, avisar = self.avisos_en_loop()
+        suscritos = []
+
+        def agregar(mensaje):
+            tickets, _ = self.leer_consulta(mensaje)
+            suscritos.extend(tickets)
+            self.almacen.suscribir(tickets, avisar)
+
+        async def leer():
+            try:
+                while True:
+                    mensaje = await leer_mensaje(reader)
+                    if mensaje is None:
+                        break
+                    tipo, cuerpo = mensaje
+                    if tipo != SUSCRIPCION:
+                        raise ErrorProtocolo(f"Se esperaba una suscripción: tipo {tipo}")
+                    agregar(cuerpo)
+            except (OSError, ErrorProtocolo) as e:
+                log_clientes.error("En suscripción: %s", e)
+            finally:
+                avisos.put_nowait(None)
+
+        agregar(suscripcion)
+        lectura = asyncio.create_task(leer())
+        try:
+            while True:
+                resultado = await avisos.get()
+                if resultado is None:
+                    break
+                await escribir_mensaje(writer, RESULTADO, resultado, codec)
+        finally:
+            lectura.cancel()
+            self.almacen.desuscribir(suscritos, avisar)
+
+    async def procesar_fragmentada(self, writer, tarea, partes, aceptada, origen=None,
+                                   codec=CODEC_JSON):
+        """Encola los fragmentos de una tarea y responde con los resultados combinados"""
+        rechazo = self.admitir(origen, len(partes))
+        if rechazo is not None:
+            await escribir_mensaje(writer, RESULTADO, dict(rechazo, id=tarea['id']), codec)
+            self.metricas.contar('tareas_respondidas', operacion=tarea['operacion'],
+                                 estado='rechazado')
+            return
+
+        esperas = [self.registrar_espera(parte['id']) for parte in partes]
+
+        try:
+            await self.esperar_diario(self.anotar_aceptadas(partes))
+            for parte, espera in zip(partes, esperas):
+                espera.marcas.update(aceptada=aceptada, encolada=time.monotonic())
+                self.encolar(parte)
+
+            limite = self.limite_espera(tarea)
+            respuestas = [await espera.esperar(max(0, limite - time.monotonic()))
+                          for espera in esperas]
+
+            resultado = self.combinar_fragmentos(tarea, respuestas)
+            if resultado['estado'] == 'completado':
+                self.guardar_en_cache(tarea, resultado)
+            await escribir_mensaje(writer, RESULTADO, resultado, codec)
+            log.debug("Resultado de %d fragmentos enviado al cliente", len(partes),
+                      extra={'tarea': tarea['id']})
+
+            self.metricas.contar('tareas_fragmentadas', operacion=tarea['operacion'],
+                                 estado=resultado['estado'])
+            for espera, respuesta in zip(esperas, respuestas):
+                self.medir_respuesta('fragmento', espera,
+                                     respuesta.get('estado', 'desconocido')
+                                     if respuesta is not None else 'timeout')
+
+        finally:
+            for parte in partes:
+                self.descartar_espera(parte['id'])
+            self.admision.liberar(origen, len(partes))
+
+    async def procesar_lote_cliente(self, writer, lote, origen=None, codec=CODEC_JSON):
+        """Encola los sub-lotes de un lote y responde todo junto o en flujo"""
+        aceptada = time.monotonic()
+        cantidad = len(lote.get('tareas', []))
+        rechazo = self.admitir(origen, cantidad)
+        if rechazo is not None:
+            await escribir_mensaje(writer, RESULTADO_LOTE, self.rechazo_lote(rechazo, cantidad),
+                                   codec)
+            self.metricas.contar('tareas_respondidas', operacion='lote', estado='rechazado')
+            return
+
+        flujo = lote.get('flujo', False)
+        partes = self.dividir_lote(lote)
+        esperas = [self.registrar_espera(parte['id']) for parte in partes]
+
+        try:
+            await self.esperar_diario(self.anotar_aceptadas(partes))
+            for parte, espera in zip(partes, esperas):
+                espera.marcas.update(aceptada=aceptada, encolada=time.monotonic())
+                self.encolar(parte)
+
+            # Un único plazo para todo el lote (las partes comparten el vencimiento)
+            limite = self.limite_espera(partes[0]) if partes else time.monotonic()
+            resultados = []
+            estados = []
+
+            for parte, espera in zip(partes, esperas):
+                respuesta = await espera.esperar(max(0, limite - time.monotonic()))
+                parciales = self.resultados_parte(parte, respuesta)
+                estados.append('completado' if respuesta is not None else 'timeout')
+
+                if flujo:
+                    await escribir_mensaje(writer, RESULTADO_LOTE, {
+                        'desde': parte['desde'], 'resultados': parciales, 'fin': False
+                    }, codec)
+                    self.medir_respuesta('lote', espera, estados[-1])
+                else:
+                    resultados.extend(parciales)
+
+            await escribir_mensaje(writer, RESULTADO_LOTE, {
+                'desde': 0, 'resultados': resultados, 'fin': True
+            }, codec)
+            log_lotes.debug("%d resultados enviados al cliente", cantidad)
+            if not flujo:
+                for espera, estado in zip(esperas, estados):
+                    self.medir_respuesta('lote', espera, estado)
+
+        finally:
+            for parte in partes:
+                self.descartar_espera(parte['id'])
+            self.admision.liberar(origen, cantidad)
+
+    async def procesar_flujo_cliente(self, reader, writer, tarea, origen=None,
+                                     codec=CODEC_JSON):
+        """Tarea con el texto o el resultado en flujo: reenvía cada parte del
+        texto al worker apenas llega y cada parte del resultado al cliente"""
+        aceptada = time.monotonic()
+        tarea_id = self.preparar_tarea(tarea)
+        operacion = self.etiqueta_operacion(tarea)
+
+        rechazo = self.error_flujo(tarea) or self.admitir(origen, 1)
+        if rechazo is not None:
+            if tarea.get('entrada_flujo'):
+                while not self.leer_parte(await leer_mensaje(reader)).get('fin'):
+                    pass
+            await escribir_mensaje(writer, RESULTADO, dict(rechazo, id=tarea_id), codec)
+            self.metricas.contar('tareas_respondidas', operacion=operacion,
+                                 estado=rechazo['estado'])
+            return
+
+        espera = self.registrar_espera(tarea_id, flujo=True)
+        espera.marcas['aceptada'] = aceptada
+        subida = None
+
+        try:
+            await self.esperar_diario(self.anotar_aceptadas([tarea]))
+            espera.marcas['encolada'] = time.monotonic()
+            self.encolar(tarea)
+            limite = self.limite_espera(tarea)
+
+            # El texto sube en otra corrutina mientras esta baja el resultado
+            if tarea.get('entrada_flujo'):
+                subida = asyncio.create_task(
+                    self.reenviar_entrada(reader, writer, tarea_id, espera, limite))
+
+            resultado = await self.responder_en_flujo(writer, espera, limite, codec)
+            if subida is not None:
+                await subida
+            if resultado is None:
+                resultado = self.respuesta_sin_resultado(tarea)
+                log.warning("Timeout - no procesada", extra={'tarea': tarea_id})
+            await escribir_mensaje(writer, RESULTADO, resultado, codec)
+            self.medir_respuesta(operacion, espera, resultado.get('estado', 'desconocido'))
+
+        finally:
+            espera.cerrar()
+            if subida is not None and not subida.done():
+                subida.cancel()
+            self.descartar_espera(tarea_id)
+            self.admision.liberar(origen, 1)
+
+    async def reenviar_entrada(self, reader, writer, tarea_id, espera, limite):
+        """Reenvía al worker cada parte del texto que manda el cliente apenas
+        llega. Si la tarea termina antes (error, plazo), descarta el resto"""
+        reenviando = True
+        fin = False
+        try:
+            while not fin:
+                parte = self.leer_parte(await leer_mensaje(reader))
+                fin = bool(parte.get('fin'))
+                conexion = await espera.reservar(limite) if reenviando else None
+                if conexion is None:
+                    # Ya no se reenvía: el worker deja de esperar el resto
+                    reenviando = False
+                    espera.cancelar_entrada(tarea_id)
+                    continue
+                conexion.salida.put_nowait(ParteFlujo(
+                    {'id': tarea_id, 'texto': parte.get('texto', ''), 'fin': fin}, espera))
+
+        except (OSError, ErrorProtocolo) as e:
+            log_clientes.error("Recibiendo el texto: %s", e, extra={'tarea': tarea_id})
+            espera.cerrar()
+            writer.transport.abort()
+
+        finally:
+            if reenviando and not fin:
+                espera.cancelar_entrada(tarea_id)
+
+    async def responder_en_flujo(self, writer, espera, limite, codec):
+        """Envía al cliente cada parte del resultado apenas llega del worker.
+        Retorna la respuesta final, o None si venció el plazo"""
+        while True:
+            elemento = await espera.siguiente(max(0, limite - time.monotonic()))
+            if not isinstance(elemento, str):
+                return elemento
+            await escribir_mensaje(writer, FRAGMENTO, {'parte': elemento}, codec)
+
+    async def manejar_worker(self, reader, writer):
+        """Maneja la conexión de un worker que procesa tareas"""
+        addr = writer.get_extra_info('peername')
+        log_workers.info("Conectado desde %s", addr)
+
+        conexion = None
+        emisor = None
+        try:
+            # El worker anuncia cuántas tareas puede tener en vuelo y qué operaciones sabe
+            nombre, capacidad, declaradas, codec, par = leer_hola(await leer_mensaje(reader),
+                                                                 addr)
+            conexion = ConexionWorker(addr, nombre, capacidad, declaradas,
+                                      canal=writer, salida=asyncio.Queue(), codec=codec,
+                                      par=par)
+            self.registrar_operaciones_worker(nombre, declaradas)
+            await escribir_mensaje(writer, HOLA, self.saludo_servidor(codec))
+            log_workers.info("%s (%s) con capacidad %d, codec %s",
+                             nombre, addr, capacidad, NOMBRES_CODEC[codec])
+
+            # Una tarea envía lo que asigna el despachador; esta corrutina lee resultados
+            emisor = asyncio.create_task(self.enviar_a_worker(writer, conexion))
+            self.registro.agregar(conexion)
+            self.hay_creditos.set()
+
+            while True:
+                mensaje = await leer_mensaje(reader)
+                if mensaje is None:
+                    break
+
+                # Cualquier mensaje cuenta como señal de vida
+                self.registro.latido(conexion)
+                tipo, resultado = mensaje
+                if tipo == LATIDO:
+                    if self.recibir_latido(conexion, resultado):
+                        self.hay_creditos.set()
+                    continue
+                if tipo == FRAGMENTO:
+                    # Con la ventana del cliente llena se deja de leer del worker
+                    espera = self.espera_en_flujo(resultado.get('id'))
+                    if espera is not None:
+                        await espera.agregar(resultado.get('parte', ''))
+                    continue
+                if tipo not in (RESULTADO, RESULTADO_LOTE):
+                    raise ErrorProtocolo(f"Tipo de mensaje inesperado: {tipo}")
+                tarea_id = resultado.get('id')
+
+                # Los resultados pueden llegar en cualquier orden
+                if self.recibir_resultado(conexion, resultado):
+                    self.hay_creditos.set()
+                log.debug("Resultado recibido de worker %s", addr, extra={'tarea': tarea_id})
+
+        except Exception as e:
+            log.error("Worker %s: %s", addr, e)
+
+        finally:
+            if emisor is not None:
+                emisor.cancel()
+            if conexion is not None:
+                self.registro.quitar(conexion)
+                self.recuperar_tareas(conexion)
+            writer.close()
+            log_workers.info("%s desconectado", addr)
+
+    async def enviar_a_worker(self, writer, conexion):
+        """Envía a un worker las tareas que le asignó el despachador"""
+        try:
+            while True:
+                tarea = await conexion.salida.get()
+                if isinstance(tarea, ParteFlujo):
+                    try:
+                        await escribir_mensaje(writer, FRAGMENTO, tarea.mensaje, conexion.codec)
+                    finally:
+                        tarea.enviada()
+                    continue
+                try:
+                    await escribir_mensaje(writer, self.tipo_mensaje(tarea),
+                                           self.mensaje_para(conexion, tarea), conexion.codec)
+                    if tarea.get('entrada_flujo') and not self.abrir_entrada(tarea, conexion):
+                        await escribir_mensaje(writer, FRAGMENTO, cancelacion(tarea['id']).mensaje,
+                                               conexion.codec)
+                except ErrorProtocolo as e:
+                    if self.descartar_no_codificable(conexion, tarea, e):
+                        self.hay_creditos.set()
+                    continue
+                log.debug("Enviada a worker %s (%d/%d en vuelo)", conexion.nombre,
+                          len(conexion.en_vuelo), conexion.capacidad,
+                          extra={'tarea': tarea['id']})
+        except ConnectionError as e:
+            log.error("Enviando tareas a %s: %s", conexion.addr, e)
+
+    async def despachar(self):
+        """Asigna cada tarea del planificador al worker menos cargado"""
+        retenida = None
+        while True:
+            # Sacar una tarea solo cuando algún worker puede recibirla
+            if not self.registro.hay_libres(locales=retenida is not None):
+                self.hay_creditos.clear()
+                await self.hay_creditos.wait()
+                continue
+
+            tarea = retenida or await self.siguiente_tarea()
+            conexion = self.asignar_tarea(tarea, devolver=False)
+            retenida = self.retener(tarea, conexion)
+            if conexion is not None:
+                conexion.salida.put_nowait(tarea)
+
+    async def vigilar_workers(self):
+        """Revisa periódicamente los latidos de los workers"""
+        while True:
+            await asyncio.sleep(self.intervalo_latido)
+            self.expulsar_inactivos()
+            self.reencolar_leases_vencidos()
+
+    async def vigilar_rezagadas(self):
+        """Revisa con frecuencia las tareas en vuelo que tardan más de lo normal"""
+        while True:
+            await asyncio.sleep(INTERVALO_REZAGADAS)
+            self.duplicar_rezagadas()
+
+    async def vigilar_tickets(self):
+        """Vence los tickets sin resultado y los resultados viejos"""
+        while True:
+            await asyncio.sleep(INTERVALO_TICKETS)
+            self.vencer_tickets()
+
+    async def atender_metricas(self, reader, writer):
+        """Responde una consulta HTTP de métricas (p. ej. de Prometheus)"""
+        try:
+            peticion = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            writer.write(respuesta_http(peticion, self.texto_metricas))
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as e:
+            log.error("Atendiendo métricas: %s", e)
+        finally:
+            writer.close()
+
+    def cortar_conexion(self, conexion):
+        """Aborta el transporte de un worker para que su lector termine"""
+        conexion.canal.transport.abort()
+
+    async def servir(self):
+        """Abre ambos puertos en el event loop actual y atiende para siempre"""
+        self.loop = asyncio.get_running_loop()
+        self.hay_tareas = asyncio.Event()
+        self.hay_creditos = asyncio.Event()
+        self.recuperar_diario()
+        self.iniciar_enlaces()
+
+        servidor_clientes = await asyncio.start_server(
+            self.manejar_cliente, self.host, self.puerto_clientes,
+            backlog=self.backlog, reuse_address=True)
+        log.info("Escuchando clientes en puerto %s", self.puerto_clientes)
+
+        servidor_workers = await asyncio.start_server(
+            self.manejar_worker, self.host, self.puerto_workers,
+            backlog=self.backlog, reuse_address=True)
+        log.info("Escuchando workers en puerto %s", self.puerto_workers)
+
+        tareas = [servidor_clientes.serve_forever(), servidor_workers.serve_forever(),
+                  self.despachar(), self.vigilar_workers(), self.vigilar_rezagadas(),
+                  self.vigilar_tickets()]
+        if self.puerto_metricas:
+            servidor_metricas = await asyncio.start_server(
+                self.atender_metricas, self.host, self.puerto_metricas, reuse_address=True)
+            log.info("Métricas en http://%s:%s/metrics", self.host, self.puerto_metricas)
+            tareas.append(servidor_metricas.serve_forever())
+
+        log.info("Listo para recibir conexiones (motor asyncio)")
+        log.info("Presiona Ctrl+C para detener")
+
+        async with servidor_clientes, servidor_workers:
+            await asyncio.gather(*tareas)
+
+    def iniciar(self):
+        """Inicia el servidor"""
+        log.info("Iniciando...")
+
+        try:
+            asyncio.run(self.servir())
+        except KeyboardInterrupt:
+            log.info("Deteniendo...")
+            if self.diario is not None:
+                self.diario.cerrar()
+
+
+if __name__ == '__main__':
+    servidor = ServidorTareasAsync()
+    servidor.iniciar()
@@ -4,11 +4,12 @@ Este script ejecuta pruebas de ejemplo sin necesidad de interacción
 """
 
 import socket
-import json
 import time
 
-def enviar_tarea(operacion, datos, host='localhost', puerto=5000):
-    """Envía una tarea y retorna el resultado"""
+from protocolo import TAREA, LectorMensajes, enviar_mensaje
+
+def enviar_tarea(operacion, datos, host='localhost', puerto=5000, **opciones):
+    """Envía una tarea y retorna el resultado (opciones: prioridad, plazo)"""
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(5)
@@ -16,12 +17,15 @@ def enviar_tarea(operacion, datos, host='localhost', puerto=5000):
         
         tarea = {
             'operacion': operacion,
-            'datos': datos
+            'datos': datos,
+            **opciones
         }
         
-        sock.sendall(json.dumps(tarea).encode('utf-8'))
-        data = sock.recv(4096).decode('utf-8')
-        resultado = json.loads(data)
+        enviar_mensaje(sock, TAREA, tarea)
+        mensaje = LectorMensajes(sock).recibir()
+        if mensaje is None:
+            raise ConnectionError("El servidor cerró la conexión sin responder")
+        _, resultado = mensaje
         
         sock.close()
         return resultado
@@ -110,6 +114,25 @@ def test_operaciones_texto():
         
         time.sleep(0.2)
 
+def test_mensajes_grandes():
+    """Prueba tareas y resultados mayores a un segmento TCP"""
+    print("\n" + "="*60)
+    print("TEST 3b: Mensajes Grandes")
+    print("="*60)
+    
+    for tamano in (4096, 100_000, 1_000_000):
+        texto = ('abc ' * (tamano // 4 + 1))[:tamano]
+        resultado = enviar_tarea('inverso_texto', {'texto': texto})
+        
+        if resultado.get('estado') == 'completado':
+            obtenido = resultado.get('resultado')
+            status = "✓ PASS" if obtenido == texto[::-1] else "✗ FAIL"
+            print(f"{status} | inverso_texto de {tamano} bytes")
+        else:
+            print(f"✗ ERROR | inverso_texto de {tamano} bytes - {resultado.get('error', 'desconocido')}")
+        
+        time.sleep(0.2)
+
 def test_manejo_errores():
     """Prueba el manejo de errores"""
     print("\n" + "="*60)
@@ -134,6 +157,19 @@ def test_manejo_errores():
             print(f"✗ FAIL | {operacion} - Debería haber generado error")
         
         time.sleep(0.2)
+    
+    # Sin operación, o con una que no es texto: las estadísticas siguen respondiendo
+    from cliente import Cliente
+    enviar_tarea(None, {'a': 1})
+    enviar_tarea(['no', 'es', 'texto'], {'a': 1})
+    estadisticas = Cliente().estadisticas() or {}
+    etiquetas = set()
+    for por_operacion in estadisticas.get('etapas', {}).values():
+        etiquetas.update(por_operacion)
+    ok = 'desconocida' in etiquetas and all(isinstance(e, str) for e in etiquetas)
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Estadísticas tras tareas sin operación válida: "
+          f"{len(etiquetas)} operaciones medidas")
 
 def test_carga_paralela():
     """Prueba envío de múltiples tareas en paralelo"""
@@ -184,6 +220,664 @@ def test_carga_paralela():
         for worker, count in workers.items():
             print(f"  - {worker}: {count} tareas")
 
+def test_lote():
+    """Prueba el envío de muchas tareas en un solo mensaje"""
+    print("\n" + "="*60)
+    print("TEST 6: Lote de 1000 tareas")
+    print("="*60)
+    
+    from cliente import Cliente
+    
+    tareas = [('suma', {'a': i, 'b': i}) for i in range(1000)]
+    
+    inicio = time.time()
+    resultados = Cliente().enviar_lote(tareas) or []
+    tiempo_total = time.time() - inicio
+    
+    correctos = sum(1 for i, r in enumerate(resultados)
+                    if r and r.get('resultado') == 2 * i)
+    status = "✓ PASS" if correctos == len(tareas) else "✗ FAIL"
+    print(f"{status} | {correctos}/{len(tareas)} resultados correctos y en orden")
+    print(f"✓ Tiempo total: {tiempo_total:.2f} segundos")
+
+def test_cache():
+    """Prueba que las operaciones deterministas repetidas salen del cache"""
+    print("\n" + "="*60)
+    print("TEST 7: Cache de Resultados")
+    print("="*60)
+    
+    from cliente import Cliente
+    
+    datos = {'n': 25}
+    primero = enviar_tarea('fibonacci', datos)
+    
+    inicio = time.time()
+    segundo = enviar_tarea('fibonacci', dict(reversed(list(datos.items()))))
+    tiempo = time.time() - inicio
+    
+    ok = segundo.get('cache') is True and segundo.get('resultado') == primero.get('resultado')
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | fibonacci({datos}) repetido respondido desde cache en {tiempo*1000:.1f} ms")
+    
+    no_cacheable = enviar_tarea('suma', {'a': 1, 'b': 1})
+    status = "✓ PASS" if not no_cacheable.get('cache') else "✗ FAIL"
+    print(f"{status} | suma no se cachea")
+    
+    estadisticas = Cliente().estadisticas() or {}
+    print(f"✓ Estadísticas de cache: {estadisticas.get('cache')}")
+
+def test_prioridad_y_plazo():
+    """Prueba que una tarea de prioridad alta se adelanta a una cola saturada
+    y que una tarea con plazo corto se descarta en lugar de procesarse tarde"""
+    print("\n" + "="*60)
+    print("TEST 8: Prioridad y Plazo")
+    print("="*60)
+    
+    import threading
+    from cliente import Cliente
+    
+    estadisticas = Cliente().estadisticas() or {}
+    # Suficientes tareas lentas para dos tandas con todos los workers ocupados
+    cantidad = 2 * 4 * max(estadisticas.get('workers', 1), 1)
+    
+    hilos = [threading.Thread(target=enviar_tarea, args=('sleep', {'segundos': 1}))
+             for _ in range(cantidad)]
+    for hilo in hilos:
+        hilo.start()
+    time.sleep(0.3)
+    
+    inicio = time.time()
+    urgente = enviar_tarea('suma', {'a': 1, 'b': 1}, prioridad='alta')
+    tiempo = time.time() - inicio
+    ok = urgente.get('resultado') == 2 and tiempo < 1.5
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | suma 'alta' con {cantidad} sleeps en cola: {tiempo:.2f}s")
+    
+    inicio = time.time()
+    vencida = enviar_tarea('suma', {'a': 2, 'b': 2}, prioridad='baja', plazo=0.3)
+    tiempo = time.time() - inicio
+    ok = vencida.get('estado') == 'vencida' and tiempo < 1
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | suma 'baja' con plazo 0.3s detrás de la cola: "
+          f"{vencida.get('estado')} en {tiempo:.2f}s")
+    
+    for hilo in hilos:
+        hilo.join()
+    
+    estadisticas = Cliente().estadisticas() or {}
+    print(f"✓ Estadísticas de cola: {estadisticas.get('cola')}")
+
+def test_latidos():
+    """Prueba que un worker que deja de dar señales se da de baja solo"""
+    print("\n" + "="*60)
+    print("TEST 9: Registro de Workers y Latidos")
+    print("="*60)
+    
+    from cliente import Cliente
+    from protocolo import HOLA
+    
+    antes = (Cliente().estadisticas() or {}).get('workers', 0)
+    
+    # Worker falso: saluda y después no envía nada (ni latidos ni resultados)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(('localhost', 5001))
+    enviar_mensaje(sock, HOLA, {'nombre': 'Mudo', 'capacidad': 1, 'operaciones': {}})
+    LectorMensajes(sock).recibir()
+    time.sleep(0.2)
+    
+    registrado = (Cliente().estadisticas() or {}).get('workers', 0) == antes + 1
+    status = "✓ PASS" if registrado else "✗ FAIL"
+    print(f"{status} | worker silencioso registrado ({antes + 1} conectados)")
+    
+    inicio = time.time()
+    expulsado = False
+    while time.time() - inicio < 20:
+        estadisticas = Cliente().estadisticas() or {}
+        if estadisticas.get('workers') == antes:
+            expulsado = True
+            break
+        time.sleep(0.5)
+    sock.close()
+    
+    status = "✓ PASS" if expulsado else "✗ FAIL"
+    print(f"{status} | worker sin latidos dado de baja en {time.time() - inicio:.1f}s")
+    for worker in estadisticas.get('registro', {}).get('conectados', []):
+        print(f"  - {worker['nombre']}: {worker['completadas']} completadas, "
+              f"latencia {worker['latencia'] or 0:.4f}s")
+
+def test_reencolado():
+    """Prueba que una tarea en vuelo en un worker que muere se reencola en otro"""
+    print("\n" + "="*60)
+    print("TEST 10: Reencolado de Tareas de un Worker Caído")
+    print("="*60)
+    
+    import threading
+    import operaciones
+    from protocolo import HOLA
+    
+    # Worker falso sin tareas completadas: es el menos cargado y recibe la próxima
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(('localhost', 5001))
+    enviar_mensaje(sock, HOLA, {'nombre': 'Fragil', 'capacidad': 1,
+                                'operaciones': operaciones.describir()})
+    lector = LectorMensajes(sock)
+    lector.recibir()
+    time.sleep(0.2)
+    
+    resultados = []
+    inicio = time.time()
+    hilo = threading.Thread(
+        target=lambda: resultados.append(enviar_tarea('suma', {'a': 20, 'b': 22})))
+    hilo.start()
+    
+    # Recibe la tarea y se desconecta sin responder
+    sock.settimeout(5)
+    try:
+        recibida = lector.recibir() is not None
+    except OSError:
+        recibida = False
+    sock.close()
+    hilo.join()
+    tiempo = time.time() - inicio
+    
+    resultado = resultados[0] if resultados else {}
+    ok = recibida and resultado.get('resultado') == 42 and tiempo < 5
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | tarea del worker caído completada por "
+          f"{resultado.get('worker', '?')} en {tiempo:.2f}s")
+
+def test_duplicado_rezagadas():
+    """Prueba que una tarea idempotente trabada en un worker se duplica en otro"""
+    print("\n" + "="*60)
+    print("TEST 11: Duplicado de Tareas Rezagadas")
+    print("="*60)
+    
+    import operaciones
+    from cliente import Cliente
+    from protocolo import HOLA
+    
+    # Muestras suficientes para que el servidor conozca la latencia normal
+    for i in range(30):
+        enviar_tarea('multiplicacion', {'a': i, 'b': 3})
+    
+    # Worker falso que acepta la tarea y nunca responde
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(('localhost', 5001))
+    enviar_mensaje(sock, HOLA, {'nombre': 'Lento', 'capacidad': 1,
+                                'operaciones': operaciones.describir()})
+    LectorMensajes(sock).recibir()
+    time.sleep(0.2)
+    
+    inicio = time.time()
+    resultado = enviar_tarea('multiplicacion', {'a': 6, 'b': 7})
+    tiempo = time.time() - inicio
+    sock.close()
+    
+    duplicadas = (Cliente().estadisticas() or {}).get('duplicadas', {})
+    ok = resultado.get('resultado') == 42 and tiempo < 1 and duplicadas.get('ganadoras')
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | multiplicacion rezagada respondida por "
+          f"{resultado.get('worker', '?')} en {tiempo:.2f}s ({duplicadas})")
+
+def test_admision():
+    """Prueba el rechazo inmediato cuando un cliente supera su límite de tareas"""
+    print("\n" + "="*60)
+    print("TEST 12: Control de Admisión")
+    print("="*60)
+    
+    import threading
+    from cliente import Cliente
+    
+    # Un lote más grande que el límite por cliente ocupa todo su cupo
+    lote = [('suma', {'a': i, 'b': 1}) for i in range(50000)]
+    hilo = threading.Thread(target=lambda: list(Cliente().enviar_lote_flujo(lote)))
+    hilo.start()
+    
+    # Esperar a que el servidor lo haya admitido
+    limite = time.time() + 5
+    while time.time() < limite:
+        admision = (Cliente().estadisticas() or {}).get('admision', {})
+        if admision.get('pendientes', 0) >= len(lote):
+            break
+        time.sleep(0.01)
+    
+    inicio = time.time()
+    rechazo = enviar_tarea('suma', {'a': 1, 'b': 1})
+    tiempo = time.time() - inicio
+    ok = rechazo.get('estado') == 'rechazado' and 'reintentar_en' in rechazo
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | rechazo en {tiempo*1000:.1f} ms "
+          f"(reintentar en {rechazo.get('reintentar_en')}s): {rechazo.get('error')}")
+    
+    # El cliente con backoff termina consiguiendo lugar
+    resultado = Cliente().enviar_tarea('suma', {'a': 2, 'b': 2}) or {}
+    hilo.join()
+    print(f"✓ Lote de {len(lote)} tareas terminado a los {time.time() - inicio:.2f}s")
+    status = "✓ PASS" if resultado.get('resultado') == 4 else "✗ FAIL"
+    print(f"{status} | Cliente con reintentos: {resultado.get('estado')}")
+    
+    estadisticas = Cliente().estadisticas() or {}
+    print(f"✓ Estadísticas de admisión: {estadisticas.get('admision')}")
+
+def test_codec_binario():
+    """Prueba el codec binario: enteros enormes y mismas respuestas que JSON"""
+    print("\n" + "="*60)
+    print("TEST 13: Codec binario")
+    print("="*60)
+    
+    import math
+    from cliente import Cliente
+    
+    # JSON no puede llevar enteros de más de 4300 dígitos; el binario sí
+    resultado = Cliente(codec='binario').enviar_tarea('factorial', {'n': 5000}) or {}
+    ok = resultado.get('resultado') == math.factorial(5000)
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | factorial(5000) por el codec binario: {resultado.get('estado')}")
+
+    # También como dato: la clave de cache y de tareas iguales no puede pasar por JSON
+    enorme = 10 ** 5000 + 1
+    respuestas = [Cliente(codec='binario').enviar_tarea('potencia',
+                                                        {'base': enorme, 'exponente': 1}) or {}
+                  for _ in range(2)]
+    ok = all(r.get('resultado') == enorme for r in respuestas)
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Entero de 5001 dígitos como dato: "
+          f"{[r.get('estado') for r in respuestas]} (cache: {respuestas[1].get('cache')})")
+
+    json_ = Cliente(codec='json').enviar_tarea('multiplicacion', {'a': -7, 'b': 2.5}) or {}
+    binario = Cliente(codec='binario').enviar_tarea('multiplicacion', {'a': -7, 'b': 2.5}) or {}
+    ok = json_.get('resultado') == binario.get('resultado') == -17.5
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Mismo resultado por JSON y binario: "
+          f"{json_.get('resultado')} / {binario.get('resultado')}")
+
+def test_cliente_concurrente():
+    """Prueba submit/map/as_completed con conexiones persistentes (hilos y asyncio)"""
+    print("\n" + "="*60)
+    print("TEST 14: Cliente Concurrente con Futuros")
+    print("="*60)
+    
+    import asyncio
+    from cliente import Cliente
+    from cliente_async import ClienteAsync
+    
+    n = 500
+    with Cliente(conexiones=8) as cliente:
+        inicio = time.time()
+        resultados = list(cliente.map('suma', [{'a': i, 'b': 1} for i in range(n)]))
+        tiempo = time.time() - inicio
+        ok = [r.get('resultado') for r in resultados] == [i + 1 for i in range(n)]
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | map de {n} tareas en {tiempo:.2f}s "
+              f"({cliente.pool.creadas} conexiones abiertas)")
+        
+        futuros = [cliente.submit('multiplicacion', {'a': i, 'b': 3}) for i in range(50)]
+        completados = sum(1 for f in cliente.as_completed(futuros)
+                          if f.result().get('estado') == 'completado')
+        status = "✓ PASS" if completados == 50 and cliente.pool.creadas <= 8 else "✗ FAIL"
+        print(f"{status} | as_completed: {completados}/50 completadas")
+    
+    async def probar_async():
+        async with ClienteAsync(conexiones=8) as cliente:
+            inicio = time.time()
+            resultados = await cliente.map('resta', [{'a': i, 'b': 1} for i in range(n)])
+            tiempo = time.time() - inicio
+            ok = [r.get('resultado') for r in resultados] == [i - 1 for i in range(n)]
+            status = "✓ PASS" if ok and cliente.creadas <= 8 else "✗ FAIL"
+            print(f"{status} | asyncio map de {n} tareas en {tiempo:.2f}s "
+                  f"({cliente.creadas} conexiones abiertas)")
+            
+            tareas = [cliente.submit('suma', {'a': i, 'b': i}) for i in range(20)]
+            completadas = 0
+            for proxima in cliente.as_completed(tareas):
+                completadas += (await proxima).get('estado') == 'completado'
+            status = "✓ PASS" if completadas == 20 else "✗ FAIL"
+            print(f"{status} | asyncio as_completed: {completadas}/20 completadas")
+    
+    asyncio.run(probar_async())
+
+def test_carga_lazo_abierto():
+    """Prueba el generador de carga: tasa lograda y percentiles de latencia"""
+    print("\n" + "="*60)
+    print("TEST 15: Carga en Lazo Abierto")
+    print("="*60)
+    
+    import asyncio
+    from bench_carga import ejecutar
+    
+    tasa = 200
+    resumen = asyncio.run(ejecutar(modo='poisson', tasa=tasa, duracion=2, calentamiento=0.5,
+                                   mezcla='suma=3,mayusculas=1'))
+    latencia = resumen['latencia']
+    ok = (resumen['completadas'] == resumen['enviadas'] > 0
+          and latencia['p50'] <= latencia['p99'] <= latencia['max'])
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | {resumen['completadas']}/{resumen['enviadas']} completadas | "
+          f"p50 {latencia['p50'] * 1e3:.1f} ms | p99 {latencia['p99'] * 1e3:.1f} ms")
+    
+    # Una tasa baja debe sostenerse sin que la latencia la frene
+    ok = resumen['tasa_lograda'] >= 0.8 * resumen['tasa_ofrecida']
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Ofrecida {resumen['tasa_ofrecida']:.0f}/s, "
+          f"lograda {resumen['tasa_lograda']:.0f}/s")
+
+def test_metricas():
+    """Prueba las etapas por tarea y el puerto de métricas de Prometheus"""
+    print("\n" + "="*60)
+    print("TEST 16: Métricas por Etapa")
+    print("="*60)
+    
+    import urllib.request
+    from cliente import Cliente
+    
+    with Cliente() as cliente:
+        list(cliente.map('resta', [{'a': i, 'b': 7} for i in range(50)]))
+        etapas = cliente.estadisticas().get('etapas', {})
+    
+    completas = all(etapas.get(etapa, {}).get('resta', {}).get('cantidad', 0) >= 50
+                    for etapa in ('admision', 'cola', 'worker', 'ejecucion', 'entrega', 'total'))
+    status = "✓ PASS" if completas else "✗ FAIL"
+    total = etapas.get('total', {}).get('resta', {})
+    print(f"{status} | Etapas medidas para 'resta': {sorted(etapas)} "
+          f"(p50 total {(total.get('p50') or 0) * 1e3:.2f} ms)")
+    
+    try:
+        with urllib.request.urlopen('http://localhost:5002/metrics', timeout=5) as respuesta:
+            texto = respuesta.read().decode()
+    except OSError as e:
+        texto = ''
+        print(f"      Error: {e}")
+    ok = ('tareas_etapa_segundos_count{etapa="cola",operacion="resta"}' in texto
+          and 'workers_conectados ' in texto)
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | /metrics en formato Prometheus ({len(texto.splitlines())} líneas)")
+
+def test_bitacora():
+    """Prueba que la bitácora no bloquea con una salida lenta y cuenta lo descartado"""
+    print("\n" + "="*60)
+    print("TEST 17: Bitácora Asíncrona con Muestreo")
+    print("="*60)
+    
+    import io
+    import logging
+    import bitacora
+    
+    class SalidaLenta(io.StringIO):
+        def write(self, texto):
+            time.sleep(0.001)
+            return super().write(texto)
+    
+    salida = SalidaLenta()
+    bitacora.configurar('DEBUG', muestreo=10, capacidad=100, salida=salida)
+    log = bitacora.obtener('prueba')
+    
+    inicio = time.time()
+    for tarea_id in range(5000):
+        log.debug("Recibida", extra={'tarea': tarea_id})
+    tiempo = time.time() - inicio
+    descartados = bitacora.descartados()
+    ok = tiempo < 0.5 and descartados > 0
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | 5000 mensajes en {tiempo * 1e3:.0f} ms con salida lenta "
+          f"({descartados} descartados)")
+    
+    # Con la cola ya vaciada, el siguiente mensaje lleva el aviso de descartes
+    time.sleep(0.5)
+    log.warning("Sin muestrear", extra={'tarea': 3})
+    time.sleep(0.5)
+    lineas = salida.getvalue().splitlines()
+    muestreadas = all(int(l.split()[1].rstrip(']')) % 10 == 0
+                      for l in lineas if l.startswith('[TAREA') and 'Recibida' in l)
+    ok = (muestreadas and '[TAREA 3] Sin muestrear' in lineas
+          and any('Se descartaron' in l for l in lineas))
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Muestreo 1/10, advertencias siempre y aviso de descartes "
+          f"({len(lineas)} líneas escritas)")
+    # La salida lenta era solo para la prueba
+    logging.getLogger().handlers.clear()
+
+def test_diario():
+    """Prueba que el diario recupera las tareas sin terminar tras una caída"""
+    print("\n" + "="*60)
+    print("TEST 18: Diario de Tareas y Recuperación")
+    print("="*60)
+    
+    import os
+    import shutil
+    import tempfile
+    from diario import Diario
+    
+    directorio = tempfile.mkdtemp(prefix='test-diario-')
+    try:
+        # Segmentos chicos para que compacte durante la prueba
+        diario = Diario(directorio, 'sincronica', tamano_segmento=4096)
+        diario.abrir()
+        for tarea_id in range(1, 101):
+            diario.aceptada({'operacion': 'suma', 'datos': {'a': tarea_id, 'b': 1},
+                             'id': tarea_id, 'vence': time.monotonic() + 60})
+            diario.despachada(tarea_id, 'W1')
+            if tarea_id % 2 == 0:
+                secuencia = diario.completada(tarea_id, 'completado')
+        diario.esperar(secuencia)
+        compactaciones = diario.estadisticas()['compactaciones']
+        diario.cerrar()
+        
+        # Caída a mitad de escritura: la última línea queda cortada
+        ultimo = sorted(os.listdir(directorio))[-1]
+        with open(os.path.join(directorio, ultimo), 'ab') as f:
+            f.write(b'{"e":"a","tarea":{"id":10')
+        
+        recuperado = Diario(directorio, 'sincronica')
+        tareas, ultimo_id = recuperado.abrir()
+        recuperado.cerrar()
+        ids = sorted(tarea['id'] for tarea in tareas)
+        ok = (ids == list(range(1, 101, 2)) and ultimo_id == 100
+              and all(tarea['intentos'] == 1 and tarea['vence'] > time.monotonic()
+                      for tarea in tareas))
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | {len(tareas)} tareas sin terminar recuperadas (esperadas 50), "
+              f"último ID {ultimo_id}")
+        
+        segmentos = os.listdir(directorio)
+        ok = compactaciones > 0 and len(segmentos) == 1
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | {compactaciones} compactaciones, {len(segmentos)} segmento en disco")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+def test_cluster():
+    """Prueba que un segundo nodo con workers ociosos le roba tareas al servidor"""
+    print("\n" + "="*60)
+    print("TEST 19: Cluster con Robo de Trabajo")
+    print("="*60)
+    
+    import threading
+    from cliente import Cliente
+    from servidor import ServidorTareas
+    from worker import Worker
+    
+    # Otro nodo en este proceso, con un worker propio y enlazado al servidor
+    nodo = ServidorTareas(puerto_clientes=5100, puerto_workers=5101, puerto_metricas=0,
+                          pares=[('localhost', 5001)])
+    threading.Thread(target=nodo.iniciar, daemon=True).start()
+    time.sleep(0.5)
+    worker = Worker(puerto=5101, nombre='Worker-Par', capacidad=4)
+    threading.Thread(target=worker.iniciar, daemon=True).start()
+    time.sleep(1)
+    
+    # Los clientes solo hablan con el servidor original
+    cliente = Cliente(conexiones=48)
+    inicio = time.time()
+    futuros = [cliente.submit('sleep', {'segundos': 0.3}) for _ in range(48)]
+    resultados = [futuro.result() for futuro in futuros]
+    tiempo = time.time() - inicio
+    cliente.cerrar()
+    
+    enlace = nodo.estadisticas()['cluster']['pares'][0]
+    completadas = sum(1 for r in resultados if r.get('estado') == 'completado')
+    en_par = sum(1 for r in resultados if r.get('worker') == 'Worker-Par')
+    ok = completadas == 48 and en_par > 0
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | 48 tareas en {tiempo:.2f}s: {en_par} ejecutadas por el otro nodo "
+          f"({enlace['recibidas']} prestadas), {completadas} completadas")
+
+def test_fragmentos():
+    """Prueba que los textos grandes repartidos en fragmentos dan el mismo resultado"""
+    print("\n" + "="*60)
+    print("TEST 20: Textos Grandes Repartidos en Fragmentos")
+    print("="*60)
+    
+    import random
+    import operaciones
+    
+    # Texto nuevo en cada corrida (no sale del cache), con espacios variados y acentos
+    palabras = ['ñandú', 'straße', 'año', 'Ωmega', 'tarea', str(random.random())]
+    separadores = [' ', '  ', '\n', '\t', '\u3000']
+    texto = ''.join(random.choice(palabras) + random.choice(separadores)
+                    for _ in range(400_000))
+    
+    for operacion in ('contar_palabras', 'mayusculas', 'inverso_texto'):
+        resultado = enviar_tarea(operacion, {'texto': texto})
+        esperado = operaciones.ejecutar(operacion, {'texto': texto})
+        
+        if resultado.get('estado') == 'completado':
+            fragmentos = resultado.get('fragmentos', 1)
+            ok = resultado.get('resultado') == esperado and fragmentos > 1
+            status = "✓ PASS" if ok else "✗ FAIL"
+            print(f"{status} | {operacion} de {len(texto)} caracteres en {fragmentos} fragmentos "
+                  f"({resultado.get('worker')})")
+        else:
+            print(f"✗ ERROR | {operacion} - {resultado.get('error', 'desconocido')}")
+
+def test_flujo():
+    """Prueba el texto y el resultado en flujo: nadie arma el cuerpo completo"""
+    print("\n" + "="*60)
+    print("TEST 21: Texto y Resultado en Flujo")
+    print("="*60)
+    
+    import math
+    import random
+    from cliente import Cliente
+    
+    partes = [f'parte {numero} ñandú {random.random()} ' * 5000 for numero in range(20)]
+    recibido = []
+    try:
+        resultado = Cliente().enviar_en_flujo('mayusculas', partes=iter(partes),
+                                              al_recibir=recibido.append)
+        ok = (resultado.get('estado') == 'completado'
+              and ''.join(recibido) == ''.join(partes).upper())
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | mayusculas de {sum(map(len, partes))} caracteres en "
+              f"{len(partes)} partes, {resultado.get('partes')} de vuelta")
+        
+        resultado = Cliente().enviar_en_flujo('contar_palabras', partes=iter(partes))
+        esperado = len(''.join(partes).split())
+        status = "✓ PASS" if resultado.get('resultado') == esperado else "✗ FAIL"
+        print(f"{status} | contar_palabras en flujo = {resultado.get('resultado')} "
+              f"(esperado {esperado})")
+        
+        resultado = Cliente().enviar_en_flujo('factorial', datos={'n': 5000})
+        ok = resultado.get('resultado') == math.factorial(5000) and resultado.get('partes', 0) >= 1
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | factorial(5000) en flujo ({resultado.get('partes')} partes)")
+        
+        # inverso_texto necesita el texto entero: se rechaza sin trabar la conexión
+        resultado = Cliente().enviar_en_flujo('inverso_texto', partes=iter(partes))
+        status = "✓ PASS" if resultado.get('estado') == 'error' else "✗ FAIL"
+        print(f"{status} | inverso_texto en flujo rechazado: {resultado.get('error')}")
+    except Exception as e:
+        print(f"✗ ERROR | {e}")
+
+def test_tickets():
+    """Prueba el envío con ticket: la conexión queda libre y el resultado se retira después"""
+    print("\n" + "="*60)
+    print("TEST 22: Envío con Ticket y Almacén de Resultados")
+    print("="*60)
+    
+    from cliente import Cliente
+    
+    cliente = Cliente(conexiones=1)
+    try:
+        # Por una sola conexión: cada envío vuelve sin esperar al worker
+        inicio = time.time()
+        respuestas = [cliente.enviar_con_ticket('sleep', {'segundos': 1}) for _ in range(4)]
+        respuestas.append(cliente.enviar_con_ticket('suma', {'a': 20, 'b': 22}))
+        envio = time.time() - inicio
+        tickets = [r.get('ticket') for r in respuestas]
+        ok = envio < 0.5 and all(r.get('estado') == 'aceptada' for r in respuestas)
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | 5 tareas aceptadas con ticket en {envio*1000:.0f} ms por una conexión")
+        
+        resultados = cliente.consultar(tickets, espera=10)
+        ok = (all(r.get('estado') == 'completado' for r in resultados)
+              and resultados[-1].get('resultado') == 42)
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | Consulta en bloque: {[r.get('estado') for r in resultados]}")
+        
+        # La suscripción recibe cada resultado apenas termina, en ese orden
+        lenta = cliente.enviar_con_ticket('sleep', {'segundos': 1})['ticket']
+        rapida = cliente.enviar_con_ticket('suma', {'a': 1, 'b': 1})['ticket']
+        with cliente.suscribir([lenta]) as suscripcion:
+            suscripcion.agregar([rapida, 'inventado'])
+            orden = [r.get('ticket') for r in suscripcion]
+        ok = orden.index(rapida) < orden.index(lenta) and 'inventado' in orden
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | Suscripción: resultados en orden de llegada {orden}")
+        
+        # El ticket no es el ID: con el ID de la tarea no se lee el resultado
+        respuesta = cliente.enviar_con_ticket('suma', {'a': 2, 'b': 3})
+        resultados = cliente.consultar([respuesta.get('id'), str(respuesta.get('id'))], espera=1)
+        ok = (respuesta.get('ticket') != respuesta.get('id')
+              and all(r.get('estado') == 'desconocido' for r in resultados))
+        status = "✓ PASS" if ok else "✗ FAIL"
+        print(f"{status} | Ticket al azar: el ID {respuesta.get('id')} no da acceso "
+              f"({[r.get('estado') for r in resultados]})")
+    except Exception as e:
+        print(f"✗ ERROR | {e}")
+    finally:
+        cliente.cerrar()
+
+def test_coalescencia():
+    """Prueba que las tareas puras iguales en curso se responden con un solo resultado"""
+    print("\n" + "="*60)
+    print("TEST 23: Tareas Iguales en Curso (coalescencia)")
+    print("="*60)
+    
+    import math
+    import random
+    from cliente import Cliente
+    
+    # Un n nuevo en cada corrida para que no salga del cache
+    n = 100_000 + random.randint(0, 10_000)
+    with Cliente(conexiones=8) as cliente:
+        antes = (cliente.estadisticas() or {}).get('coalescidas', 0)
+        inicio = time.time()
+        futuros = [cliente.submit('factorial', {'n': n}) for _ in range(8)]
+        resultados = [futuro.result() for futuro in futuros]
+        tiempo = time.time() - inicio
+        despues = (cliente.estadisticas() or {}).get('coalescidas', 0)
+    
+    unidas = sum(1 for r in resultados if r.get('coalescida'))
+    ok = (all(r.get('resultado') == math.factorial(n) for r in resultados)
+          and len({r.get('id') for r in resultados}) == 8
+          and unidas > 0 and despues - antes == unidas)
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | 8 factorial({n}) a la vez en {tiempo:.2f}s: {unidas} esperaron "
+          f"el resultado de otra igual")
+
+    # Una copia sin plazo no hereda el vencimiento de una original con plazo corto
+    n = 150_000 + random.randint(0, 10_000)
+    with Cliente(conexiones=2) as cliente:
+        apurada = cliente.submit('factorial', {'n': n}, plazo=0.15)
+        time.sleep(0.05)
+        sin_plazo = cliente.submit('factorial', {'n': n}).result()
+        apurada = apurada.result()
+    ok = (apurada.get('estado') == 'vencida' and sin_plazo.get('estado') == 'completado'
+          and not sin_plazo.get('coalescida'))
+    status = "✓ PASS" if ok else "✗ FAIL"
+    print(f"{status} | Plazo de 0.15s: {apurada.get('estado')}; la igual sin plazo: "
+          f"{sin_plazo.get('estado')}")
+
 def verificar_servidor():
     """Verifica si el servidor está en ejecución"""
     try:
@@ -218,8 +912,27 @@ def main():
         test_operaciones_matematicas()
         test_operaciones_numericas()
         test_operaciones_texto()
+        test_mensajes_grandes()
         test_manejo_errores()
         test_carga_paralela()
+        test_lote()
+        test_cache()
+        test_prioridad_y_plazo()
+        test_latidos()
+        test_reencolado()
+        test_duplicado_rezagadas()
+        test_admision()
+        test_codec_binario()
+        test_cliente_concurrente()
+        test_carga_lazo_abierto()
+        test_metricas()
+        test_bitacora()
+        test_diario()
+        test_cluster()
+        test_fragmentos()
+        test_flujo()
+        test_tickets()
+        test_coalescencia()
         
         print("\n" + "="*60)
         print("RESUMEN: Todos los tests completados")
@@ -3,100 +3,85 @@ Worker que procesa tareas
 Se conecta al servidor y procesa las tareas que recibe
 """
 
+import queue
 import socket
-import json
+import threading
 import time
-import math
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+import bitacora
+import operaciones
+from flujo import VENTANA_FLUJO, partir_resultado
+from numerico import es_primo, fibonacci
+from protocolo import (TAREA, RESULTADO, HOLA, LOTE, RESULTADO_LOTE, LATIDO, FRAGMENTO,
+                       CODEC_JSON, CODECS, LectorMensajes, enviar_mensaje, ErrorProtocolo)
+
+# Operaciones de CPU con costo estimado mayor a este umbral (segundos) van al
+# pool de procesos; las más baratas no compensan el costo de IPC
+UMBRAL_COSTO_PROCESO = 1e-3
 
 class Worker:
-    def __init__(self, host='localhost', puerto=5001, nombre=None):
+    def __init__(self, host='localhost', puerto=5001, nombre=None, capacidad=4,
+                 procesos=0, codec='binario'):
         self.host = host
         self.puerto = puerto
         self.nombre = nombre or f"Worker-{id(self)}"
+        # Los mensajes llevan el nombre del worker como etiqueta
+        self.log = bitacora.Etiquetado(bitacora.obtener('worker'), {'etiqueta': self.nombre})
         self.sock = None
+        self.lector = None
+        # Segundos entre latidos; lo indica el servidor en su saludo
+        self.intervalo_latido = None
+        # Codecs que se ofrecen en el saludo (en orden de preferencia) y el que
+        # elige el servidor para todos los mensajes de la conexión
+        self.codecs = ['binario', 'json'] if codec == 'binario' else ['json']
+        self.codec = CODEC_JSON
+        
+        # Cantidad de tareas que el servidor puede tener en vuelo con este worker
+        self.capacidad = capacidad
+        self.lock_envio = threading.Lock()
+        
+        # Partes del texto recibidas para cada tarea en flujo, aún sin procesar
+        self.entradas = {}
+        
+        # Con procesos > 0 las operaciones de CPU se reparten en un pool local
+        self.procesos = procesos
+        self.pool_procesos = None
+        if procesos > 0:
+            self.pool_procesos = ProcessPoolExecutor(max_workers=procesos)
+            # Al menos un hilo por proceso para mantener el pool ocupado
+            self.capacidad = max(capacidad, procesos)
         
-        print(f"[{self.nombre}] Inicializado")
+        self.log.info("Inicializado")
     
-    def procesar_tarea(self, tarea):
-        """Procesa una tarea y retorna el resultado"""
+    def usa_pool_procesos(self, operacion, datos):
+        """Indica si la operación conviene ejecutarla en el pool de procesos"""
+        if self.pool_procesos is None:
+            return False
+        op = operaciones.REGISTRO.get(operacion)
+        return (op is not None and op.tipo == 'cpu'
+                and op.costo_estimado(datos) >= UMBRAL_COSTO_PROCESO)
+    
+    def calcular(self, operacion, datos):
+        """Ejecuta una operación, en el pool de procesos si es de CPU y cara"""
+        if self.usa_pool_procesos(operacion, datos):
+            # Fuera del GIL: el pool reparte entre los núcleos disponibles
+            return self.pool_procesos.submit(operaciones.ejecutar, operacion, datos).result()
+        return operaciones.ejecutar(operacion, datos)
+    
+    def latencia_simulada(self, operacion):
+        """Segundos de retardo artificial configurados para la operación"""
+        op = operaciones.REGISTRO.get(operacion)
+        return op.latencia if op is not None else 0.0
+    
+    def armar_respuesta(self, tarea, calculo):
+        """Ejecuta calculo() y arma el dict de resultado o de error"""
         operacion = tarea.get('operacion')
-        datos = tarea.get('datos', {})
         tarea_id = tarea.get('id')
         
-        print(f"[{self.nombre}] Procesando tarea {tarea_id}: {operacion}")
-        
         try:
-            resultado = None
-            
-            if operacion == 'suma':
-                a = datos.get('a', 0)
-                b = datos.get('b', 0)
-                resultado = a + b
-            
-            elif operacion == 'resta':
-                a = datos.get('a', 0)
-                b = datos.get('b', 0)
-                resultado = a - b
-            
-            elif operacion == 'multiplicacion':
-                a = datos.get('a', 0)
-                b = datos.get('b', 0)
-                resultado = a * b
-            
-            elif operacion == 'division':
-                a = datos.get('a', 0)
-                b = datos.get('b', 1)
-                if b == 0:
-                    raise ValueError("División por cero")
-                resultado = a / b
-            
-            elif operacion == 'potencia':
-                base = datos.get('base', 0)
-                exponente = datos.get('exponente', 1)
-                resultado = base ** exponente
-            
-            elif operacion == 'raiz':
-                numero = datos.get('numero', 0)
-                if numero < 0:
-                    raise ValueError("No se puede calcular raíz de número negativo")
-                resultado = math.sqrt(numero)
-            
-            elif operacion == 'factorial':
-                n = datos.get('n', 0)
-                if n < 0:
-                    raise ValueError("Factorial no definido para negativos")
-                resultado = math.factorial(n)
-            
-            elif operacion == 'primo':
-                n = datos.get('n', 2)
-                resultado = self.es_primo(n)
-            
-            elif operacion == 'fibonacci':
-                n = datos.get('n', 0)
-                resultado = self.fibonacci(n)
-            
-            elif operacion == 'inverso_texto':
-                texto = datos.get('texto', '')
-                resultado = texto[::-1]
-            
-            elif operacion == 'mayusculas':
-                texto = datos.get('texto', '')
-                resultado = texto.upper()
-            
-            elif operacion == 'contar_palabras':
-                texto = datos.get('texto', '')
-                resultado = len(texto.split())
-            
-            elif operacion == 'sleep':
-                segundos = datos.get('segundos', 1)
-                time.sleep(segundos)
-                resultado = f"Dormido por {segundos} segundos"
-            
-            else:
-                raise ValueError(f"Operación desconocida: {operacion}")
-            
-            # Simular tiempo de procesamiento
-            time.sleep(0.1)
+            resultado = calculo()
             
             return {
                 'id': tarea_id,
@@ -115,70 +100,297 @@ class Worker:
                 'worker': self.nombre
             }
     
+    def procesar_tarea(self, tarea):
+        """Procesa una tarea y retorna el resultado"""
+        operacion = tarea.get('operacion')
+        datos = tarea.get('datos', {})
+        
+        self.log.debug("Procesando tarea %s: %s", tarea.get('id'), operacion,
+                       extra={'tarea': tarea.get('id')})
+        
+        inicio = time.perf_counter()
+        respuesta = self.armar_respuesta(tarea, lambda: self.calcular(operacion, datos))
+        
+        # Simular tiempo de procesamiento (por defecto ninguno)
+        latencia = self.latencia_simulada(operacion)
+        if latencia > 0 and respuesta['estado'] == 'completado':
+            time.sleep(latencia)
+        
+        # Segundos de ejecución: el servidor separa así el cálculo de la red
+        respuesta['ejecucion'] = time.perf_counter() - inicio
+        return respuesta
+    
+    def procesar_lote(self, lote):
+        """Procesa un lote completo en una sola llamada y retorna todos sus resultados"""
+        tareas = lote.get('tareas', [])
+        
+        self.log.debug("Procesando lote %s: %d tareas", lote.get('id'), len(tareas),
+                       extra={'tarea': lote.get('id')})
+        
+        inicio = time.perf_counter()
+        # Lanzar primero todo lo que va al pool de procesos para que corra en paralelo
+        futuros = {}
+        for i, tarea in enumerate(tareas):
+            if self.usa_pool_procesos(tarea.get('operacion'), tarea.get('datos', {})):
+                futuros[i] = self.pool_procesos.submit(
+                    operaciones.ejecutar, tarea.get('operacion'), tarea.get('datos', {}))
+        
+        resultados = []
+        latencia = 0.0
+        for i, tarea in enumerate(tareas):
+            if i in futuros:
+                calculo = futuros[i].result
+            else:
+                calculo = partial(operaciones.ejecutar, tarea.get('operacion'),
+                                  tarea.get('datos', {}))
+            resultados.append(self.armar_respuesta(tarea, calculo))
+            latencia += self.latencia_simulada(tarea.get('operacion'))
+        
+        # Simular tiempo de procesamiento (por defecto ninguno)
+        if latencia > 0:
+            time.sleep(latencia)
+        
+        return {
+            'id': lote.get('id'),
+            'resultados': resultados,
+            'worker': self.nombre,
+            'ejecucion': time.perf_counter() - inicio
+        }
+    
+    def textos_entrada(self, tarea_id):
+        """Genera las partes del texto de una tarea en flujo a medida que llegan"""
+        cola = self.entradas[tarea_id]
+        while True:
+            parte = cola.get()
+            if parte.get('cancelada'):
+                self.entradas.pop(tarea_id, None)
+                raise ConnectionError("El texto de la tarea no llegó completo")
+            if parte.get('texto'):
+                yield parte['texto']
+            if parte.get('fin'):
+                self.entradas.pop(tarea_id, None)
+                return
+    
+    def cerrar_entrada(self, tarea_id):
+        """Descarta lo que falte del texto de una tarea que terminó antes de
+        leerlo todo (p. ej. por un error), hasta la última parte"""
+        if tarea_id in self.entradas:
+            try:
+                for _ in self.textos_entrada(tarea_id):
+                    pass
+            except ConnectionError:
+                pass
+    
+    def cancelar_entradas(self):
+        """Sin conexión no llegan más partes: despierta a las tareas en flujo"""
+        for tarea_id, cola in list(self.entradas.items()):
+            while True:
+                try:
+                    cola.put_nowait({'id': tarea_id, 'fin': True, 'cancelada': True})
+                    break
+                except queue.Full:
+                    try:
+                        cola.get_nowait()
+                    except queue.Empty:
+                        pass
+    
+    def enviar_parte(self, tarea_id, parte):
+        """Envía al servidor una parte del resultado de una tarea en flujo"""
+        with self.lock_envio:
+            enviar_mensaje(self.sock, FRAGMENTO, {'id': tarea_id, 'parte': parte}, self.codec)
+    
+    def procesar_en_flujo(self, tarea):
+        """Procesa una tarea con el texto o el resultado en flujo: consume cada
+        parte del texto apenas llega y, si se pidió, envía cada parte del
+        resultado apenas está lista. Retorna la respuesta final"""
+        tarea_id = tarea.get('id')
+        operacion = tarea.get('operacion')
+        datos = tarea.get('datos', {})
+        salida = tarea.get('salida_flujo', False)
+        # Formato y cantidad de las partes del resultado ya enviadas
+        enviado = {'formato': None, 'partes': 0}
+        
+        def emitir(formato, partes):
+            enviado['formato'] = formato
+            for parte in partes:
+                self.enviar_parte(tarea_id, parte)
+                enviado['partes'] += 1
+        
+        def calcular():
+            if tarea.get('entrada_flujo'):
+                procesador = operaciones.procesador_en_flujo(operacion, datos)
+                acumuladas = []
+                for texto in self.textos_entrada(tarea_id):
+                    parte = procesador.alimentar(texto)
+                    if parte and salida:
+                        emitir('texto', (parte,))
+                    elif parte:
+                        acumuladas.append(parte)
+                resultado = procesador.terminar()
+                if resultado is not None:
+                    return resultado
+                if salida:
+                    enviado['formato'] = 'texto'
+                    return None
+                return ''.join(acumuladas)
+            
+            resultado = self.calcular(operacion, datos)
+            formato, partes = partir_resultado(resultado) if salida else (None, ())
+            if formato is None:
+                return resultado
+            emitir(formato, partes)
+            return None
+        
+        self.log.debug("Procesando tarea %s en flujo: %s", tarea_id, operacion,
+                       extra={'tarea': tarea_id})
+        inicio = time.perf_counter()
+        respuesta = self.armar_respuesta(tarea, calcular)
+        
+        # El resultado ya salió en partes: el cliente lo arma con el formato
+        if enviado['formato'] is not None and respuesta['estado'] == 'completado':
+            del respuesta['resultado']
+            respuesta.update(enviado)
+        respuesta['ejecucion'] = time.perf_counter() - inicio
+        return respuesta
+    
     def es_primo(self, n):
         """Verifica si un número es primo"""
-        if n < 2:
-            return False
-        if n == 2:
-            return True
-        if n % 2 == 0:
-            return False
-        
-        for i in range(3, int(math.sqrt(n)) + 1, 2):
-            if n % i == 0:
-                return False
-        return True
+        return es_primo(n)
     
     def fibonacci(self, n):
         """Calcula el n-ésimo número de Fibonacci"""
-        if n <= 0:
-            return 0
-        elif n == 1:
-            return 1
-        
-        a, b = 0, 1
-        for _ in range(2, n + 1):
-            a, b = b, a + b
-        return b
+        return fibonacci(n)
     
     def conectar(self):
         """Conecta al servidor"""
-        print(f"[{self.nombre}] Conectando a {self.host}:{self.puerto}")
+        self.log.info("Conectando a %s:%s", self.host, self.puerto)
         
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((self.host, self.puerto))
         
-        print(f"[{self.nombre}] Conectado al servidor")
+        # Anunciar capacidad (el servidor no enviará más tareas que créditos)
+        # y el registro de operaciones que sabe ejecutar
+        enviar_mensaje(self.sock, HOLA, {
+            'nombre': self.nombre,
+            'capacidad': self.capacidad,
+            'operaciones': operaciones.describir(),
+            'codecs': self.codecs
+        })
+        
+        # El servidor responde con las operaciones que conoce
+        self.lector = LectorMensajes(self.sock)
+        mensaje = self.lector.recibir()
+        if mensaje is None or mensaje[0] != HOLA:
+            raise ErrorProtocolo("El servidor no respondió el saludo")
+        
+        self.intervalo_latido = mensaje[1].get('latido')
+        self.codec = CODECS.get(mensaje[1].get('codec'), CODEC_JSON)
+        desconocidas = set(operaciones.REGISTRO) - set(mensaje[1].get('operaciones', []))
+        if desconocidas:
+            self.log.info("El servidor no tiene modelo de costo para: %s",
+                          ', '.join(sorted(desconocidas)))
+        
+        self.log.info("Conectado al servidor (capacidad %d)", self.capacidad)
+    
+    def ejecutar_y_responder(self, tipo, tarea):
+        """Procesa una tarea o lote y envía su resultado (corre en el pool, o en un
+        hilo propio si el texto llega en flujo)"""
+        if tipo == LOTE:
+            tipo_respuesta, resultado = RESULTADO_LOTE, self.procesar_lote(tarea)
+        elif tarea.get('entrada_flujo') or tarea.get('salida_flujo'):
+            tipo_respuesta, resultado = RESULTADO, self.procesar_en_flujo(tarea)
+        else:
+            tipo_respuesta, resultado = RESULTADO, self.procesar_tarea(tarea)
+        
+        try:
+            with self.lock_envio:
+                try:
+                    enviar_mensaje(self.sock, tipo_respuesta, resultado, self.codec)
+                except ErrorProtocolo as e:
+                    # El resultado no entra en el codec: se informa el error en su lugar
+                    error = {'error': str(e), 'estado': 'error', 'worker': self.nombre}
+                    if tipo == LOTE:
+                        error = {'id': tarea['id'],
+                                 'resultados': [error] * len(tarea.get('tareas', []))}
+                    else:
+                        error['id'] = tarea['id']
+                    enviar_mensaje(self.sock, tipo_respuesta, error, self.codec)
+        except OSError as e:
+            self.log.error("No se pudo enviar la tarea %s: %s", tarea['id'], e,
+                           extra={'tarea': tarea['id']})
+            return
+        
+        finally:
+            # Un error antes de la última parte: el resto del texto se descarta
+            if tarea.get('entrada_flujo'):
+                self.cerrar_entrada(tarea['id'])
+        
+        self.log.debug("Tarea %s completada", tarea['id'], extra={'tarea': tarea['id']})
+    
+    def latir(self, detener):
+        """Avisa al servidor que el worker sigue vivo aunque no termine tareas"""
+        while not detener.wait(self.intervalo_latido):
+            try:
+                with self.lock_envio:
+                    enviar_mensaje(self.sock, LATIDO, {}, self.codec)
+            except OSError:
+                break
     
     def trabajar(self):
         """Loop principal del worker"""
+        lector = self.lector
+        # Hasta `capacidad` tareas en paralelo; los resultados salen en orden de llegada
+        pool = ThreadPoolExecutor(max_workers=self.capacidad,
+                                  thread_name_prefix=self.nombre)
+        
+        detener_latidos = threading.Event()
+        if self.intervalo_latido:
+            thread = threading.Thread(target=self.latir, args=(detener_latidos,))
+            thread.daemon = True
+            thread.start()
+        
         try:
             while True:
                 # Recibir tarea del servidor
-                data = self.sock.recv(4096).decode('utf-8') # type: ignore
+                mensaje = lector.recibir()
                 
-                if not data:
-                    print(f"[{self.nombre}] Servidor desconectado")
+                if mensaje is None:
+                    self.log.info("Servidor desconectado")
                     break
                 
-                tarea = json.loads(data)
+                tipo, tarea = mensaje
+                if tipo == FRAGMENTO:
+                    # Con la cola de la tarea llena se deja de leer: el servidor se frena
+                    cola = self.entradas.get(tarea.get('id'))
+                    if cola is not None:
+                        cola.put(tarea)
+                    continue
+                if tipo not in (TAREA, LOTE):
+                    raise ErrorProtocolo(f"Tipo de mensaje inesperado: {tipo}")
                 
-                # Procesar tarea
-                resultado = self.procesar_tarea(tarea)
+                if tarea.get('entrada_flujo'):
+                    # Un hilo propio: en el pool podría esperar detrás de tareas
+                    # que a su vez esperan que este hilo lector avance
+                    self.entradas[tarea['id']] = queue.Queue(maxsize=VENTANA_FLUJO)
+                    threading.Thread(target=self.ejecutar_y_responder, args=(tipo, tarea),
+                                     daemon=True).start()
+                    continue
                 
-                # Enviar resultado
-                resultado_json = json.dumps(resultado)
-                self.sock.sendall(resultado_json.encode('utf-8')) # type: ignore
-                
-                print(f"[{self.nombre}] Tarea {tarea['id']} completada")
+                # Procesar tarea sin bloquear la lectura de las siguientes
+                pool.submit(self.ejecutar_y_responder, tipo, tarea)
         
         except Exception as e:
-            print(f"[{self.nombre}] Error: {e}")
+            self.log.error("Error: %s", e)
         
         finally:
+            detener_latidos.set()
+            self.cancelar_entradas()
+            pool.shutdown(wait=True)
+            if self.pool_procesos is not None:
+                self.pool_procesos.shutdown()
             if self.sock:
                 self.sock.close()
-            print(f"[{self.nombre}] Desconectado")
+            self.log.info("Desconectado")
     
     def iniciar(self):
         """Inicia el worker"""
@@ -186,16 +398,33 @@ class Worker:
             self.conectar()
             self.trabajar()
         except KeyboardInterrupt:
-            print(f"\n[{self.nombre}] Detenido por usuario")
+            self.log.info("Detenido por usuario")
         except Exception as e:
-            print(f"[{self.nombre}] Error: {e}")
+            self.log.error("Error: %s", e)
 
 if __name__ == '__main__':
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Worker que procesa tareas')
+    parser.add_argument('nombre', nargs='?', default=None)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--puerto', type=int, default=5001)
+    parser.add_argument('--capacidad', type=int, default=4,
+                        help='tareas en vuelo y procesadas en paralelo (créditos)')
+    parser.add_argument('--procesos', type=int, default=0,
+                        help='procesos para operaciones de CPU (0 = todo en este proceso)')
+    parser.add_argument('--latencia', action='append', default=[], metavar='OP=SEG',
+                        help="latencia simulada por operación ('*=0.1' para todas)")
+    parser.add_argument('--codec', choices=['binario', 'json'], default='binario',
+                        help="codec preferido para los mensajes ('json' para depurar)")
+    bitacora.agregar_argumentos(parser)
+    args = parser.parse_args()
+    bitacora.configurar_desde(args)
     
-    nombre = None
-    if len(sys.argv) > 1:
-        nombre = sys.argv[1]
+    for ajuste in args.latencia:
+        nombre_op, segundos = ajuste.split('=', 1)
+        operaciones.configurar_latencia(nombre_op, float(segundos))
     
-    worker = Worker(nombre=nombre)
+    worker = Worker(host=args.host, puerto=args.puerto, nombre=args.nombre,
+                    capacidad=args.capacidad, procesos=args.procesos, codec=args.codec)
     worker.iniciar()